@@ -1,8 +1,28 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response
 from functools import wraps
+import json
 import os
 from datetime import datetime, timedelta
-from face_recognition_service import face_service
+from face_loader import face_service
+from attendance_store import attendance_store, attendance_writer, normalize_record
+from face_batch import batch_extractor
+from face_jobs import FINISHED, SUCCEEDED, job_runner, job_store
+from face_metrics import face_metrics
+from student_roster import roster_store, stream_roster
+from face_stream import StreamChannel, channel_slots, encode_event
+from face_workers import PoolSaturated, detection_pool
+
+# أقصى عدد صور في طلب استخراج دفعة واحدة
+MAX_BATCH_IMAGES = int(os.environ.get('FACE_BATCH_MAX_IMAGES', 500))
+
+# الانتظار المقترح (ثوانٍ) عند امتلاء قنوات البث
+STREAM_RETRY_AFTER = 5
+
+# أنواع المحتوى المقبولة كصورة خام في جسم الطلب
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+# حقول نموذج multipart التي تحمل قيم JSON
+JSON_FORM_FIELDS = ('students',)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
@@ -114,13 +134,181 @@ def settings():
 def certificate():
     return render_template('certificate.html')
 
-@app.route('/api/students', methods=['GET'])
+@app.route('/api/students', methods=['GET', 'POST'])
 def api_students():
-    return jsonify([])
+    """
+    قائمة الطلاب مع بصماتهم ورقم إصدار للتغييرات (انظر student_roster)
+    
+    GET:
+        ?since=<version>  التغييرات فقط بعد هذا الإصدار (مع المحذوفين في 'deleted')
+        ?limit=&cursor=   ترقيم بالمؤشر (next_cursor من الصفحة السابقة)
+        If-None-Match     رد 304 بدون جسم إذا لم يتغير الإصدار (ETag)
+        
+        الرد متدفق:
+        {'success': True, 'version': int, 'since': int, 'students': [...],
+         'deleted': [معرفات], 'next_cursor': int أو null}
+        العميل يحفظ 'version' من آخر صفحة ويرسله كـ since في المرة التالية
+        
+        الأخطاء:
+            400  since أو cursor أو limit ليست أعداداً صحيحة موجبة
+            410  {'error': 'version_gone', 'version': int}: since أو cursor أحدث من
+                 إصدار القائمة (أعيد إنشاء القاعدة) فيلزم تحميل كامل من جديد
+    
+    POST:
+        {'students': [{'id': '...', ...}], 'replace': false, 'deleted': [معرفات]}
+        replace: true يعني أن القائمة كاملة فيُحذف من ليس فيها
+        {'success': True, 'version': int, 'changed': int, 'deleted': int}
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            students = data.get('students', [])
+            if not isinstance(students, list) or not isinstance(data.get('deleted', []), list):
+                return jsonify({
+                    'success': False,
+                    'message': 'قائمة الطلاب غير صالحة'
+                }), 400
+            result = roster_store.upsert(students, replace=_flag(data.get('replace')))
+            if data.get('deleted'):
+                result['deleted'] += roster_store.delete(data['deleted'])['deleted']
+                result['version'] = roster_store.version()
+            return jsonify({'success': True, **result})
+        
+        since = _int_arg('since', 0)
+        cursor = _int_arg('cursor')
+        limit = _int_arg('limit')
+        
+        snapshot = roster_store.snapshot()
+        if max(since, cursor or 0) > snapshot.version:
+            snapshot.close()
+            # القاعدة أحدث من نسخة العميل (أعيد إنشاؤها): تحميل كامل من جديد
+            return jsonify({
+                'success': False,
+                'error': 'version_gone',
+                'message': 'إصدار القائمة غير معروف، يرجى التحميل الكامل',
+                'version': snapshot.version
+            }), 410
+        
+        etag = f'roster-{snapshot.version}'
+        if request.if_none_match.contains_weak(etag):
+            snapshot.close()
+            response = Response(status=304)
+        else:
+            response = Response(stream_roster(snapshot, since, cursor, limit), mimetype='application/json')
+            response.call_on_close(snapshot.close)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Roster-Version'] = str(snapshot.version)
+        return response
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
 
-@app.route('/api/attendance', methods=['GET'])
+@app.route('/api/attendance', methods=['GET', 'POST'])
 def api_attendance():
-    return jsonify([])
+    """
+    سجلات الحضور المحفوظة على الخادم (انظر attendance_store)
+    
+    GET: ?date=YYYY-MM-DD أو date_from/date_to، stage، student_id، lecture_name،
+         limit (افتراضي 100، حد أقصى 1000)، cursor (next_cursor من الصفحة السابقة)
+        {'success': True, 'attendance': [...], 'next_cursor': int أو null}
+    
+    POST: سجل واحد أو {'records': [...]} بحقول AttendanceTB
+          (student_id, student_name, stage, date, time, lecture_name, lecturer_name, duration)
+        الكتابة مؤقتة وتتم دفعات (رد 202)؛ التاريخ YYYY-MM-DD أو DD/MM/YYYY، والسجل المكرر
+        (نفس التاريخ والمرحلة والطالب والمحاضرة) يُتجاهل، فنقل سجلات Firebase القديمة
+        من صفحة الحضور آمن عند تكراره
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            records = data.get('records') if isinstance(data.get('records'), list) else [data]
+            attendance_writer.append([normalize_record(record) for record in records])
+            return jsonify({'success': True, 'queued': len(records)}), 202
+        
+        args = request.args
+        # سجلات هذه العملية المنتظرة تُكتب أولاً حتى تظهر في النتيجة
+        attendance_writer.flush()
+        records, next_cursor = attendance_store.query(
+            date=args.get('date'),
+            date_from=args.get('date_from'),
+            date_to=args.get('date_to'),
+            stage=args.get('stage'),
+            student_id=args.get('student_id'),
+            lecture_name=args.get('lecture_name'),
+            limit=args.get('limit', 100),
+            cursor=args.get('cursor')
+        )
+        return jsonify({'success': True, 'attendance': records, 'next_cursor': next_cursor})
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
+
+
+@app.route('/api/reports', methods=['GET'])
+@app.route('/api/reports/<kind>', methods=['GET'])
+def api_reports(kind='stages'):
+    """
+    تقارير الحضور المجمّعة مسبقاً (انظر attendance_reports)
+    
+    الأنواع:
+        stages    لكل مرحلة: الطلاب، الجلسات، الحضور، النسبة
+        students  لكل طالب: الحضور، الغياب، النسبة، الاستمرارية الحالية والأفضل
+                  ?stage=&student_id=&sort=rate|present|absent|streak|name
+        days      لكل يوم ومرحلة: الجلسات، الطلاب الحاضرون والغائبون، النسبة
+                  ?stage=&date_from=&date_to=
+    
+    الترقيم: limit (افتراضي 100، حد أقصى 1000) و cursor (next_cursor من الصفحة السابقة)
+    
+    Response:
+        {'success': True, 'report': str, 'rows': [...], 'next_cursor': str أو null}
+    """
+    try:
+        args = request.args
+        filters = {
+            'students': {'stage': args.get('stage'), 'student_id': args.get('student_id'),
+                         'sort': args.get('sort', 'rate')},
+            'days': {'stage': args.get('stage'), 'date_from': args.get('date_from'),
+                     'date_to': args.get('date_to')},
+        }.get(kind, {})
+        attendance_writer.flush()
+        rows, next_cursor = attendance_store.report(
+            kind,
+            limit=args.get('limit', 100),
+            cursor=args.get('cursor'),
+            **filters
+        )
+        return jsonify({'success': True, 'report': kind, 'rows': rows, 'next_cursor': next_cursor})
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
 
 
 @app.errorhandler(404)
@@ -132,7 +320,107 @@ def internal_error(error):
     return render_template('500.html'), 500
 
 
+def _upload_buffer(upload):
+    """بايتات الملف المرفوع كـ memoryview (بدون نسخ إن كان في الذاكرة)"""
+    stream = upload.stream
+    if hasattr(stream, 'getbuffer'):
+        return stream.getbuffer()
+    return memoryview(upload.read())
+
+
+def _flag(value):
+    return value in (True, 1, 'true', 'True', '1', 'yes', 'on')
+
+
+def _int_arg(name, default=None):
+    """معامل عدد صحيح غير سالب من query string (ValueError للقيمة غير الصالحة)"""
+    value = request.args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise ValueError(f'قيمة غير صالحة لـ {name}: {value}')
+    return number
+
+
+def _positive_int(data, name, default=None):
+    """معامل عدد صحيح موجب من جسم الطلب أو query string (ValueError للقيمة غير الصالحة)"""
+    value = data.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit() \
+            or int(value) < 1:
+        raise ValueError(f'قيمة غير صالحة لـ {name}: {value}')
+    return int(value)
+
+
+def _busy_response(error):
+    """رد 429 عند امتلاء مجموعة الكشف (يحاول العميل مجدداً بعد Retry-After)"""
+    response = jsonify({
+        'success': False,
+        'error': 'busy',
+        'message': 'الخادم مشغول حالياً، يرجى المحاولة بعد قليل',
+        'retry_after': error.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def _record_attendance(result, data):
+    """
+    إضافة الطلاب المتعرف عليهم إلى مخزن الحضور (كتابة مؤقتة على دفعات)
+    معلومات المحاضرة اختيارية في الطلب: lecture_name, lecturer_name, duration, date, time
+    'record': false يعطّل التسجيل (للاختبار أو عند التسجيل من المتصفح فقط)
+    """
+    if not result.get('success') or not _flag(data.get('record', True)):
+        return
+    matches = result.get('matches') if 'matches' in result else [result]
+    context = {key: data.get(key) for key in ('lecture_name', 'lecturer_name', 'duration', 'date', 'time')}
+    try:
+        attendance_writer.append([
+            normalize_record({**context, **{key: match.get(key) for key in
+                                            ('student_id', 'student_name', 'stage', 'distance', 'similarity')}},
+                             source='face')
+            for match in matches if match.get('student_id')
+        ])
+    except ValueError as e:
+        result['attendance_error'] = str(e)
+
+
+def read_image_request():
+    """
+    قراءة الصورة ومعاملات الطلب من أي صيغة مدعومة:
+        - JSON: {'image': 'data:image/jpeg;base64,...', ...} (الصيغة القديمة)
+        - جسم ثنائي خام (image/jpeg أو image/png) والمعاملات في query string
+        - multipart/form-data: ملف 'image' والمعاملات كحقول في النموذج
+    
+    Returns:
+        (الصورة كنص base64 أو memoryview للبايتات, قاموس المعاملات)
+    """
+    mimetype = request.mimetype
+    
+    if mimetype in RAW_IMAGE_TYPES:
+        body = request.get_data(cache=False)
+        return (memoryview(body) if body else None), request.args.to_dict()
+    
+    if mimetype == 'multipart/form-data':
+        data = {**request.args.to_dict(), **request.form.to_dict()}
+        for key in JSON_FORM_FIELDS:
+            if isinstance(data.get(key), str):
+                data[key] = json.loads(data[key])
+        upload = request.files.get('image')
+        return (_upload_buffer(upload) if upload else data.get('image')), data
+    
+    data = request.get_json(silent=True) or {}
+    return data.get('image'), data
+
+
 @app.route('/api/face/extract-embedding', methods=['POST'])
+@face_metrics.instrument('extract_embedding')
 def extract_embedding():
     """
     استخراج بصمة الوجه من صورة
@@ -140,12 +428,27 @@ def extract_embedding():
     
     Request:
         {
-            'image': 'data:image/jpeg;base64,...'
+            'image': 'data:image/jpeg;base64,...',
+            'embedding_format': 'list' (افتراضي) أو 'float32' أو 'float16' أو 'int8'
         }
+    
+    أو جسم JPEG/PNG خام، أو multipart مع ملف 'image' (انظر read_image_request)
+    
+    الصيغ المضغوطة تُرجع البصمة كنص base64 (انظر face_embedding_codec)
+    ومعها 'embedding_version' لمعرفة البصمات الناتجة عن خوارزمية أقدم
     """
+    from face_embedding import EMBEDDING_VERSION
+    from face_embedding_codec import EMBEDDING_FORMATS, format_embedding
+
     try:
-        data = request.get_json()
-        image_base64 = data.get('image')
+        image_base64, data = read_image_request()
+        embedding_format = data.get('embedding_format', 'list')
+        
+        if embedding_format not in EMBEDDING_FORMATS:
+            return jsonify({
+                'success': False,
+                'message': f'صيغة بصمة غير معروفة: {embedding_format}'
+            }), 400
         
         if not image_base64:
             return jsonify({
@@ -153,9 +456,97 @@ def extract_embedding():
                 'message': 'لم يتم إرسال صورة'
             }), 400
         
-        result = face_service.extract_face_embedding(image_base64)
+        result = detection_pool.run(face_service.extract_face_embedding, image_base64)
+        if result.get('success'):
+            result['embedding'] = format_embedding(result['embedding'], embedding_format)
+            result['embedding_version'] = EMBEDDING_VERSION
         return jsonify(result)
     
+    except PoolSaturated as e:
+        return _busy_response(e)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
+
+
+@app.route('/api/face/extract-embeddings', methods=['POST'])
+@face_metrics.instrument('extract_embeddings')
+def extract_embeddings_batch():
+    """
+    استخراج بصمات عدة صور دفعة واحدة (استيراد الطلاب)
+    يتم توزيع الصور على مجموعة عمليات بحجم عدد الأنوية
+    
+    Request:
+        {
+            'images': ['data:image/jpeg;base64,...', ...]
+                      أو [{'id': '...', 'image': 'data:image/jpeg;base64,...'}, ...],
+            'stream': false,
+            'embedding_format': 'list' (افتراضي) أو 'float32' أو 'float16' أو 'int8'
+        }
+    
+    Response:
+        {
+            'success': bool,
+            'results': [
+                {'index': int, 'id': ..., 'success': bool, 'embedding': [...],
+                 'face_count': int, 'error': str أو null},
+                ...
+            ]
+        }
+    
+    مع 'stream': true يتم إرسال النتائج كسطور JSON (NDJSON) فور اكتمال كل صورة
+    
+    أو multipart مع عدة ملفات 'images' (و stream كحقل نموذج أو في query string)
+    """
+    from face_embedding import EMBEDDING_VERSION
+    from face_embedding_codec import EMBEDDING_FORMATS
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            data = {**request.args.to_dict(), **request.form.to_dict()}
+            images = [upload.read() for upload in request.files.getlist('images')]
+        else:
+            data = request.get_json(silent=True) or {}
+            images = data.get('images')
+        
+        if not images or not isinstance(images, list):
+            return jsonify({
+                'success': False,
+                'message': 'لم يتم إرسال صور'
+            }), 400
+        
+        embedding_format = data.get('embedding_format', 'list')
+        if embedding_format not in EMBEDDING_FORMATS:
+            return jsonify({
+                'success': False,
+                'message': f'صيغة بصمة غير معروفة: {embedding_format}'
+            }), 400
+        
+        if len(images) > MAX_BATCH_IMAGES:
+            return jsonify({
+                'success': False,
+                'message': f'عدد الصور أكبر من الحد المسموح ({MAX_BATCH_IMAGES})'
+            }), 413
+        
+        if _flag(data.get('stream')):
+            def generate():
+                for result in batch_extractor.extract_stream(images, embedding_format):
+                    yield json.dumps(result, ensure_ascii=False) + '\n'
+            
+            return Response(generate(), mimetype='application/x-ndjson')
+        
+        results = batch_extractor.extract(images, embedding_format)
+        return jsonify({
+            'success': True,
+            'embedding_version': EMBEDDING_VERSION,
+            'count': len(results),
+            'succeeded': sum(1 for r in results if r['success']),
+            'results': results
+        })
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -164,6 +555,7 @@ def extract_embedding():
 
 
 @app.route('/api/face/match-attendance', methods=['POST'])
+@face_metrics.instrument('match_attendance')
 def match_attendance():
     """
     مطابقة الوجه مع الطلاب لتسجيل الحضور
@@ -176,11 +568,64 @@ def match_attendance():
                 ...
             ]
         }
+    
+    'embedding' قائمة أرقام أو نص بالصيغة المضغوطة (انظر face_embedding_codec)؛
+    البصمات من إصدار أقدم للخوارزمية تُذكر في 'stale_embeddings'
+    أو 'embeddings': عدة بصمات للطالب (لقطات تسجيل مختلفة)، فتُختار قائمة مختصرة
+    بمراكز البصمات ثم تُقارن مع بصمات كل طالب فيها
+    
+    أو مع معرض مسجل مسبقاً عبر /api/face/galleries:
+        {
+            'image': 'data:image/jpeg;base64,...',
+            'gallery_id': '...'
+        }
+    
+    خيارات إضافية:
+        'metric': 'euclidean' (افتراضي) أو 'cosine'
+        'top_k': عدد المرشحين في 'candidates' (افتراضي 5، عدد صحيح موجب حتى عدد الطلاب)
+        'nprobe': عدد قوائم IVF المفحوصة للمعارض المفهرسة (عدد صحيح موجب)
+        'mode': 'single' (افتراضي، الوجه الأكبر) أو 'multi' (كل الوجوه في صورة الفصل)
+        'assignment': 'greedy' (افتراضي) أو 'optimal' لوضع 'multi'
+        'stage', 'section': البحث في طلاب المرحلة (والشعبة) أولاً، والرجوع لكل الطلاب
+                           فقط إذا لم يبلغ أقرب مرشح حد المطابقة؛ الرد يذكر 'shard'
+                           و'fallback' و'matched_in' ('shard' أو 'global')
+        'lecture_name', 'lecturer_name', 'duration', 'date', 'time': بيانات سجل الحضور
+        'record': false لعدم حفظ الطلاب المتعرف عليهم في مخزن الحضور
+    
+    يمكن أيضاً إرسال الصورة كجسم JPEG/PNG خام مع المعاملات في query string
+    (مثل ?gallery_id=...&mode=multi) أو كـ multipart (انظر read_image_request)
     """
+    from face_gallery import shard_key
+
     try:
-        data = request.get_json()
-        image_base64 = data.get('image')
+        image_base64, data = read_image_request()
+        gallery_id = data.get('gallery_id')
         students = data.get('students', [])
+        metric = data.get('metric', 'euclidean')
+        mode = data.get('mode', 'single')
+        assignment = data.get('assignment', 'greedy')
+        shard = shard_key(data.get('stage'), data.get('section'))
+        
+        try:
+            top_k = _positive_int(data, 'top_k', 5)
+            nprobe = _positive_int(data, 'nprobe')
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        if metric not in ('euclidean', 'cosine'):
+            return jsonify({
+                'success': False,
+                'message': f'مقياس غير معروف: {metric}'
+            }), 400
+        
+        if mode not in ('single', 'multi') or assignment not in ('greedy', 'optimal'):
+            return jsonify({
+                'success': False,
+                'message': 'وضع المطابقة غير معروف'
+            }), 400
         
         if not image_base64:
             return jsonify({
@@ -188,6 +633,35 @@ def match_attendance():
                 'message': 'لم يتم إرسال صورة'
             }), 400
         
+        if mode == 'multi' and gallery_id:
+            result = detection_pool.run(
+                face_service.match_faces_in_frame,
+                image_base64,
+                gallery_id=gallery_id,
+                metric=metric,
+                assignment=assignment,
+                shard=shard
+            )
+            if result.get('error') == 'gallery_not_found':
+                return jsonify(result), 404
+            _record_attendance(result, data)
+            return jsonify(result)
+        
+        if gallery_id:
+            result = detection_pool.run(
+                face_service.match_face_with_gallery,
+                image_base64,
+                gallery_id,
+                metric=metric,
+                top_k=top_k,
+                nprobe=nprobe,
+                shard=shard
+            )
+            if result.get('error') == 'gallery_not_found':
+                return jsonify(result), 404
+            _record_attendance(result, data)
+            return jsonify(result)
+        
         if not students:
             return jsonify({
                 'success': False,
@@ -195,7 +669,7 @@ def match_attendance():
             }), 400
         
         students_with_embeddings = [
-            s for s in students if s.get('embedding')
+            s for s in students if s.get('embedding') or s.get('embeddings')
         ]
         
         if not students_with_embeddings:
@@ -204,13 +678,168 @@ def match_attendance():
                 'message': 'لا توجد بيانات بصمات طلاب'
             }), 400
         
-        result = face_service.match_face_with_students(
+        if mode == 'multi':
+            result = detection_pool.run(
+                face_service.match_faces_in_frame,
+                image_base64,
+                students_with_embeddings,
+                metric=metric,
+                assignment=assignment,
+                shard=shard
+            )
+            _record_attendance(result, data)
+            return jsonify(result)
+        
+        result = detection_pool.run(
+            face_service.match_face_with_students,
             image_base64,
-            students_with_embeddings
+            students_with_embeddings,
+            metric=metric,
+            top_k=min(top_k, len(students_with_embeddings)),
+            shard=shard
         )
+        _record_attendance(result, data)
         
         return jsonify(result)
     
+    except PoolSaturated as e:
+        return _busy_response(e)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
+
+
+@app.route('/api/face/galleries', methods=['POST'])
+def register_gallery():
+    """
+    تسجيل قائمة الطلاب مرة واحدة كمعرض بصمات على الخادم
+    
+    Request:
+        {
+            'gallery_id': '...' (اختياري، يستبدل المعرض إن كان موجوداً),
+            'students': [
+                {'id': '...', 'full_name': '...', 'stage': '...', 'embedding': [...]},
+                ...
+            ],
+            'index': {'type': 'ivf', 'nlist': 256, 'nprobe': 8, 'pq_m': 0} (اختياري),
+            'storage': 'float32' (افتراضي) أو 'float16' أو 'int8'
+        }
+    
+    البصمات تُقبل كقوائم أو بالصيغة المضغوطة (نص base64)، ويمكن إرسال عدة بصمات
+    للطالب في 'embeddings' بدل 'embedding' (حتى FACE_MAX_TEMPLATES، الأحدث تبقى)
+    'stage' و'section' (اختياري) تقسم المعرض إلى أجزاء للمطابقة المحصورة بمرحلة
+    
+    Response:
+        {
+            'success': bool,
+            'gallery_id': str,
+            'version': int,
+            'size': int,
+            'skipped': [معرفات الطلاب بدون بصمة صالحة],
+            'stale_embeddings': [معرفات الطلاب ببصمات من إصدار أقدم]
+        }
+    """
+    from face_embedding_codec import DTYPES
+
+    try:
+        data = request.get_json()
+        students = data.get('students', [])
+        
+        if not isinstance(students, list):
+            return jsonify({
+                'success': False,
+                'message': 'قائمة الطلاب غير صالحة'
+            }), 400
+        
+        index = data.get('index')
+        if index and not isinstance(index, dict):
+            return jsonify({
+                'success': False,
+                'message': 'إعدادات الفهرس غير صالحة'
+            }), 400
+        if index and index.get('type', 'ivf') != 'ivf':
+            return jsonify({
+                'success': False,
+                'message': 'نوع الفهرس غير مدعوم'
+            }), 400
+        
+        storage = data.get('storage', 'float32')
+        if storage not in DTYPES:
+            return jsonify({
+                'success': False,
+                'message': f'نوع تخزين غير معروف: {storage}'
+            }), 400
+        
+        gallery, skipped = face_service.galleries.register(
+            students,
+            gallery_id=data.get('gallery_id'),
+            index=index,
+            storage=storage
+        )
+        
+        return jsonify({
+            'success': True,
+            **gallery.info(),
+            'skipped': skipped,
+            'stale_embeddings': gallery.stale_ids()
+        })
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
+
+
+@app.route('/api/face/galleries/<gallery_id>', methods=['GET', 'PATCH', 'DELETE'])
+def manage_gallery(gallery_id):
+    """
+    معلومات المعرض، التحديث التدريجي أو الحذف
+    
+    PATCH Request:
+        {
+            'upsert': [{'id': '...', 'full_name': '...', 'stage': '...', 'embedding': [...]}],
+            'remove': ['student_id', ...]
+        }
+    """
+    try:
+        if request.method == 'DELETE':
+            deleted = face_service.galleries.delete(gallery_id)
+            return jsonify({'success': deleted}), (200 if deleted else 404)
+        
+        if request.method == 'PATCH':
+            data = request.get_json()
+            gallery, skipped = face_service.galleries.update(
+                gallery_id,
+                upsert=data.get('upsert', []),
+                remove=data.get('remove', [])
+            )
+        else:
+            gallery, skipped = face_service.galleries.get(gallery_id), []
+        
+        if gallery is None:
+            return jsonify({
+                'success': False,
+                'error': 'gallery_not_found',
+                'message': 'المعرض غير مسجل'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            **gallery.info(),
+            'skipped': skipped,
+            'stale_embeddings': gallery.stale_ids()
+        })
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -219,14 +848,16 @@ def match_attendance():
 
 
 @app.route('/api/face/compare', methods=['POST'])
+@face_metrics.instrument('compare')
 def compare_embeddings():
     """
     مقارنة بصمتي وجه مباشرة
     
     Request:
         {
-            'embedding1': [...],
-            'embedding2': [...]
+            'embedding1': [...] أو نص بالصيغة المضغوطة,
+            'embedding2': [...] أو نص بالصيغة المضغوطة,
+            'metric': 'euclidean' (افتراضي) أو 'cosine'
         }
     """
     try:
@@ -240,7 +871,7 @@ def compare_embeddings():
                 'message': 'لم يتم إرسال بصمات'
             }), 400
         
-        result = face_service.compare_face_encodings(embedding1, embedding2)
+        result = face_service.compare_face_encodings(embedding1, embedding2, data.get('metric', 'euclidean'))
         return jsonify({
             'success': True,
             **result
@@ -253,6 +884,7 @@ def compare_embeddings():
         }), 500
 
 @app.route('/api/face/detect-only', methods=['POST'])
+@face_metrics.instrument('detect_only')
 def detect_faces_only():
     """
     الكشف السريع عن الوجوه بدون استخراج بصمة
@@ -260,19 +892,25 @@ def detect_faces_only():
     
     Request:
         {
-            'image': 'data:image/jpeg;base64,...'
+            'image': 'data:image/jpeg;base64,...',
+            'session_id': 'camera-1' (اختياري: تتبع الوجوه بين إطارات نفس الكاميرا),
+            'track': {...} (اختياري: قيمة 'track' من الرد السابق لنفس الجلسة)
         }
     
+    أو جسم JPEG/PNG خام، أو multipart مع ملف 'image' (انظر read_image_request)
+    
     Response:
         {
             'success': bool,
             'face_count': int,
+            'boxes': [{'x', 'y', 'w', 'h'}, ...] (بإحداثيات الصورة المرسلة),
+            'tracking': 'full' أو 'roi' (مع session_id فقط),
+            'track': {...} (مع session_id فقط),
             'message': str
         }
     """
     try:
-        data = request.get_json()
-        image_base64 = data.get('image')
+        image_base64, params = read_image_request()
         
         if not image_base64:
             return jsonify({
@@ -281,12 +919,28 @@ def detect_faces_only():
                 'message': 'لم يتم إرسال صورة'
             }), 400
         
-        result = face_service.detect_faces_only(image_base64)
-        return jsonify({
+        session_id = params.get('session_id') or None
+        track = params.get('track')
+        if isinstance(track, str):
+            try:
+                track = json.loads(track)
+            except ValueError:
+                track = None
+        
+        result = detection_pool.run(face_service.detect_faces_only, image_base64, session_id, track)
+        response = {
             'success': result['success'],
             'face_count': result.get('face_count', 0),
+            'boxes': result.get('boxes', []),
             'message': result.get('message', '')
-        })
+        }
+        if 'tracking' in result:
+            response['tracking'] = result['tracking']
+            response['track'] = result['track']
+        return jsonify(response)
+    
+    except PoolSaturated as e:
+        return _busy_response(e)
     
     except Exception as e:
         return jsonify({
@@ -296,6 +950,140 @@ def detect_faces_only():
         }), 500
 
 
+@app.route('/api/face/stream', methods=['POST'])
+def face_stream():
+    """
+    قناة بث مستمرة للحضور الحي (انظر face_stream للبروتوكول)
+    
+    Request:
+        جسم ثنائي مقطّع (Transfer-Encoding: chunked) من رسائل متتالية:
+        رسالة تحكم لربط القائمة ثم الإطارات كـ JPEG/PNG ثنائي
+        query string اختياري: gallery_id, metric, assignment
+    
+    Response:
+        application/x-ndjson: سطر JSON لكل حدث (ready, bound, frame, match, ping, end)
+    """
+    if not channel_slots.acquire(blocking=False):
+        return _busy_response(PoolSaturated(STREAM_RETRY_AFTER))
+    
+    channel = StreamChannel(face_service, detection_pool, request.stream, request.args.to_dict())
+    events = (encode_event(event) for event in channel.events())
+    response = Response(events, mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(channel_slots.release)
+    return response
+
+
+@app.route('/api/face/jobs', methods=['POST'])
+def submit_face_job():
+    """
+    إرسال مهمة وجه طويلة للتنفيذ في الخلفية (انظر face_jobs)
+    
+    Request:
+        {
+            'kind': 'extract_embeddings',
+            'images': [...], 'embedding_format': 'list'   (كما في extract-embeddings)
+        }
+        أو
+        {
+            'kind': 'build_gallery',
+            'gallery_id': '...', 'students': [...], 'index': {...}, 'storage': 'float32',
+            'embedding_format': 'list'
+        }
+        في build_gallery يمكن إرسال 'image' للطالب بدل 'embedding' فتُستخرج بصمته أولاً،
+        أو 'images' (عدة لقطات تسجيل) فتُحفظ بصماته كلها في 'embeddings'
+    
+    Response (202):
+        {'success': True, 'job_id': str, 'status': 'queued', ...}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        params = {key: value for key, value in data.items() if key != 'kind'}
+        job = job_runner.submit(data.get('kind'), params)
+        return jsonify({'success': True, **job}), 202
+    
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
+
+
+@app.route('/api/face/jobs/<job_id>', methods=['GET', 'DELETE'])
+def manage_face_job(job_id):
+    """
+    حالة المهمة وتقدمها (GET) أو إلغاؤها (DELETE)
+    
+    Response:
+        {
+            'success': True,
+            'job_id': str,
+            'kind': str,
+            'status': 'queued' | 'running' | 'succeeded' | 'failed' | 'cancelled',
+            'done': int, 'total': int, 'progress': 0..1,
+            'error': str أو null,
+            'created_at', 'started_at', 'finished_at': ثوانٍ منذ 1970
+        }
+    
+    إلغاء مهمة جارية يتم عند تحديث التقدم التالي (cancel_requested: true حتى ذلك)
+    """
+    try:
+        job_runner.start()
+        job = job_store.cancel(job_id) if request.method == 'DELETE' else job_store.get(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'message': 'المهمة غير موجودة'
+            }), 404
+        return jsonify({'success': True, **job})
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
+
+
+@app.route('/api/face/jobs/<job_id>/result', methods=['GET'])
+def face_job_result(job_id):
+    """
+    نتيجة المهمة بعد نجاحها (409 إذا لم تنتهِ بعد أو لم تنجح)
+    """
+    try:
+        job = job_store.get(job_id, with_result=True)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'message': 'المهمة غير موجودة'
+            }), 404
+        if job['status'] != SUCCEEDED:
+            job.pop('result', None)
+            message = 'المهمة لم تنتهِ بعد' if job['status'] not in FINISHED else 'المهمة لم تنجح'
+            return jsonify({'success': False, 'message': message, **job}), 409
+        return jsonify({'success': True, **job})
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'خطأ: {str(e)}'
+        }), 500
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    مقاييس خدمة الوجه بصيغة Prometheus (مجمعة من جميع عمليات gunicorn)
+    """
+    return Response(face_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     app.run(
         host='127.0.0.1',
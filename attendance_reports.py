@@ -0,0 +1,245 @@
+"""
+تجميعات تقارير الحضور - Attendance Report Rollups
+إحصاءات التقارير (الحضور والغياب والنسب والاستمرارية) محفوظة كجداول تجميع في قاعدة
+الحضور وتُحدَّث مع كل سجل جديد داخل نفس معاملة الكتابة، فلا يُعاد مسح السجلات
+عند عرض التقرير: تقرير الأسبوع 15 يكلف مثل تقرير الأسبوع الأول
+
+التعريفات:
+    جلسة     (التاريخ، المرحلة، المحاضرة) سُجل فيها حضور طالب واحد على الأقل
+    الحضور   عدد جلسات المرحلة التي حضرها الطالب
+    الغياب   جلسات المرحلة - الحضور
+    النسبة   الحضور / جلسات المرحلة
+    الاستمرارية (streak)  عدد الجلسات المتتالية التي حضرها الطالب بترتيب إنشاء الجلسات؛
+             الحالية صفر إذا غاب عن آخر جلسة للمرحلة
+    طلاب المرحلة  من سُجل لهم حضور في المرحلة مرة على الأقل
+"""
+
+# يُرفع عند تغيير الجداول أو التعريفات فيُعاد بناء التجميعات من السجلات مرة واحدة
+# (2: الاستمرارية تُعاد حسابها عند وصول سجل متأخر لجلسة سابقة)
+REPORTS_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS report_stages (
+    stage TEXT PRIMARY KEY,
+    students INTEGER NOT NULL DEFAULT 0,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS report_sessions (
+    date TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    lecture_name TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    present INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, stage, lecture_name)
+);
+CREATE TABLE IF NOT EXISTS report_days (
+    stage TEXT NOT NULL,
+    date TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0,
+    students_present INTEGER NOT NULL DEFAULT 0,
+    students_known INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stage, date)
+);
+CREATE INDEX IF NOT EXISTS report_days_date ON report_days (date);
+CREATE TABLE IF NOT EXISTS report_students (
+    stage TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    student_name TEXT NOT NULL DEFAULT '',
+    present INTEGER NOT NULL DEFAULT 0,
+    days_present INTEGER NOT NULL DEFAULT 0,
+    first_date TEXT,
+    last_date TEXT,
+    last_seq INTEGER NOT NULL DEFAULT 0,
+    streak INTEGER NOT NULL DEFAULT 0,
+    best_streak INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stage, student_id)
+);
+CREATE INDEX IF NOT EXISTS report_students_student ON report_students (student_id);
+"""
+
+ROLLUP_TABLES = ('report_stages', 'report_sessions', 'report_days', 'report_students')
+
+STUDENT_SORTS = {
+    'rate': 'rate DESC, s.present DESC',
+    'present': 's.present DESC',
+    'absent': 'absent DESC',
+    'streak': 'current_streak DESC, s.present DESC',
+    'name': 's.student_name',
+}
+
+
+def apply(db, row):
+    """
+    تحديث التجميعات بسجل حضور جديد (يُستدعى داخل معاملة الكتابة بعد إدراج السجل)
+
+    Args:
+        row: السجل كما في attendance_store.normalize_record مع 'id' بعد الإدراج
+    """
+    date, stage, student_id = row['date'], row['stage'], row['student_id']
+    lecture = row['lecture_name']
+
+    db.execute('INSERT OR IGNORE INTO report_stages (stage) VALUES (?)', (stage,))
+
+    # الجلسة: جديدة تأخذ الرقم التالي في المرحلة
+    session = db.execute(
+        'SELECT seq FROM report_sessions WHERE date = ? AND stage = ? AND lecture_name = ?',
+        (date, stage, lecture)
+    ).fetchone()
+    new_session = session is None
+    if new_session:
+        db.execute('UPDATE report_stages SET sessions = sessions + 1 WHERE stage = ?', (stage,))
+        seq = db.execute('SELECT sessions FROM report_stages WHERE stage = ?', (stage,)).fetchone()[0]
+        db.execute(
+            'INSERT INTO report_sessions (date, stage, lecture_name, seq, present) VALUES (?, ?, ?, ?, 1)',
+            (date, stage, lecture, seq)
+        )
+    else:
+        seq = session[0]
+        db.execute(
+            'UPDATE report_sessions SET present = present + 1 WHERE date = ? AND stage = ? AND lecture_name = ?',
+            (date, stage, lecture)
+        )
+
+    # الطالب
+    student = db.execute(
+        'SELECT last_date, last_seq, streak, best_streak FROM report_students WHERE stage = ? AND student_id = ?',
+        (stage, student_id)
+    ).fetchone()
+    if student is None:
+        db.execute('UPDATE report_stages SET students = students + 1 WHERE stage = ?', (stage,))
+        first_day = True
+        streak = 1
+        db.execute(
+            'INSERT INTO report_students (stage, student_id, student_name, present, days_present, first_date, '
+            'last_date, last_seq, streak, best_streak) VALUES (?, ?, ?, 1, 1, ?, ?, ?, 1, 1)',
+            (stage, student_id, row['student_name'], date, date, seq)
+        )
+    else:
+        last_date, last_seq, streak, best_streak = student
+        # أول حضور للطالب في هذا اليوم (السجلات فريدة لكل محاضرة وليس لكل يوم)
+        first_day = last_date != date and not db.execute(
+            'SELECT 1 FROM attendance WHERE date = ? AND stage = ? AND student_id = ? AND id < ? LIMIT 1',
+            (date, stage, student_id, row['id'])
+        ).fetchone()
+        if seq > last_seq:
+            streak = streak + 1 if seq == last_seq + 1 else 1
+            last_seq = seq
+            best_streak = max(best_streak, streak)
+        else:
+            # سجل متأخر لجلسة سابقة (إدخال يدوي أو نقل سجلات قديمة) قد يصل سلسلتين
+            streak, best_streak = _streaks(db, stage, student_id, row['id'])
+        db.execute(
+            'UPDATE report_students SET present = present + 1, days_present = days_present + ?, '
+            'student_name = COALESCE(NULLIF(?, \'\'), student_name), '
+            'last_date = MAX(COALESCE(last_date, \'\'), ?), first_date = MIN(COALESCE(first_date, ?), ?), '
+            'last_seq = ?, streak = ?, best_streak = ? WHERE stage = ? AND student_id = ?',
+            (int(first_day), row['student_name'], date, date, date, last_seq, streak,
+             best_streak, stage, student_id)
+        )
+
+    db.execute('UPDATE report_stages SET present = present + 1 WHERE stage = ?', (stage,))
+
+    # اليوم: عدد طلاب المرحلة يُثبت عند أول سجل في اليوم ويزيد مع الطلاب الجدد
+    known = db.execute('SELECT students FROM report_stages WHERE stage = ?', (stage,)).fetchone()[0]
+    db.execute(
+        'INSERT INTO report_days (stage, date, students_known) VALUES (?, ?, ?) '
+        'ON CONFLICT (stage, date) DO UPDATE SET students_known = MAX(students_known, excluded.students_known)',
+        (stage, date, known)
+    )
+    db.execute(
+        'UPDATE report_days SET sessions = sessions + ?, present = present + 1, '
+        'students_present = students_present + ? WHERE stage = ? AND date = ?',
+        (int(new_session), int(first_day), stage, date)
+    )
+
+
+def _streaks(db, stage, student_id, last_id):
+    """
+    الاستمرارية من جلسات الطالب في المرحلة حتى السجل last_id (rebuild يعيد السجلات
+    بالترتيب فلا تُحسب سجلات لم تُطبق بعد)
+
+    Returns:
+        (السلسلة المنتهية بآخر جلسة حضرها, أطول سلسلة)
+    """
+    seqs = [row[0] for row in db.execute(
+        'SELECT s.seq FROM attendance a JOIN report_sessions s '
+        'ON s.date = a.date AND s.stage = a.stage AND s.lecture_name = a.lecture_name '
+        'WHERE a.stage = ? AND a.student_id = ? AND a.id <= ? ORDER BY s.seq',
+        (stage, student_id, last_id)
+    )]
+    streak = best = 0
+    previous = None
+    for seq in seqs:
+        streak = streak + 1 if previous is not None and seq == previous + 1 else 1
+        best = max(best, streak)
+        previous = seq
+    return streak, best
+
+
+def rebuild(db):
+    """إعادة بناء كل التجميعات من السجلات بترتيب الإدراج (للقواعد الموجودة قبل التجميعات)"""
+    for table in ROLLUP_TABLES:
+        db.execute(f'DELETE FROM {table}')
+    count = 0
+    for row in db.execute('SELECT * FROM attendance ORDER BY id').fetchall():
+        apply(db, row)
+        count += 1
+    return count
+
+
+def _page(db, sql, params, limit, cursor):
+    """ترقيم بالإزاحة (المؤشر رقم الصف التالي كنص)"""
+    offset = int(cursor or 0)
+    rows = db.execute(f'{sql} LIMIT ? OFFSET ?', (*params, limit + 1, offset)).fetchall()
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = str(offset + limit) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def stages_report(db, limit, cursor=None):
+    return _page(db, (
+        'SELECT stage, students, sessions, present, '
+        'CASE WHEN sessions * students > 0 THEN CAST(present AS REAL) / (sessions * students) END AS rate '
+        'FROM report_stages ORDER BY stage'
+    ), (), limit, cursor)
+
+
+def students_report(db, limit, cursor=None, stage=None, student_id=None, sort='rate'):
+    conditions, params = [], []
+    if stage:
+        conditions.append('s.stage = ?')
+        params.append(stage)
+    if student_id:
+        conditions.append('s.student_id = ?')
+        params.append(student_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return _page(db, (
+        'SELECT s.stage, s.student_id, s.student_name, s.present, st.sessions - s.present AS absent, '
+        'st.sessions, s.days_present, s.first_date, s.last_date, '
+        'CASE WHEN s.last_seq = st.sessions THEN s.streak ELSE 0 END AS current_streak, s.best_streak, '
+        'CASE WHEN st.sessions > 0 THEN CAST(s.present AS REAL) / st.sessions END AS rate '
+        f'FROM report_students s JOIN report_stages st ON st.stage = s.stage {where} '
+        f'ORDER BY {STUDENT_SORTS[sort]}, s.stage, s.student_id'
+    ), params, limit, cursor)
+
+
+def days_report(db, limit, cursor=None, stage=None, date_from=None, date_to=None):
+    conditions, params = [], []
+    if stage:
+        conditions.append('stage = ?')
+        params.append(stage)
+    if date_from:
+        conditions.append('date >= ?')
+        params.append(date_from)
+    if date_to:
+        conditions.append('date <= ?')
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return _page(db, (
+        'SELECT date, stage, sessions, present, students_present, students_known, '
+        'students_known - students_present AS students_absent, '
+        'CASE WHEN students_known > 0 THEN CAST(students_present AS REAL) / students_known END AS rate '
+        f'FROM report_days {where} ORDER BY date DESC, stage'
+    ), params, limit, cursor)
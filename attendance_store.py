@@ -0,0 +1,278 @@
+"""
+مخزن الحضور على الخادم - Attendance Store
+سجلات الحضور في SQLite (WAL) بدل جلبها كلها في المتصفح
+
+- نتائج التعرف في /api/face/match-attendance والسجلات اليدوية تُضاف عبر كاتب مؤقت
+  (AttendanceWriter) يجمعها ويكتبها دفعة واحدة في معاملة واحدة كل
+  ATTENDANCE_FLUSH_MS أو عند بلوغ ATTENDANCE_BATCH_SIZE سجل، فمسح الحضور عند الجرس
+  لا يتحول إلى آلاف المعاملات ذات السطر الواحد
+- سجل واحد لكل طالب في كل محاضرة في اليوم: التكرار (نفس الطالب في إطارات متتالية)
+  يُتجاهل عند الكتابة عبر الفهرس الفريد (date, stage, student_id, lecture_name)
+- الاستعلام بترقيم الصفحات بالمؤشر (id تنازلياً) مع مرشحات التاريخ والمرحلة والطالب
+- تجميعات التقارير تُحدَّث مع كل سجل جديد في نفس المعاملة (انظر attendance_reports)
+"""
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import attendance_reports
+from face_metrics import face_metrics
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ATTENDANCE_DB = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'attendance.sqlite3'
+)
+
+BATCH_SIZE = int(os.environ.get('ATTENDANCE_BATCH_SIZE', 200))
+FLUSH_INTERVAL = float(os.environ.get('ATTENDANCE_FLUSH_MS', 500)) / 1000
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# الحقول النصية كما في AttendanceTB (firebase_init.js: addAttendance)
+TEXT_FIELDS = ('student_id', 'student_name', 'stage', 'date', 'time', 'lecture_name', 'lecturer_name', 'duration')
+COLUMNS = TEXT_FIELDS + ('source', 'distance', 'similarity', 'created_at')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attendance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_id TEXT NOT NULL,
+    student_name TEXT NOT NULL DEFAULT '',
+    stage TEXT NOT NULL DEFAULT '',
+    date TEXT NOT NULL,
+    time TEXT NOT NULL DEFAULT '',
+    lecture_name TEXT NOT NULL DEFAULT '-',
+    lecturer_name TEXT NOT NULL DEFAULT '-',
+    duration TEXT NOT NULL DEFAULT '-',
+    source TEXT NOT NULL DEFAULT 'manual',
+    distance REAL,
+    similarity REAL,
+    created_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS attendance_day ON attendance (date, stage, student_id, lecture_name);
+CREATE INDEX IF NOT EXISTS attendance_student ON attendance (student_id, date);
+"""
+
+
+def normalize_record(record, source='manual'):
+    """
+    تحويل سجل (من الطلب أو من نتيجة المطابقة) إلى صف المخزن
+    التاريخ والوقت الافتراضيان هما وقت الخادم، والتاريخ بصيغة DD/MM/YYYY (سجلات
+    Firebase القديمة) يُحوَّل إلى YYYY-MM-DD حتى يعمل فهرس التكرار على السجلين
+    """
+    if not isinstance(record, dict) or not record.get('student_id'):
+        raise ValueError('سجل الحضور يحتاج student_id')
+    now = datetime.now()
+    row = {
+        'student_id': str(record['student_id']),
+        'student_name': str(record.get('student_name') or ''),
+        'stage': str(record.get('stage') or ''),
+        'date': str(record.get('date') or now.strftime('%Y-%m-%d')),
+        'time': str(record.get('time') or now.strftime('%H:%M:%S')),
+        'lecture_name': str(record.get('lecture_name') or '-'),
+        'lecturer_name': str(record.get('lecturer_name') or '-'),
+        'duration': str(record.get('duration') or '-'),
+        'source': record.get('source') or source,
+        'distance': record.get('distance'),
+        'similarity': record.get('similarity'),
+        'created_at': time.time(),
+    }
+    row['date'] = _parse_date(row['date'])
+    return row
+
+
+def _parse_date(value):
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    raise ValueError(f"تاريخ غير صالح: {value} (الصيغة YYYY-MM-DD)")
+
+
+class AttendanceStore(SQLiteStore):
+    """سجلات الحضور وتجميعات التقارير، والكتابة دفعات داخل BEGIN IMMEDIATE"""
+
+    SCHEMA = SCHEMA + attendance_reports.SCHEMA
+
+    def __init__(self, path=None):
+        super().__init__(path or os.environ.get('ATTENDANCE_DB', DEFAULT_ATTENDANCE_DB))
+
+    def _prepare(self, connection):
+        super()._prepare(connection)
+        with self._transaction() as db:
+            if db.execute('PRAGMA user_version').fetchone()[0] < attendance_reports.REPORTS_VERSION:
+                count = attendance_reports.rebuild(db)
+                db.execute(f'PRAGMA user_version = {attendance_reports.REPORTS_VERSION}')
+                logger.info(f"✓ إعادة بناء تجميعات التقارير من {count} سجل")
+
+    def insert_many(self, rows):
+        """
+        كتابة دفعة سجلات في معاملة واحدة (التكرار يُتجاهل)
+
+        Returns:
+            عدد السجلات الجديدة
+        """
+        if not rows:
+            return 0
+        sql = (
+            f"INSERT INTO attendance ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+            "ON CONFLICT (date, stage, student_id, lecture_name) DO NOTHING"
+        )
+        written = 0
+        with self._transaction() as db:
+            for row in rows:
+                cursor = db.execute(sql, tuple(row[column] for column in COLUMNS))
+                if cursor.rowcount:
+                    attendance_reports.apply(db, {**row, 'id': cursor.lastrowid})
+                    written += 1
+        return written
+
+    def query(self, date=None, date_from=None, date_to=None, stage=None, student_id=None,
+              lecture_name=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+        """
+        صفحة من السجلات الأحدث أولاً
+
+        Args:
+            cursor: next_cursor من الصفحة السابقة
+
+        Returns:
+            (السجلات, next_cursor أو None عند آخر صفحة)
+        """
+        conditions, params = [], []
+        if date:
+            conditions.append('date = ?')
+            params.append(date)
+        if date_from:
+            conditions.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('date <= ?')
+            params.append(date_to)
+        for column, value in (('stage', stage), ('student_id', student_id), ('lecture_name', lecture_name)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if cursor:
+            conditions.append('id < ?')
+            params.append(int(cursor))
+
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self._connect().execute(
+            f'SELECT * FROM attendance {where} ORDER BY id DESC LIMIT ?', (*params, limit + 1)
+        ).fetchall()
+
+        records = [dict(row) for row in rows[:limit]]
+        next_cursor = records[-1]['id'] if len(rows) > limit else None
+        return records, next_cursor
+
+    def report(self, kind, limit=DEFAULT_PAGE_SIZE, cursor=None, **filters):
+        """
+        صفحة من تقرير مجمّع: 'stages' أو 'students' أو 'days' (انظر attendance_reports)
+
+        Returns:
+            (الصفوف, next_cursor أو None)
+        """
+        reports = {
+            'stages': attendance_reports.stages_report,
+            'students': attendance_reports.students_report,
+            'days': attendance_reports.days_report,
+        }
+        if kind not in reports:
+            raise ValueError(f'تقرير غير معروف: {kind}')
+        if kind == 'students' and filters.get('sort', 'rate') not in attendance_reports.STUDENT_SORTS:
+            raise ValueError(f"ترتيب غير معروف: {filters['sort']}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        return reports[kind](self._connect(), limit, cursor, **filters)
+
+
+class AttendanceWriter:
+    """
+    كاتب مؤقت: append يضيف للذاكرة ويعود فوراً، وخيط خلفي يكتب الدفعة
+    (خيط لكل عملية، يبدأ عند أول إضافة)
+    """
+
+    def __init__(self, store, batch_size=None, flush_interval=None):
+        self.store = store
+        self.batch_size = batch_size or BATCH_SIZE
+        self.flush_interval = FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def _start(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='attendance-writer', daemon=True)
+            self._thread.start()
+
+    def append(self, rows):
+        if not rows:
+            return
+        with self._cond:
+            self._start()
+            self._pending.extend(rows)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            rows, self._pending = self._pending, []
+        return rows
+
+    def flush(self):
+        """كتابة كل السجلات المنتظرة الآن (قبل الاستعلام وعند الإغلاق)"""
+        with self._flush_lock:
+            rows = self._take()
+            if not rows:
+                return 0
+            start = time.perf_counter()
+            try:
+                written = self.store.insert_many(rows)
+            except sqlite3.Error as e:
+                logger.error(f"تعذر كتابة {len(rows)} سجل حضور: {e}")
+                face_metrics.error(e)
+                with self._cond:
+                    # إعادة السجلات لمحاولة لاحقة
+                    self._pending[:0] = rows
+                return 0
+            face_metrics.inc('attendance_records_total', written, result='written', endpoint='attendance_writer')
+            face_metrics.inc('attendance_records_total', len(rows) - written, result='duplicate',
+                             endpoint='attendance_writer')
+            face_metrics.observe('face_stage_seconds', time.perf_counter() - start, stage='attendance_batch',
+                                 endpoint='attendance_writer')
+            face_metrics.maybe_flush()
+            return written
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # انتظار اكتمال الدفعة أو انتهاء المهلة من أول سجل منتظر
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"خطأ في كاتب الحضور: {e}")
+                time.sleep(self.flush_interval)
+
+
+attendance_store = AttendanceStore()
+attendance_writer = AttendanceWriter(attendance_store)
@@ -0,0 +1,75 @@
+"""
+قياس سرعة نواة البصمة: التنفيذ السابق مقابل النواة المتجهة (وجه واحد ودفعة)
+
+الاستخدام:
+    python benchmarks/bench_face_embedding.py
+    python benchmarks/bench_face_embedding.py --faces 256 --batch 32 --repeat 5 --json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from face_embedding import embed_face, embed_faces, resize_face  # noqa: E402
+from test_embedding_parity import _random_faces, legacy_face_embedding  # noqa: E402
+
+
+def per_face_us(fn, faces, repeat):
+    """متوسط الزمن لكل وجه (ميكروثانية)، أفضل قيمة من عدة تكرارات"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(faces)
+        samples.append((time.perf_counter() - start) * 1e6 / len(faces))
+    return min(samples), statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس سرعة نواة البصمة')
+    parser.add_argument('--faces', type=int, default=256)
+    parser.add_argument('--batch', type=int, default=32, help='حجم الدفعة للنواة الدفعية')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='طباعة النتائج بصيغة JSON')
+    args = parser.parse_args()
+
+    faces = _random_faces(args.faces)
+    resized = np.stack([resize_face(face) for face in faces])
+
+    def batched(items):
+        for start in range(0, len(items), args.batch):
+            embed_faces(np.stack([resize_face(face) for face in items[start:start + args.batch]]))
+
+    paths = {
+        'legacy': lambda items: [legacy_face_embedding(face) for face in items],
+        'vectorized': lambda items: [embed_face(face).tolist() for face in items],
+        f'batch_{args.batch}': batched,
+        'batch_kernel_only': lambda items: embed_faces(resized),
+    }
+
+    results = []
+    for name, fn in paths.items():
+        best, median = per_face_us(fn, faces, args.repeat)
+        results.append({'path': name, 'best_us_per_face': best, 'median_us_per_face': median})
+
+    legacy = results[0]['best_us_per_face']
+    for row in results:
+        row['speedup'] = legacy / row['best_us_per_face']
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'path':>18} {'best us/face':>13} {'median':>10} {'speedup':>8}")
+    for row in results:
+        print(f"{row['path']:>18} {row['best_us_per_face']:>13.1f} {row['median_us_per_face']:>10.1f} {row['speedup']:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+قياس مسار رفع الصور: Base64 داخل JSON مقابل الرفع الثنائي المباشر
+يقيس حجم البيانات المرسلة وزمن فك الترميز وحجم الصورة الناتجة لكل مسار
+
+الاستخدام:
+    python benchmarks/bench_image_decode.py
+    python benchmarks/bench_image_decode.py --sizes 640x480 1280x720 --repeat 200 --json
+"""
+
+import argparse
+import base64
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from face_recognition_service import FaceRecognitionService  # noqa: E402
+
+
+def synthetic_frame(width, height, seed=0):
+    """إطار اصطناعي ثابت (تدرجات + ضوضاء) يشبه إطار كاميرا من حيث قابلية الضغط"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        (x * 255 // max(1, width - 1)),
+        (y * 255 // max(1, height - 1)),
+        ((x + y) * 127 // max(1, width + height - 2)),
+    ], axis=-1).astype(np.int16)
+    noise = rng.integers(-20, 20, size=base.shape, dtype=np.int16)
+    frame = np.clip(base + noise, 0, 255).astype(np.uint8)
+    cv2.ellipse(frame, (width // 2, height // 2), (width // 6, height // 4), 0, 0, 360, (150, 170, 200), -1)
+    return frame
+
+
+def legacy_decode(image_base64):
+    """المسار القديم: split + b64decode + PIL + np.array + cvtColor"""
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]
+    image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+    image_np = np.array(image)
+    return cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+
+
+def timed(fn, arg, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': statistics.median(samples),
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        'mean_ms': statistics.fmean(samples),
+    }
+
+
+def run(sizes, repeat, quality):
+    results = []
+    for width, height in sizes:
+        frame = synthetic_frame(width, height)
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        jpeg = encoded.tobytes()
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg).decode('ascii')
+        json_body = json.dumps({'image': data_url}).encode('utf-8')
+
+        # التحقق من تطابق البكسلات بين المسارات
+        same = np.array_equal(
+            legacy_decode(data_url),
+            FaceRecognitionService.load_image_from_base64(memoryview(jpeg))
+        )
+
+        paths = {
+            'json_base64_legacy': (lambda body: legacy_decode(json.loads(body)['image']), json_body),
+            'json_base64': (lambda body: FaceRecognitionService.load_image_from_base64(json.loads(body)['image']), json_body),
+            'binary': (lambda body: FaceRecognitionService.load_image_from_base64(memoryview(body)), jpeg),
+            # مسار الكشف فقط: فك ترميز رمادي مصغّر (عرض 800)
+            'binary_gray_reduced': (lambda body: FaceRecognitionService.load_gray_image(memoryview(body), 800), jpeg),
+        }
+        for name, (fn, body) in paths.items():
+            decoded = fn(body)
+            results.append({
+                'size': f'{width}x{height}',
+                'path': name,
+                'bytes_in': len(body),
+                'decoded_bytes': int(decoded.nbytes),
+                'pixels_identical': same,
+                **timed(fn, body, repeat),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس Base64 JSON مقابل الرفع الثنائي')
+    parser.add_argument('--sizes', nargs='+', default=['640x480', '1280x720', '1920x1080'])
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--quality', type=int, default=80)
+    parser.add_argument('--json', action='store_true', help='طباعة النتائج بصيغة JSON')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.lower().split('x')) for size in args.sizes]
+    results = run(sizes, args.repeat, args.quality)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'size':>10} {'path':>20} {'bytes_in':>10} {'decoded':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in results:
+        print(f"{row['size']:>10} {row['path']:>20} {row['bytes_in']:>10} {row['decoded_bytes']:>10} "
+              f"{row['p50_ms']:>8.3f} {row['p99_ms']:>8.3f}")
+    print(f"pixels identical across paths: {all(r['pixels_identical'] for r in results)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+قياس تجميع طلبات المطابقة المتزامنة (micro-batching)
+عدة خيوط تحاكي أجهزة الحضور: زمن "استخراج بصمة" ثم بحث في نفس المعرض
+يقارن بدون تجميع (نافذة 0) مع نوافذ مختلفة ويعرض كفاءة التجميع
+
+الاستخدام:
+    python benchmarks/bench_match_batching.py
+    python benchmarks/bench_match_batching.py --gallery 20000 --threads 16 --windows 0 2 5 10 --json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from face_batching import MatchBatcher  # noqa: E402
+from face_gallery import FaceGallery  # noqa: E402
+from face_matcher import FaceMatcher  # noqa: E402
+
+
+def build_gallery(size, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    gallery = FaceGallery('bench', dim=dim, capacity=size)
+    gallery.upsert([
+        {'id': str(i), 'full_name': f'student {i}', 'embedding': row.tolist()}
+        for i, row in enumerate(rng.normal(size=(size, dim)).astype(np.float32))
+    ])
+    return gallery
+
+
+def run_window(gallery, window_ms, threads, requests, embed_ms, max_batch, k):
+    batcher = MatchBatcher(window_ms=window_ms, max_batch=max_batch)
+    matcher = FaceMatcher('euclidean')
+    rng = np.random.default_rng(1)
+    queries = rng.normal(size=(threads, requests, gallery.matrix.shape[1])).astype(np.float32)
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(t):
+        samples = []
+        barrier.wait()
+        for r in range(requests):
+            start = time.perf_counter()
+            with batcher.request():
+                # محاكاة فك الترميز والكشف (OpenCV يحرر الـ GIL)
+                time.sleep(embed_ms / 1000.0)
+                batcher.search(gallery, queries[t, r], matcher, k=k)
+            samples.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(samples)
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    stats = batcher.stats()
+    return {
+        'window_ms': window_ms,
+        'requests': len(latencies),
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'batches': stats['batches'],
+        'efficiency': stats['efficiency'],
+        'avg_wait_ms': stats['avg_wait_ms'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس تجميع طلبات المطابقة')
+    parser.add_argument('--gallery', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50, help='طلبات لكل خيط')
+    parser.add_argument('--embed-ms', type=float, default=5.0)
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 2, 5, 10])
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='طباعة النتائج بصيغة JSON')
+    args = parser.parse_args()
+
+    gallery = build_gallery(args.gallery)
+    results = [
+        run_window(gallery, window, args.threads, args.requests, args.embed_ms, args.max_batch, args.k)
+        for window in args.windows
+    ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'window':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'batches':>8} {'req/batch':>10} {'wait ms':>8}")
+    for row in results:
+        print(f"{row['window_ms']:>7.1f} {row['throughput_rps']:>9.1f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+              f"{row['batches']:>8} {row['efficiency'] or 0:>10.2f} {row['avg_wait_ms'] or 0:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
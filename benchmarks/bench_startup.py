@@ -0,0 +1,195 @@
+"""
+قياس بدء تشغيل gunicorn في أوضاع تحميل نظام الوجه (FACE_LOAD)
+
+لكل وضع يُشغَّل gunicorn بنفس إعدادات Procfile (عدد العمليات والخيوط قابل للتعديل)
+على منفذ حر، ويُقاس:
+    - الزمن حتى أول استجابة 200 لصفحة /login
+    - زمن أول طلب وجه (detect-only) على خيوط الكشف: دفعة طلبات متزامنة بعدد الخيوط
+      حتى يصل كل منها لخيط كشف مختلف (الكاشفات نسخة لكل خيط، فخيط لم يُسخَّن يدفع
+      تحميل ملفات الكاشف)، بالأسوأ والوسيط، ثم زمن طلب تالٍ
+    - ذاكرة كل عملية عاملة: RSS و PSS (PSS يقسم الصفحات المشتركة بين العمليات، فيُظهر
+      فائدة copy-on-write في وضع preload) من /proc، بعد الطلبات وبعد انتهاء التسخين
+
+الاستخدام:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --modes lazy preload --workers 4 --json
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthetic_faces import synthetic_face  # noqa: E402
+
+MODES = ('eager', 'lazy', 'preload')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def live_frame():
+    frame = np.full((480, 640, 3), 200, np.uint8)
+    frame[100:260, 200:360] = synthetic_face(seed=0, size=160)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.tobytes()).decode('ascii')
+
+
+def request(url, body=None, timeout=60):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'} if data else {})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        response.read()
+        return response.status, (time.perf_counter() - start) * 1000
+
+
+def wait_ready(url, process, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn توقف (رمز {process.returncode})')
+        try:
+            if request(url, timeout=2)[0] == 200:
+                return
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.01)
+    raise RuntimeError('انتهت المهلة قبل أول استجابة')
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = Path(f'/proc/{entry}/stat').read_text()
+        except OSError:
+            continue
+        # الحقل الرابع بعد اسم العملية (بين أقواس) هو ppid
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def memory(pid):
+    """RSS و PSS بالميجابايت (PSS من smaps_rollup إن توفر)"""
+    values = {}
+    try:
+        for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+            if line.startswith('VmRSS:'):
+                values['rss_mb'] = int(line.split()[1]) / 1024
+        for line in Path(f'/proc/{pid}/smaps_rollup').read_text().splitlines():
+            if line.startswith('Pss:'):
+                values['pss_mb'] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return values
+
+
+def worker_memory(master_pid):
+    workers = [memory(pid) for pid in _children(master_pid)]
+    row = {'workers': len(workers)}
+    for key in ('rss_mb', 'pss_mb'):
+        samples = [w[key] for w in workers if key in w]
+        if samples:
+            row[f'{key}_per_worker'] = sum(samples) / len(samples)
+            row[f'{key}_total'] = sum(samples)
+    master = memory(master_pid)
+    row['master_rss_mb'] = master.get('rss_mb')
+    return row
+
+
+def run_mode(mode, args, frame):
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, FACE_LOAD=mode,
+               FACE_METRICS_DIR=tempfile.mkdtemp(prefix='face_startup_metrics_'),
+               FACE_GALLERY_DIR=tempfile.mkdtemp(prefix='face_startup_galleries_'))
+    if args.warmup is not None:
+        env['FACE_WARMUP'] = '1' if args.warmup else '0'
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', 'app:app',
+               '--workers', str(args.workers), '--worker-class', 'gthread', '--threads', str(args.threads),
+               '--log-level', 'warning']
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(f'{base}/login', process, args.timeout)
+        row = {'mode': mode, 'first_response_ms': (time.perf_counter() - start) * 1000}
+        # انتظار بدء كل العمليات قبل قياس أول طلب وجه
+        time.sleep(args.settle)
+        row['memory_idle'] = worker_memory(process.pid)
+
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            first = [ms for _, ms in executor.map(
+                lambda _: request(f'{base}/api/face/detect-only', {'image': frame}), range(args.threads)
+            )]
+        row['first_face_request_ms'] = max(first)
+        row['first_face_request_median_ms'] = statistics.median(first)
+        _, row['second_face_request_ms'] = request(f'{base}/api/face/detect-only', {'image': frame})
+        # توزيع طلبات على كل العمليات (gunicorn لا يضمن عملية بعينها)
+        for _ in range(args.workers * 4):
+            request(f'{base}/api/face/detect-only', {'image': frame})
+        row['memory_after_face'] = worker_memory(process.pid)
+        return row
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس زمن بدء gunicorn وذاكرة العمليات لكل وضع FACE_LOAD')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--settle', type=float, default=3.0, help='ثوانٍ قبل قياس الذاكرة وأول طلب وجه')
+    parser.add_argument('--warmup', type=int, choices=[0, 1], help='فرض FACE_WARMUP (افتراضياً حسب الوضع)')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    frame = live_frame()
+    report = [run_mode(mode, args, frame) for mode in args.modes]
+
+    if args.json:
+        print(json.dumps({'workers': args.workers, 'threads': args.threads, 'results': report}, indent=2))
+        return
+
+    print(f"{args.workers} عمليات x {args.threads} خيوط")
+    print(f"{'mode':>8} {'first 200':>10} {'1st max':>9} {'1st med':>9} {'2nd face':>9} "
+          f"{'RSS/w idle':>11} {'PSS/w idle':>11} {'RSS/w face':>11} {'PSS/w face':>11}")
+    for row in report:
+        idle, face = row['memory_idle'], row['memory_after_face']
+        fmt = lambda v: f"{v:>8.1f} MB" if v is not None else f"{'-':>11}"  # noqa: E731
+        print(f"{row['mode']:>8} {row['first_response_ms']:>7.0f} ms {row['first_face_request_ms']:>6.0f} ms "
+              f"{row['first_face_request_median_ms']:>6.0f} ms {row['second_face_request_ms']:>6.0f} ms "
+              f"{fmt(idle.get('rss_mb_per_worker'))} {fmt(idle.get('pss_mb_per_worker'))} "
+              f"{fmt(face.get('rss_mb_per_worker'))} {fmt(face.get('pss_mb_per_worker'))}")
+
+
+if __name__ == '__main__':
+    main()
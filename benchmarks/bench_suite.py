@@ -0,0 +1,258 @@
+"""
+مجموعة قياس قابلة للتكرار لخدمة الوجه ومسارات Flask
+
+- صور وجوه اصطناعية ثابتة (benchmarks/synthetic_faces.py) ومعارض بصمات بأحجام
+  100 و 1k و 10k و 100k (بذرة ثابتة، وبصمة الوجه المختبر في منتصف المعرض)
+- لكل حالة: الإنتاجية (عملية/ثانية بخيط واحد) و p50/p99، مباشرة على الخدمة
+  وعبر Flask test client
+- ذاكرة النتائج (face_cache) معطلة حتى يُقاس المسار الكامل في كل تكرار
+- النتائج JSON، ووضع --compare يعلّم التراجع مقارنة بنتيجة محفوظة
+  (رمز خروج 1 عند وجود تراجع)
+
+الاستخدام:
+    python benchmarks/bench_suite.py --output baseline.json
+    python benchmarks/bench_suite.py --output current.json --compare baseline.json
+    python benchmarks/bench_suite.py --galleries 100 1000 --iterations 10 --only direct/match
+"""
+
+import argparse
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# المقاييس والمعارض في مجلد مؤقت بدلاً من instance/
+os.environ.setdefault('FACE_METRICS_DIR', tempfile.mkdtemp(prefix='face_bench_metrics_'))
+os.environ.setdefault('FACE_GALLERY_DIR', tempfile.mkdtemp(prefix='face_bench_galleries_'))
+os.environ['FACE_CACHE_MAX_MB'] = '0'
+
+import cv2  # noqa: E402
+
+from face_embedding_codec import format_embedding  # noqa: E402
+from synthetic_faces import synthetic_face  # noqa: E402
+
+DEFAULT_GALLERIES = (100, 1000, 10000, 100000)
+
+# نسبة التراجع المسموحة قبل التعليم (p99 أكثر تذبذباً فحدّه ضعف الحد)
+DEFAULT_THRESHOLD = 0.2
+
+# أقل عدد عينات ليكون p99 ذا معنى (مع عينات أقل هو أكبر قيمة فقط)
+MIN_P99_SAMPLES = 20
+
+
+def data_url(image):
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.tobytes()).decode('ascii')
+
+
+def build_students(size, probe_embedding, embedding_format, seed=0):
+    """معرض ثابت: بصمات عشوائية (متوسط 0، انحراف 1 مثل البصمات الحقيقية) + بصمة الوجه المختبر"""
+    rng = np.random.default_rng(seed + size)
+    matrix = rng.normal(size=(size, len(probe_embedding))).astype(np.float32)
+    matrix[size // 2] = probe_embedding
+    return [
+        {'id': f's{i}', 'full_name': f'student {i}', 'stage': 'bench',
+         'embedding': format_embedding(row, embedding_format)}
+        for i, row in enumerate(matrix)
+    ]
+
+
+def percentile(sorted_values, q):
+    """أقرب رتبة (nearest-rank)"""
+    index = max(0, min(len(sorted_values) - 1, int(np.ceil(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - start
+    samples.sort()
+    return {
+        'samples': iterations,
+        'p50_ms': percentile(samples, 50),
+        'p99_ms': percentile(samples, 99),
+        'mean_ms': float(np.mean(samples)),
+        'throughput_per_s': iterations / total if total else None,
+    }
+
+
+def _checked(result):
+    """التأكد من أن الحالة تقيس المسار الناجح وليس رسالة خطأ سريعة"""
+    if isinstance(result, dict) and not result.get('success', True):
+        raise RuntimeError(f"نتيجة غير ناجحة: {result.get('message')}")
+    return result
+
+
+def _checked_response(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return _checked(response.get_json())
+
+
+def build_cases(args):
+    """الحالات: (الاسم, الدالة, عدد التكرارات)"""
+    from app import app
+    from face_recognition_service import face_service
+
+    face = synthetic_face(seed=1, size=480)
+    image = data_url(face)
+    # إطار كاميرا 640x480 بوجه واحد (بذرة وحجم يكشفهما ملف الكشف الحي)
+    frame = np.full((480, 640, 3), 200, np.uint8)
+    frame[100:260, 200:360] = synthetic_face(seed=0, size=160)
+    live_frame = data_url(frame)
+    crop = face[60:420, 60:420]
+
+    probe = face_service.extract_face_embedding(image)
+    if not probe.get('success'):
+        raise SystemExit('الوجه الاصطناعي لم يُكشف، لا يمكن بناء المعارض')
+    probe_embedding = np.asarray(probe['embedding'], dtype=np.float32)
+
+    client = app.test_client()
+    cases = [
+        ('direct/load_image_from_base64', lambda: face_service.load_image_from_base64(image), args.iterations),
+        ('direct/_compute_face_embedding', lambda: face_service._compute_face_embedding(crop), args.iterations),
+        ('direct/extract_face_embedding', lambda: _checked(face_service.extract_face_embedding(image)), args.iterations),
+        ('direct/detect_faces_only', lambda: face_service.detect_faces_only(live_frame), args.iterations),
+        ('http/extract-embedding', lambda: _checked_response(
+            client.post('/api/face/extract-embedding', json={'image': image})), args.iterations),
+        ('http/detect-only', lambda: _checked_response(
+            client.post('/api/face/detect-only', json={'image': live_frame})), args.iterations),
+    ]
+
+    for size in args.galleries:
+        students = build_students(size, probe_embedding, args.embedding_format)
+        gallery_id = f'bench-{size}'
+        face_service.galleries.register(students, gallery_id=gallery_id)
+        # المعارض الكبيرة بطيئة عبر JSON: تكرارات أقل (عدد العينات مسجل في النتيجة)
+        iterations = args.iterations if size <= 10000 else max(3, args.iterations // 5)
+        body = {'image': image, 'students': students}
+
+        cases += [
+            (f'direct/match_face_with_students/{size}',
+             lambda s=students: _checked(face_service.match_face_with_students(image, s)), iterations),
+            (f'direct/match_face_with_gallery/{size}',
+             lambda g=gallery_id: _checked(face_service.match_face_with_gallery(image, g)), iterations),
+            (f'http/match-attendance/{size}',
+             lambda b=body: _checked_response(client.post('/api/face/match-attendance', json=b)), iterations),
+            (f'http/match-attendance-gallery/{size}',
+             lambda g=gallery_id: _checked_response(
+                 client.post('/api/face/match-attendance', json={'image': image, 'gallery_id': g})), iterations),
+        ]
+    return cases
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cpus': os.cpu_count(),
+        'machine': platform.machine(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Returns:
+        (صفوف المقارنة, عدد التراجعات)
+    """
+    rows, regressions = [], 0
+    for name, now in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            rows.append((name, None, None, None, 'new'))
+            continue
+        p50 = now['p50_ms'] / before['p50_ms'] if before['p50_ms'] else None
+        p99 = now['p99_ms'] / before['p99_ms'] if before['p99_ms'] else None
+        throughput = before['throughput_per_s'] / now['throughput_per_s'] if now['throughput_per_s'] else None
+        flags = []
+        if p50 and p50 > 1 + threshold:
+            flags.append('p50')
+        enough = min(now['samples'], before['samples']) >= MIN_P99_SAMPLES
+        if p99 and enough and p99 > 1 + 2 * threshold:
+            flags.append('p99')
+        if throughput and throughput > 1 + threshold:
+            flags.append('throughput')
+        regressions += bool(flags)
+        rows.append((name, p50, p99, throughput, 'REGRESSION ' + ','.join(flags) if flags else 'ok'))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مجموعة قياس خدمة الوجه')
+    parser.add_argument('--galleries', type=int, nargs='+', default=list(DEFAULT_GALLERIES))
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--embedding-format', default='list', choices=['list', 'float32', 'float16', 'int8'],
+                        help="صيغة بصمات الطلاب في الطلبات ('list' كالعملاء الحاليين)")
+    parser.add_argument('--only', nargs='+', help='تشغيل الحالات التي تبدأ بهذه الأسماء فقط')
+    parser.add_argument('--output', help='ملف JSON للنتائج')
+    parser.add_argument('--compare', help='ملف نتائج سابق للمقارنة')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='نسبة التراجع المسموحة (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+
+    results = {}
+    for name, fn, iterations in build_cases(args):
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        row = measure(fn, iterations, min(args.warmup, iterations))
+        results[name] = row
+        print(f"{name:>44} p50 {row['p50_ms']:>9.2f} ms  p99 {row['p99_ms']:>9.2f} ms  "
+              f"{row['throughput_per_s']:>8.1f}/s  (n={row['samples']})", flush=True)
+
+    report = {
+        'environment': environment(),
+        'config': {'iterations': args.iterations, 'warmup': args.warmup, 'galleries': args.galleries,
+                   'embedding_format': args.embedding_format},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = compare(report, baseline, args.threshold)
+        print(f"\nمقارنة مع {args.compare} (commit {baseline.get('environment', {}).get('commit')}), "
+              f"الحد {args.threshold:.0%}:")
+        print(f"{'case':>44} {'p50 x':>7} {'p99 x':>7} {'thr x':>7}  status")
+        for name, p50, p99, throughput, status in rows:
+            fmt = lambda v: f"{v:>7.2f}" if v is not None else f"{'-':>7}"  # noqa: E731
+            print(f"{name:>44} {fmt(p50)} {fmt(p99)} {fmt(throughput)}  {status}")
+        if regressions:
+            print(f"\n{regressions} حالة متراجعة")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
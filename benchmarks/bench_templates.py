@@ -0,0 +1,128 @@
+"""
+قياس التسجيل متعدد البصمات: الدقة وزمن البحث
+
+بصمات اصطناعية: لكل طالب مركز هوية، ولكل ظرف إضاءة إزاحة مشتركة بين الطلاب
+(الخصائص اليدوية في face_embedding تتأثر بالإضاءة) مع ضوضاء لكل لقطة.
+التسجيل بلقطة واحدة (الإضاءة 0) مقابل --templates لقطات (الإضاءات 0..T-1)،
+والاستعلامات بإضاءات عشوائية من كل --conditions (منها ما لم يُسجل)
+
+الطرق المقارنة:
+    single       بصمة واحدة لكل طالب (الوضع السابق)
+    centroid     مركز البصمات فقط
+    brute        كل البصمات في المصفوفة (O(الطلاب × البصمات))
+    two_stage    المراكز ثم أقرب بصمة أو مركز للقائمة المختصرة (FaceGallery مع 'embeddings')
+
+الاستخدام:
+    python benchmarks/bench_templates.py
+    python benchmarks/bench_templates.py --students 20000 --templates 3 --shortlist 10 20 50 --json
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import face_matcher  # noqa: E402
+from face_gallery import FaceGallery  # noqa: E402
+from face_matcher import FaceMatcher  # noqa: E402
+
+
+def synthetic_roster(students, templates, conditions, queries, dim=128, spread=3.0, lighting=35.0, noise=1.5,
+                     seed=0):
+    rng = np.random.default_rng(seed)
+    identity = rng.normal(scale=spread, size=(students, dim)).astype(np.float32)
+    shifts = rng.normal(size=(conditions, dim)).astype(np.float32)
+    shifts *= lighting / np.linalg.norm(shifts, axis=1, keepdims=True)
+
+    def shot(rows, condition):
+        return identity[rows] + shifts[condition] + rng.normal(scale=noise, size=(len(rows), dim)).astype(np.float32)
+
+    everyone = np.arange(students)
+    shots = np.stack([shot(everyone, t % conditions) for t in range(templates)], axis=1)  # (S, T, dim)
+    truth = rng.integers(0, students, queries)
+    probe_conditions = rng.integers(0, conditions, queries)
+    probes = np.stack([shot([s], c)[0] for s, c in zip(truth, probe_conditions)])
+    return shots, probes, truth
+
+
+def gallery_of(shots, multi):
+    gallery = FaceGallery('bench', dim=shots.shape[2], capacity=len(shots))
+    gallery.upsert([
+        {'id': str(i), 'full_name': f'student {i}', **({'embeddings': [t.tolist() for t in student]} if multi
+                                                        else {'embedding': student[0].tolist()})}
+        for i, student in enumerate(shots)
+    ])
+    return gallery
+
+
+def evaluate(name, search, probes, truth, threshold, repeat, row_student=None):
+    rows, distances = search(probes, 1)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for probe in probes[:200]:
+            search(probe, 5)
+    per_query = (time.perf_counter() - start) / (repeat * min(200, len(probes))) * 1000
+    predicted = rows[:, 0] if row_student is None else row_student(rows[:, 0])
+    correct = predicted == truth
+    accepted = distances[:, 0] <= threshold
+    return {
+        'method': name,
+        'rank1': float(correct.mean()),
+        'hit': float((correct & accepted).mean()),
+        'false_accept': float((~correct & accepted).mean()),
+        'ms_per_query': per_query,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس التسجيل متعدد البصمات')
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--templates', type=int, default=3, help='لقطات التسجيل لكل طالب')
+    parser.add_argument('--conditions', type=int, default=4, help='ظروف الإضاءة في الاستعلامات')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--shortlist', type=int, nargs='+', default=[face_matcher.TEMPLATE_SHORTLIST])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='طباعة النتائج بصيغة JSON')
+    args = parser.parse_args()
+
+    shots, probes, truth = synthetic_roster(args.students, args.templates, args.conditions, args.queries)
+    matcher = FaceMatcher('euclidean')
+    threshold = matcher.threshold
+
+    single = gallery_of(shots, multi=False)
+    multi = gallery_of(shots, multi=True)
+    flat = np.ascontiguousarray(shots.reshape(-1, shots.shape[2]))
+
+    report = [
+        evaluate('single', lambda q, k: single.search(q, matcher, k=k), probes, truth, threshold,
+                 args.repeat),
+        evaluate('centroid', lambda q, k: matcher.search(q, multi.matrix, k=k, sq_norms=multi.sq_norms),
+                 probes, truth, threshold, args.repeat),
+        evaluate('brute', lambda q, k: matcher.search(q, flat, k=k), probes, truth, threshold, args.repeat,
+                 row_student=lambda rows: rows // args.templates),
+    ]
+    for shortlist in args.shortlist:
+        face_matcher.TEMPLATE_SHORTLIST = shortlist
+        report.append(dict(evaluate('two_stage', lambda q, k: multi.search(q, matcher, k=k), probes, truth,
+                                    threshold, args.repeat), shortlist=shortlist))
+
+    if args.json:
+        print(json.dumps({'students': args.students, 'templates': args.templates,
+                          'conditions': args.conditions, 'threshold': threshold, 'results': report}, indent=2))
+        return
+
+    print(f"{args.students} طالب × {args.templates} لقطات، {args.conditions} إضاءات، الحد {threshold:g}")
+    print(f"{'method':>16} {'rank-1':>8} {'hit':>8} {'false acc':>10} {'ms/query':>9}")
+    for row in report:
+        name = row['method'] + (f"/{row['shortlist']}" if 'shortlist' in row else '')
+        print(f"{name:>16} {row['rank1']:>8.2%} {row['hit']:>8.2%} {row['false_accept']:>10.2%} "
+              f"{row['ms_per_query']:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""
+تحليل معرض البصمات كاملاً ومعايرة حد المطابقة على قائمة الطلاب الفعلية
+
+يحسب توزيع المسافات بين كل أزواج البصمات (N² / 2) على شكل مربعات (tiles) من
+--block صف: الذاكرة = المصفوفة (N x dim float32) + مربع واحد (block² float32) +
+مدرج تكراري ثابت الحجم، فمعرض 50 ألف طالب (1.25 مليار زوج) يعمل على جهاز واحد
+
+- أزواج المحتالين (impostor): بصمتان لطالبين مختلفين؛ منها نسبة القبول الخاطئ
+  (FAR) لكل حد، والحد الموصى به هو أكبر حد لا تتجاوز نسبته --far
+- الأزواج الحقيقية (genuine): أكثر من بصمة لنفس الطالب (نفس id مكرر في الملف)؛
+  منها نسبة الرفض الخاطئ (FRR) عند الحد الموصى به
+- أقرب محتال لكل طالب: نسبة الطلاب الذين يطابقهم طالب آخر عند الحد (خطر المطابقة
+  الخاطئة في بحث 1:N على القائمة كاملة)
+- أقرب --duplicates زوج لطالبين مختلفين: تسجيلات مكررة محتملة (نفس الشخص بمعرفين
+  أو صورة خاطئة) تُراجع قبل اعتماد الحد
+
+--write يحفظ الحد في ملف FACE_THRESHOLDS_FILE (instance/face_thresholds.json)
+الذي تحمّله الخدمة عند بدء التشغيل (face_matcher.load_thresholds)
+
+المدخلات:
+    معرض محفوظ (instance/face_galleries/<id>.npz)
+    أو JSON: قائمة طلاب [{"id", "embedding"}] أو {"students": [...]}
+    (يُقبل face_embedding بدل embedding)
+    أو --synthetic N: معرض اصطناعي للقياس
+
+الاستخدام:
+    python benchmarks/calibrate_thresholds.py instance/face_galleries/class-a.npz --far 0.001
+    python benchmarks/calibrate_thresholds.py students.json --metric cosine --far 0.0001 --write
+    python benchmarks/calibrate_thresholds.py --synthetic 50000 --templates 2 --json
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from face_embedding_codec import dequantize, stack_embeddings  # noqa: E402
+from face_gallery import EMBEDDING_DIM, FaceGallery  # noqa: E402
+from face_matcher import (  # noqa: E402
+    DEFAULT_THRESHOLDS,
+    DEFAULT_THRESHOLDS_FILE,
+    METRICS,
+    pairwise_distances,
+    squared_norms
+)
+
+DEFAULT_BLOCK = 2048
+DEFAULT_BINS = 8192
+
+
+def load_embeddings(path):
+    """
+    Returns:
+        (المعرفات لكل صف, مصفوفة float32 (N, dim))
+    """
+    if path.endswith('.npz'):
+        gallery = FaceGallery.load(path)
+        return list(gallery.ids), gallery.vectors()
+
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    students = data.get('students', []) if isinstance(data, dict) else data
+    values = [s.get('embedding', s.get('face_embedding')) for s in students]
+    kept, matrix, scales, _ = stack_embeddings(values, EMBEDDING_DIM)
+    if len(kept) < len(students):
+        print(f"تم تجاهل {len(students) - len(kept)} بصمة غير صالحة", file=sys.stderr)
+    return [str(students[i].get('id')) for i in kept], dequantize(matrix, scales)
+
+
+def synthetic_embeddings(students, templates=1, dim=EMBEDDING_DIM, spread=6.0, noise=1.4, seed=0):
+    """طلاب عشوائيون حول مراكز، ولكل طالب templates بصمات (تغير الإضاءة كضوضاء)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=spread, size=(students, dim)).astype(np.float32)
+    ids, blocks = [], []
+    for t in range(templates):
+        blocks.append(centers + rng.normal(scale=noise, size=centers.shape).astype(np.float32))
+        ids.extend(str(i) for i in range(students))
+    return ids, np.concatenate(blocks)
+
+
+def _upper_bound(matrix, metric, sq_norms):
+    """أكبر مسافة ممكنة (حد المدرج التكراري) بدون تمريرة إضافية"""
+    if metric == 'cosine':
+        return 2.0
+    # متباينة المثلث: ||a - b|| <= ||a|| + ||b||
+    return max(float(2 * np.sqrt(sq_norms.max())) if len(sq_norms) else 1.0, 1e-6)
+
+
+def analyze(ids, matrix, metric='euclidean', block=DEFAULT_BLOCK, bins=DEFAULT_BINS, duplicates=50):
+    """
+    كل أزواج البصمات على مربعات block x block (المثلث العلوي فقط)
+
+    Returns:
+        قاموس بالمدرجات التكرارية وأقرب محتال لكل صف وأقرب أزواج المحتالين
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    n = matrix.shape[0]
+    codes = np.unique(np.asarray(ids), return_inverse=True)[1].astype(np.int64).reshape(-1)
+    sq_norms = squared_norms(matrix)
+    edges = np.linspace(0.0, _upper_bound(matrix, metric, sq_norms), bins + 1)
+    scale = bins / edges[-1]
+
+    impostor = np.zeros(bins, dtype=np.int64)
+    genuine = np.zeros(bins, dtype=np.int64)
+    nearest = np.full(n, np.inf, dtype=np.float32)
+    closest = []  # كومة (-المسافة, i, j) بحجم duplicates
+
+    def accumulate(hist, values):
+        index = np.minimum((values * scale).astype(np.int64), bins - 1)
+        hist += np.bincount(index, minlength=bins)
+
+    for i0 in range(0, n, block):
+        rows = matrix[i0:i0 + block]
+        for j0 in range(i0, n, block):
+            tile = pairwise_distances(rows, matrix[j0:j0 + block], metric, sq_norms=sq_norms[j0:j0 + block])
+            same = codes[i0:i0 + len(rows), None] == codes[None, j0:j0 + tile.shape[1]]
+            pairs = np.ones(tile.shape, dtype=bool)
+            if i0 == j0:
+                # المربع القطري: كل زوج مرة واحدة وبدون البصمة مع نفسها
+                pairs = np.triu(pairs, k=1)
+            accumulate(genuine, tile[pairs & same])
+
+            # أزواج الطلاب المختلفين فقط (الأزواج الحقيقية والمثلث السفلي = ∞)
+            tile[~pairs | same] = np.inf
+            accumulate(impostor, tile[np.isfinite(tile)])
+            np.minimum(nearest[i0:i0 + len(rows)], tile.min(axis=1), out=nearest[i0:i0 + len(rows)])
+            np.minimum(nearest[j0:j0 + tile.shape[1]], tile.min(axis=0), out=nearest[j0:j0 + tile.shape[1]])
+
+            if duplicates:
+                k = min(duplicates, tile.size)
+                flat = np.argpartition(tile, k - 1, axis=None)[:k]
+                for index, distance in zip(flat.tolist(), tile.ravel()[flat].tolist()):
+                    if distance == np.inf:
+                        continue
+                    item = (-distance, i0 + index // tile.shape[1], j0 + index % tile.shape[1])
+                    if len(closest) < duplicates:
+                        heapq.heappush(closest, item)
+                    elif item > closest[0]:
+                        heapq.heapreplace(closest, item)
+
+    return {
+        'metric': metric,
+        'edges': edges,
+        'impostor': impostor,
+        'genuine': genuine,
+        'nearest': nearest,
+        'closest': sorted((-d, i, j) for d, i, j in closest),
+    }
+
+
+def threshold_at(edges, hist, far):
+    """
+    أكبر حد (حافة في المدرج) لا تتجاوز عنده نسبة الأزواج المقبولة far
+
+    Returns:
+        (الحد, النسبة الفعلية عنده)
+    """
+    total = hist.sum()
+    if not total:
+        return None, None
+    cumulative = np.cumsum(hist) / total
+    allowed = np.nonzero(cumulative <= far)[0]
+    if not allowed.size:
+        return float(edges[0]), 0.0
+    return float(edges[allowed[-1] + 1]), float(cumulative[allowed[-1]])
+
+
+def rate_at(edges, hist, threshold, above=False):
+    """نسبة المسافات <= الحد (أو > الحد مع above) بدقة المدرج"""
+    total = hist.sum()
+    if not total:
+        return None
+    below = hist[:int(np.searchsorted(edges, threshold, side='right')) - 1].sum() / total
+    return float(1 - below if above else below)
+
+
+def report(analysis, ids, fars, current):
+    edges, impostor, genuine, nearest = (analysis[key] for key in ('edges', 'impostor', 'genuine', 'nearest'))
+    students = len(set(ids))
+
+    def point(threshold):
+        return {
+            'threshold': threshold,
+            'far': rate_at(edges, impostor, threshold),
+            'frr': rate_at(edges, genuine, threshold, above=True),
+            # الطلاب الذين يقع طالب آخر ضمن الحد منهم
+            'students_with_impostor': float(np.mean(nearest[np.isfinite(nearest)] <= threshold))
+            if np.isfinite(nearest).any() else None,
+        }
+
+    recommendations = []
+    for far in fars:
+        threshold, _ = threshold_at(edges, impostor, far)
+        if threshold is not None:
+            recommendations.append({'target_far': far, **point(threshold)})
+
+    def quantiles(hist):
+        total = hist.sum()
+        if not total:
+            return None
+        cumulative = np.cumsum(hist) / total
+        return {f'p{int(q * 100)}': float(edges[min(np.searchsorted(cumulative, q) + 1, len(edges) - 1)])
+                for q in (0.01, 0.05, 0.5, 0.95, 0.99)}
+
+    return {
+        'metric': analysis['metric'],
+        'templates': len(ids),
+        'students': students,
+        'impostor_pairs': int(impostor.sum()),
+        'genuine_pairs': int(genuine.sum()),
+        'resolution': float(edges[1] - edges[0]),
+        'impostor_quantiles': quantiles(impostor),
+        'genuine_quantiles': quantiles(genuine),
+        'current': point(current),
+        'recommended': recommendations,
+        'near_duplicates': [
+            {'id1': ids[i], 'id2': ids[j], 'distance': distance, 'below_current_threshold': distance <= current}
+            for distance, i, j in analysis['closest']
+        ],
+    }
+
+
+def write_thresholds(path, metric, result, source):
+    """دمج الحد الموصى به (أول --far) في ملف الحدود مع الإبقاء على المقاييس الأخرى"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    recommended = result['recommended'][0]
+    data.setdefault('thresholds', {})[metric] = recommended['threshold']
+    data.setdefault('calibration', {})[metric] = {
+        'target_far': recommended['target_far'],
+        'far': recommended['far'],
+        'frr': recommended['frr'],
+        'students': result['students'],
+        'templates': result['templates'],
+        'source': source,
+        'created_at': time.time(),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تحليل كل أزواج المعرض ومعايرة حد المطابقة')
+    parser.add_argument('source', nargs='?', help='معرض .npz أو ملف JSON بالطلاب')
+    parser.add_argument('--synthetic', type=int, help='عدد طلاب معرض اصطناعي بدل الملف')
+    parser.add_argument('--templates', type=int, default=2, help='بصمات لكل طالب في المعرض الاصطناعي')
+    parser.add_argument('--metric', default='euclidean', choices=METRICS)
+    parser.add_argument('--far', type=float, nargs='+', default=[0.001, 0.0001],
+                        help='نسب القبول الخاطئ المستهدفة (الأولى تُحفظ مع --write)')
+    parser.add_argument('--block', type=int, default=DEFAULT_BLOCK, help='صفوف كل مربع مسافات')
+    parser.add_argument('--bins', type=int, default=DEFAULT_BINS, help='دقة المدرج التكراري')
+    parser.add_argument('--duplicates', type=int, default=20, help='عدد أقرب الأزواج المعروضة')
+    parser.add_argument('--write', nargs='?', const=os.environ.get('FACE_THRESHOLDS_FILE', DEFAULT_THRESHOLDS_FILE),
+                        help='حفظ الحد في ملف الحدود (الافتراضي FACE_THRESHOLDS_FILE)')
+    parser.add_argument('--json', action='store_true', help='طباعة النتائج بصيغة JSON')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        ids, matrix = synthetic_embeddings(args.synthetic, args.templates)
+        source = f'synthetic:{args.synthetic}x{args.templates}'
+    elif args.source:
+        ids, matrix = load_embeddings(args.source)
+        source = os.path.abspath(args.source)
+    else:
+        parser.error('يجب تحديد ملف المعرض أو --synthetic')
+    if len(ids) < 2:
+        parser.error('المعرض يحتاج بصمتين على الأقل')
+
+    start = time.perf_counter()
+    analysis = analyze(ids, matrix, args.metric, block=args.block, bins=args.bins, duplicates=args.duplicates)
+    result = report(analysis, ids, args.far, DEFAULT_THRESHOLDS[args.metric])
+    result['seconds'] = time.perf_counter() - start
+
+    if args.write:
+        if not result['recommended']:
+            parser.error('لا توجد أزواج محتالين للمعايرة')
+        write_thresholds(args.write, args.metric, result, source)
+        result['written'] = args.write
+
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        return
+
+    pct = lambda v: f"{v:.4%}" if v is not None else '-'  # noqa: E731
+    print(f"{result['students']} طالب، {result['templates']} بصمة، {args.metric}: "
+          f"{result['impostor_pairs']:,} زوج محتال و {result['genuine_pairs']:,} زوج حقيقي "
+          f"في {result['seconds']:.1f} ث (دقة الحد {result['resolution']:.4f})")
+    for name in ('impostor_quantiles', 'genuine_quantiles'):
+        if result[name]:
+            print(f"  {name}: " + ', '.join(f"{q}={v:.3f}" for q, v in result[name].items()))
+    print(f"{'threshold':>12} {'target FAR':>11} {'FAR':>10} {'FRR':>10} {'1:N risk':>10}")
+    current = result['current']
+    print(f"{current['threshold']:>12.3f} {'(current)':>11} {pct(current['far']):>10} {pct(current['frr']):>10} "
+          f"{pct(current['students_with_impostor']):>10}")
+    for row in result['recommended']:
+        print(f"{row['threshold']:>12.3f} {row['target_far']:>11g} {pct(row['far']):>10} {pct(row['frr']):>10} "
+              f"{pct(row['students_with_impostor']):>10}")
+    if result['near_duplicates']:
+        print('أقرب أزواج لطلاب مختلفين (تسجيلات مكررة محتملة):')
+        for pair in result['near_duplicates']:
+            flag = '  <= الحد الحالي' if pair['below_current_threshold'] else ''
+            print(f"  {pair['id1']} / {pair['id2']}: {pair['distance']:.3f}{flag}")
+    if args.write:
+        print(f"✓ حُفظ الحد {result['recommended'][0]['threshold']:.3f} في {args.write}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+مقارنة كاشفات الوجه: الزمن لكل صورة مقابل نسبة الكشف على مجموعة صور محلية
+
+مجموعة الصور: مجلد JPEG/PNG، ومعه اختيارياً faces.json بعدد الوجوه في كل صورة
+({"img1.jpg": 1, "class.jpg": 12}). بدونه يُفترض وجه واحد على الأقل في كل صورة.
+بدون --images تُستخدم صور اصطناعية (benchmarks/synthetic_faces.py)
+
+الكاشفات غير المتوفرة (ملف نموذج غير موجود) تظهر في التقرير مع السبب
+
+الاستخدام:
+    python benchmarks/compare_detectors.py
+    python benchmarks/compare_detectors.py --images ./photos --width 800 --repeat 3
+    python benchmarks/compare_detectors.py --models ./models --json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from face_detectors import DEFAULT_PROFILES, DetectorUnavailable, create_detector  # noqa: E402
+from synthetic_faces import synthetic_image_set  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def candidates(model_dir):
+    """الكاشفات المقارنة: ملفات الإعدادات الحالية + بدائل Haar و LBP و YuNet"""
+    lbp = os.path.join(model_dir, 'lbpcascade_frontalface_improved.xml')
+    yunet = os.path.join(model_dir, 'face_detection_yunet_2023mar.onnx')
+    return {
+        'haar/live': DEFAULT_PROFILES['live'],
+        'haar/enroll': DEFAULT_PROFILES['enroll'],
+        'haar_alt2/enroll': dict(DEFAULT_PROFILES['enroll'],
+                                 model=cv2.data.haarcascades + 'haarcascade_frontalface_alt2.xml'),
+        'lbp/live': {'backend': 'lbp', 'model': lbp, 'scaleFactor': 1.3, 'minNeighbors': 5, 'minSize': [30, 30]},
+        'lbp/enroll': {'backend': 'lbp', 'model': lbp, 'scaleFactor': 1.1, 'minNeighbors': 4,
+                       'minSize': [30, 30], 'maxSize': [400, 400]},
+        'yunet': {'backend': 'yunet', 'model': yunet, 'score_threshold': 0.8},
+    }
+
+
+def load_images(directory):
+    directory = Path(directory)
+    counts = {}
+    annotations = directory / 'faces.json'
+    if annotations.exists():
+        counts = json.loads(annotations.read_text(encoding='utf-8'))
+    images = []
+    for path in sorted(directory.iterdir()):
+        if path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        image = cv2.imread(str(path), cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append((path.name, image, counts.get(path.name)))
+    return images
+
+
+def prepare(image, width):
+    """نفس التحضير في الخدمة: تصغير للعرض المحدد، رمادي ومعادلة الهيستوجرام"""
+    if image.shape[1] > width:
+        image = cv2.resize(image, (width, int(image.shape[0] * width / image.shape[1])))
+    gray = cv2.equalizeHist(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    return image, gray
+
+
+def evaluate(detector, images, repeat):
+    times, expected_total, found_total, hits, images_hit, extra = [], 0, 0, 0, 0, 0
+    for _, (image, gray), expected in images:
+        source = image if detector.color else gray
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            faces = detector.detect(source)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+        found = len(faces)
+        found_total += found
+        images_hit += found > 0
+        if expected is not None:
+            expected_total += expected
+            hits += min(found, expected)
+            extra += max(0, found - expected)
+
+    row = {
+        'ms_p50': statistics.median(times),
+        'ms_mean': statistics.fmean(times),
+        'image_detection_rate': images_hit / len(images),
+        'faces_found': found_total,
+    }
+    if expected_total:
+        row['face_recall'] = hits / expected_total
+        row['extra_detections'] = extra
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة سرعة ونسبة كشف كاشفات الوجه')
+    parser.add_argument('--images', help='مجلد الصور (افتراضياً صور اصطناعية)')
+    parser.add_argument('--synthetic', type=int, default=40, help='عدد الصور الاصطناعية')
+    parser.add_argument('--models', default=os.environ.get('FACE_DETECTOR_MODEL_DIR', 'models'),
+                        help='مجلد نماذج LBP و YuNet')
+    parser.add_argument('--width', type=int, default=800, help='عرض الصورة قبل الكشف')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    images = load_images(args.images) if args.images else synthetic_image_set(args.synthetic)
+    if not images:
+        raise SystemExit('لا توجد صور')
+    prepared = [(name, prepare(image, args.width), expected) for name, image, expected in images]
+
+    report = []
+    for name, profile in candidates(args.models).items():
+        try:
+            detector = create_detector(profile)
+        except DetectorUnavailable as e:
+            report.append({'detector': name, 'unavailable': str(e)})
+            continue
+        report.append({'detector': name, **evaluate(detector, prepared, args.repeat)})
+
+    if args.json:
+        print(json.dumps({'images': len(images), 'width': args.width, 'results': report}, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{len(images)} صورة، عرض {args.width}")
+    print(f"{'detector':>18} {'ms p50':>8} {'ms mean':>8} {'img rate':>9} {'recall':>7} {'extra':>6}")
+    for row in report:
+        if 'unavailable' in row:
+            print(f"{row['detector']:>18}  غير متوفر: {row['unavailable']}")
+            continue
+        recall = f"{row['face_recall']:.2f}" if 'face_recall' in row else '-'
+        extra = row.get('extra_detections', '-')
+        print(f"{row['detector']:>18} {row['ms_p50']:>8.2f} {row['ms_mean']:>8.2f} "
+              f"{row['image_detection_rate']:>9.2f} {recall:>7} {extra:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+عميل محلي لقناة البث الحي: يعيد تشغيل إطارات ملف فيديو على /api/face/stream
+بمعدل الفيديو (أو --fps) ويطبع الأحداث وملخص الزمن والإطارات المُسقطة
+
+الاستخدام:
+    python benchmarks/replay_stream.py classroom.mp4
+    python benchmarks/replay_stream.py classroom.mp4 --url http://localhost:5000 --gallery-id class-a
+    python benchmarks/replay_stream.py classroom.mp4 --students roster.json --fps 10 --width 800 --quiet
+"""
+
+import argparse
+import http.client
+import json
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+import cv2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from face_stream import CONTROL, END, FRAME, encode_message  # noqa: E402
+
+
+def video_frames(path, width=None, quality=85):
+    """إطارات الفيديو كـ JPEG مع معدل الإطارات"""
+    capture = cv2.VideoCapture(str(path))
+    if not capture.isOpened():
+        raise SystemExit(f"تعذر فتح الفيديو: {path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+
+    def frames():
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                if width and frame.shape[1] > width:
+                    frame = cv2.resize(frame, (width, int(frame.shape[0] * width / frame.shape[1])))
+                ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if ok:
+                    yield buffer.tobytes()
+        finally:
+            capture.release()
+
+    return fps, frames()
+
+
+def _send_chunk(sock, data):
+    sock.sendall(b'%x\r\n' % len(data) + data + b'\r\n')
+
+
+def replay(url, frames, fps, roster=None, params=None, loops=1, on_event=None):
+    """
+    فتح قناة، إرسال الإطارات بمعدل ثابت، وجمع الأحداث
+
+    Returns:
+        (قائمة الأحداث, عدد الإطارات المرسلة, الزمن الكلي)
+    """
+    parts = urlsplit(url)
+    conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    conn = conn_class(parts.netloc, timeout=60)
+    path = (parts.path.rstrip('/') or '') + '/api/face/stream'
+    if params:
+        path += '?' + urlencode(params)
+
+    conn.putrequest('POST', path)
+    conn.putheader('Content-Type', 'application/octet-stream')
+    conn.putheader('Transfer-Encoding', 'chunked')
+    conn.endheaders()
+    # getresponse() يفصل الاتصال عن المقبس إذا كان الرد Connection: close،
+    # فالإرسال يستمر على المقبس مباشرة
+    sock = conn.sock
+
+    frames = list(frames)
+    sent = [0]
+
+    def sender():
+        try:
+            if roster is not None:
+                _send_chunk(sock, encode_message(CONTROL, roster))
+            interval = 1.0 / fps
+            next_at = time.perf_counter()
+            for _ in range(loops):
+                for frame in frames:
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    _send_chunk(sock, encode_message(FRAME, frame))
+                    sent[0] += 1
+                    next_at += interval
+            _send_chunk(sock, encode_message(END))
+            sock.sendall(b'0\r\n\r\n')
+        except OSError as e:
+            print(f"توقف الإرسال: {e}", file=sys.stderr)
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=sender, daemon=True)
+    thread.start()
+
+    response = conn.getresponse()
+    if response.status != 200:
+        raise SystemExit(f"HTTP {response.status}: {response.read().decode('utf-8', 'replace')}")
+
+    events = []
+    for line in response:
+        if not line.strip():
+            continue
+        event = json.loads(line)
+        events.append(event)
+        if on_event:
+            on_event(event)
+        if event['event'] == 'end':
+            break
+    thread.join(timeout=5)
+    conn.close()
+    return events, sent[0], time.perf_counter() - start
+
+
+def summarize(events, sent, elapsed):
+    frames = [e for e in events if e['event'] == 'frame']
+    latencies = sorted(e['latency_ms'] for e in frames)
+    end = next((e for e in events if e['event'] == 'end'), {})
+    summary = {
+        'frames_sent': sent,
+        'frames_processed': len(frames),
+        'frames_dropped': end.get('frames_dropped'),
+        'recognized': end.get('recognized', []),
+        'elapsed_s': round(elapsed, 2),
+        'processed_fps': round(len(frames) / elapsed, 2) if elapsed else None,
+    }
+    if latencies:
+        summary['latency_p50_ms'] = statistics.median(latencies)
+        summary['latency_p99_ms'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='إعادة تشغيل فيديو على قناة البث الحي')
+    parser.add_argument('video')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--fps', type=float, help='معدل الإرسال (افتراضياً معدل الفيديو)')
+    parser.add_argument('--width', type=int, default=800, help='تصغير الإطارات قبل الإرسال')
+    parser.add_argument('--gallery-id', help='معرض مسجل مسبقاً عبر /api/face/galleries')
+    parser.add_argument('--students', help='ملف JSON بقائمة الطلاب وبصماتهم')
+    parser.add_argument('--loops', type=int, default=1)
+    parser.add_argument('--quiet', action='store_true', help='عدم طباعة كل حدث')
+    parser.add_argument('--json', action='store_true', help='طباعة الملخص بصيغة JSON')
+    args = parser.parse_args()
+
+    video_fps, frames = video_frames(args.video, args.width)
+    roster = None
+    if args.students:
+        with open(args.students, encoding='utf-8') as f:
+            roster = {'students': json.load(f)}
+    params = {'gallery_id': args.gallery_id} if args.gallery_id else None
+
+    def on_event(event):
+        if not args.quiet:
+            print(json.dumps(event, ensure_ascii=False))
+
+    events, sent, elapsed = replay(args.url, frames, args.fps or video_fps, roster, params, args.loops, on_event)
+    summary = summarize(events, sent, elapsed)
+    if args.json:
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+    else:
+        for key, value in summary.items():
+            print(f"{key:>18}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+وجوه اصطناعية للقياس بدون صور حقيقية للطلاب
+رسومات بسيطة (بيضاوي الوجه، عينان وحاجبان، أنف وفم) يكشفها Haar في أغلب الأحجام،
+ومشاهد فصل بعدد وجوه معروف لقياس نسبة الكشف
+"""
+
+import cv2
+import numpy as np
+
+
+def synthetic_face(seed=0, size=240, background=200):
+    """صورة وجه واحد (size x size) BGR بملامح تختلف حسب seed"""
+    rng = np.random.default_rng(seed)
+    image = np.full((size, size, 3), background, np.uint8)
+    cx = size // 2 + int(rng.integers(-5, 5))
+    cy = size // 2 + int(rng.integers(-5, 5))
+    skin = tuple(int(v) for v in rng.integers(130, 210, 3))
+    cv2.ellipse(image, (cx, cy), (int(size * .3), int(size * .4)), 0, 0, 360, skin, -1)
+
+    eye_x, eye_y = int(size * .12), int(size * .08)
+    brow = max(2, size // 48)
+    for side in (-1, 1):
+        cv2.ellipse(image, (cx + side * eye_x, cy - eye_y), (int(size * .06), int(size * .03)),
+                    0, 0, 360, (40, 40, 40), -1)
+        cv2.line(image, (cx + side * eye_x - size // 12, cy - eye_y - size // 13),
+                 (cx + side * eye_x + size // 12, cy - eye_y - size // 13), (50, 50, 50), brow)
+    cv2.line(image, (cx, cy - eye_y), (cx, cy + int(size * .08)), (120, 130, 160), max(2, size // 60))
+    cv2.ellipse(image, (cx, cy + int(size * .18)), (int(size * .09), int(size * .03)),
+                0, 0, 360, (60, 60, 120), -1)
+    return cv2.GaussianBlur(image, (5, 5), 0)
+
+
+def synthetic_scene(seed=0, faces=3, width=1280, height=720, min_size=120, max_size=260):
+    """
+    مشهد فصل بعدد وجوه معروف في مواضع وأحجام عشوائية بدون تداخل
+
+    Returns:
+        (الصورة BGR, الصناديق [(x, y, w, h)])
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), int(rng.integers(150, 230)), np.uint8)
+    noise = rng.normal(0, 4, image.shape)
+    image = np.clip(image + noise, 0, 255).astype(np.uint8)
+
+    boxes = []
+    for i in range(faces):
+        for _ in range(50):
+            size = int(rng.integers(min_size, max_size))
+            x = int(rng.integers(0, width - size))
+            y = int(rng.integers(0, height - size))
+            if all(x + size <= bx or bx + bw <= x or y + size <= by or by + bh <= y for bx, by, bw, bh in boxes):
+                break
+        else:
+            continue
+        face = synthetic_face(seed * 1000 + i, size, background=int(image[y, x, 0]))
+        image[y:y + size, x:x + size] = face
+        boxes.append((x, y, size, size))
+    return image, boxes
+
+
+def synthetic_image_set(count=40, seed=0):
+    """
+    مجموعة صور للقياس: صور تسجيل (وجه واحد) ومشاهد فصل (2-6 وجوه)
+
+    Returns:
+        [(الاسم, الصورة BGR, عدد الوجوه)]
+    """
+    images = []
+    for i in range(count):
+        if i % 2 == 0:
+            images.append((f"enroll_{i:03d}", synthetic_face(seed + i, size=480), 1))
+        else:
+            faces = 2 + i % 5
+            image, boxes = synthetic_scene(seed + i, faces)
+            images.append((f"scene_{i:03d}", image, len(boxes)))
+    return images
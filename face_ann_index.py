@@ -0,0 +1,488 @@
+"""
+فهرس البحث التقريبي عن أقرب جار - Approximate Nearest-Neighbour Index
+فهرس IVF (مراكز خشنة بـ k-means) مع تكميم المنتج PQ اختيارياً، مكتوب بـ NumPy فقط
+يُستخدم لمعارض المؤسسة الكاملة (عشرات الآلاف من الطلاب) بدلاً من المسح الخطي
+
+مقابض الدقة/السرعة:
+    nlist  : عدد القوائم (المراكز الخشنة)
+    nprobe : عدد القوائم التي يتم فحصها لكل استعلام
+    pq_m   : عدد المقاطع الفرعية لـ PQ (0 = تخزين البصمات كاملة)
+    rerank : عدد المرشحين الذين يُعاد حساب مسافتهم بدقة عند استخدام PQ
+
+تقرير الدقة مقابل البحث الكامل:
+    python face_ann_index.py --size 50000 --queries 200 --k 10
+"""
+
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+
+from face_matcher import pairwise_distances, squared_norms, top_k
+
+logger = logging.getLogger(__name__)
+
+
+def kmeans(data, k, iterations=20, seed=0, max_samples=None):
+    """
+    تجميع k-means بسيط (تهيئة k-means++ على عينة ثم تكرارات Lloyd)
+
+    Returns:
+        المراكز (k, dim) float32
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if max_samples and data.shape[0] > max_samples:
+        data = data[rng.choice(data.shape[0], max_samples, replace=False)]
+
+    n = data.shape[0]
+    k = max(1, min(k, n))
+
+    # k-means++
+    centroids = np.empty((k, data.shape[1]), dtype=np.float32)
+    centroids[0] = data[rng.integers(n)]
+    closest = pairwise_distances(centroids[:1], data)[0] ** 2
+    for i in range(1, k):
+        total = float(closest.sum())
+        if total <= 0:
+            centroids[i:] = data[rng.choice(n, k - i)]
+            break
+        centroids[i] = data[rng.choice(n, p=closest / total)]
+        np.minimum(closest, pairwise_distances(centroids[i:i + 1], data)[0] ** 2, out=closest)
+
+    data_sq = squared_norms(data)
+    for _ in range(iterations):
+        assign = np.argmin(pairwise_distances(data, centroids, sq_norms=squared_norms(centroids)), axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            # إعادة زرع المراكز الفارغة في أبعد النقاط
+            far = np.argsort(data_sq)[-int(empty.sum()):]
+            centroids[empty] = data[far]
+
+    return centroids
+
+
+class _InvertedList:
+    """قائمة معكوسة واحدة: عناوين داخلية + بصمات و/أو رموز PQ"""
+
+    def __init__(self, dim, pq_m, store_vectors):
+        self.size = 0
+        self.labels = np.empty(16, dtype=np.int64)
+        self.vectors = np.empty((16, dim), dtype=np.float32) if store_vectors else None
+        self.codes = np.empty((16, pq_m), dtype=np.uint8) if pq_m else None
+
+    def _grow(self, needed):
+        capacity = self.labels.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        self.labels = np.resize(self.labels, capacity)
+        if self.vectors is not None:
+            grown = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        if self.codes is not None:
+            grown = np.empty((capacity, self.codes.shape[1]), dtype=np.uint8)
+            grown[:self.size] = self.codes[:self.size]
+            self.codes = grown
+
+    def append(self, labels, vectors, codes):
+        start, end = self.size, self.size + len(labels)
+        self._grow(end)
+        self.labels[start:end] = labels
+        if self.vectors is not None:
+            self.vectors[start:end] = vectors
+        if self.codes is not None:
+            self.codes[start:end] = codes
+        self.size = end
+        return start
+
+    def remove_at(self, pos):
+        """حذف عنصر بنقل الأخير مكانه؛ يرجع عنوان العنصر المنقول أو None"""
+        last = self.size - 1
+        moved = None
+        if pos != last:
+            moved = int(self.labels[last])
+            self.labels[pos] = self.labels[last]
+            if self.vectors is not None:
+                self.vectors[pos] = self.vectors[last]
+            if self.codes is not None:
+                self.codes[pos] = self.codes[last]
+        self.size = last
+        return moved
+
+
+class IVFIndex:
+    """
+    فهرس IVF للبصمات مع PQ اختياري
+    المعرفات الخارجية (معرفات الطلاب) نصية، والفهرس يدعم الإضافة والحذف التدريجي
+    """
+
+    def __init__(self, dim=128, nlist=256, nprobe=8, pq_m=0, rerank=0,
+                 metric='euclidean', seed=0):
+        if metric not in ('euclidean', 'cosine'):
+            raise ValueError(f'مقياس غير معروف: {metric}')
+        for name, value, minimum in (('nlist', nlist, 1), ('nprobe', nprobe, 1), ('pq_m', pq_m, 0),
+                                     ('rerank', rerank, 0), ('seed', seed, 0)):
+            if isinstance(value, bool) or not isinstance(value, (int, np.integer)) or value < minimum:
+                raise ValueError(f'قيمة غير صالحة لـ {name}: {value}')
+        if pq_m and dim % pq_m:
+            raise ValueError('يجب أن يقبل البعد القسمة على pq_m')
+
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank
+        self.metric = metric
+        self.seed = seed
+
+        self.centroids = None
+        self.codebooks = None  # (pq_m, 256, dim / pq_m)
+        self.lists = []
+        self._ids = []         # العنوان الداخلي -> معرف الطالب (None بعد الحذف)
+        self._labels = {}      # معرف الطالب -> العنوان الداخلي
+        self._where = {}       # العنوان الداخلي -> (رقم القائمة, الموضع)
+
+    # ------------------------------------------------------------------
+    # الإعدادات والحالة
+    # ------------------------------------------------------------------
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @property
+    def min_train_size(self):
+        """أقل عدد بصمات لتدريب الفهرس بشكل معقول"""
+        return max(self.nlist * 8, 256 if self.pq_m else 0)
+
+    @property
+    def store_vectors(self):
+        return not self.pq_m or self.rerank > 0
+
+    def params(self):
+        return {
+            'type': 'ivf',
+            'dim': self.dim,
+            'nlist': self.nlist,
+            'nprobe': self.nprobe,
+            'pq_m': self.pq_m,
+            'rerank': self.rerank,
+            'metric': self.metric,
+            'seed': self.seed,
+        }
+
+    def __len__(self):
+        return len(self._labels)
+
+    def _prepare(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.metric == 'cosine':
+            norms = np.sqrt(squared_norms(vectors))
+            vectors = vectors / np.maximum(norms, 1e-12)[:, None]
+        return vectors
+
+    # ------------------------------------------------------------------
+    # البناء
+    # ------------------------------------------------------------------
+    def train(self, data):
+        data = self._prepare(data)
+        self.nlist = max(1, min(self.nlist, data.shape[0]))
+        self.centroids = kmeans(data, self.nlist, seed=self.seed, max_samples=self.nlist * 256)
+
+        if self.pq_m:
+            residuals = data - self.centroids[self._assign(data)]
+            sub = self.dim // self.pq_m
+            self.codebooks = np.stack([
+                kmeans(residuals[:, j * sub:(j + 1) * sub], 256, iterations=10,
+                       seed=self.seed + j, max_samples=256 * 64)
+                for j in range(self.pq_m)
+            ])
+
+        self.lists = [_InvertedList(self.dim, self.pq_m, self.store_vectors) for _ in range(self.nlist)]
+        self._ids, self._labels, self._where = [], {}, {}
+        logger.info(f"✓ تم تدريب فهرس IVF (nlist={self.nlist}, pq_m={self.pq_m})")
+
+    def build(self, data, ids):
+        """تدريب الفهرس وإضافة جميع البصمات"""
+        self.train(data)
+        self.add(data, ids)
+        return self
+
+    def _assign(self, vectors):
+        distances = pairwise_distances(vectors, self.centroids, sq_norms=squared_norms(self.centroids))
+        return np.argmin(distances, axis=1)
+
+    def _encode(self, residuals):
+        sub = self.dim // self.pq_m
+        codes = np.empty((residuals.shape[0], self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codebook = self.codebooks[j]
+            distances = pairwise_distances(residuals[:, j * sub:(j + 1) * sub], codebook,
+                                           sq_norms=squared_norms(codebook))
+            codes[:, j] = np.argmin(distances, axis=1)
+        return codes
+
+    def add(self, vectors, ids):
+        """إضافة (أو استبدال) بصمات بشكل تدريجي"""
+        if not self.is_trained:
+            raise RuntimeError('الفهرس غير مدرب')
+        ids = [str(i) for i in ids]
+        self.remove([i for i in ids if i in self._labels])
+        if not ids:
+            return
+
+        vectors = self._prepare(vectors)
+        assign = self._assign(vectors)
+        codes = self._encode(vectors - self.centroids[assign]) if self.pq_m else None
+
+        labels = np.arange(len(self._ids), len(self._ids) + len(ids), dtype=np.int64)
+        self._ids.extend(ids)
+        for student_id, label in zip(ids, labels.tolist()):
+            self._labels[student_id] = label
+
+        for list_no in np.unique(assign).tolist():
+            mask = assign == list_no
+            start = self.lists[list_no].append(
+                labels[mask],
+                vectors[mask] if self.store_vectors else None,
+                codes[mask] if codes is not None else None
+            )
+            for offset, label in enumerate(labels[mask].tolist()):
+                self._where[label] = (list_no, start + offset)
+
+    def remove(self, ids):
+        removed = 0
+        for student_id in ids:
+            label = self._labels.pop(str(student_id), None)
+            if label is None:
+                continue
+            list_no, pos = self._where.pop(label)
+            moved = self.lists[list_no].remove_at(pos)
+            if moved is not None:
+                self._where[moved] = (list_no, pos)
+            self._ids[label] = None
+            removed += 1
+        return removed
+
+    # ------------------------------------------------------------------
+    # البحث
+    # ------------------------------------------------------------------
+    def search(self, queries, k=10, nprobe=None):
+        """
+        Returns:
+            (ids, distances): قائمة بقوائم معرفات الطلاب ومصفوفة المسافات لكل استعلام
+        """
+        queries = self._prepare(queries)
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+        coarse = pairwise_distances(queries, self.centroids, sq_norms=squared_norms(self.centroids))
+        probes, _ = top_k(coarse, nprobe)
+
+        all_ids, all_distances = [], []
+        for query, lists in zip(queries, probes):
+            labels, distances = self._search_lists(query, lists.tolist(), k)
+            all_ids.append([self._ids[label] for label in labels.tolist()])
+            all_distances.append(self._to_metric(distances))
+        return all_ids, all_distances
+
+    def _search_lists(self, query, list_nos, k):
+        lists = [self.lists[i] for i in list_nos if self.lists[i].size]
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        labels = np.concatenate([lst.labels[:lst.size] for lst in lists])
+
+        if not self.pq_m:
+            vectors = np.concatenate([lst.vectors[:lst.size] for lst in lists])
+            distances = pairwise_distances(query, vectors)[0]
+            rows, best = top_k(distances, k)
+            return labels[rows[0]], best[0]
+
+        # مسافات PQ غير المتماثلة (ADC) عبر جداول بحث لجميع القوائم المفحوصة دفعة واحدة
+        probed = [i for i in list_nos if self.lists[i].size]
+        sub = self.dim // self.pq_m
+        residuals = (query - self.centroids[probed]).reshape(len(probed), self.pq_m, sub)
+        tables = (
+            np.einsum('lms,lms->lm', residuals, residuals)[:, :, None]
+            + np.einsum('mcs,mcs->mc', self.codebooks, self.codebooks)[None, :, :]
+            - 2.0 * np.einsum('lms,mcs->lmc', residuals, self.codebooks)
+        )
+        codes = np.concatenate([lst.codes[:lst.size] for lst in lists])
+        owner = np.repeat(np.arange(len(lists)), [lst.size for lst in lists])
+        approx = tables[owner[:, None], np.arange(self.pq_m)[None, :], codes].sum(axis=1)
+        approx = np.sqrt(np.maximum(approx, 0.0))
+
+        if not self.rerank:
+            rows, best = top_k(approx, k)
+            return labels[rows[0]], best[0]
+
+        shortlist, _ = top_k(approx, max(k, self.rerank))
+        shortlist = shortlist[0]
+        vectors = np.concatenate([lst.vectors[:lst.size] for lst in lists])[shortlist]
+        rows, best = top_k(pairwise_distances(query, vectors)[0], k)
+        return labels[shortlist[rows[0]]], best[0]
+
+    def _to_metric(self, distances):
+        if self.metric == 'cosine':
+            # المتجهات مطبّعة: ||a - b||² = 2 (1 - cos)
+            return (distances ** 2) / 2.0
+        return distances
+
+    # ------------------------------------------------------------------
+    # الحفظ والتحميل
+    # ------------------------------------------------------------------
+    def save(self, path_or_file):
+        order = [lst for lst in self.lists]
+        offsets = np.cumsum([0] + [lst.size for lst in order])
+        arrays = {
+            'params': np.array(json.dumps(self.params())),
+            'centroids': self.centroids,
+            'offsets': offsets,
+            'labels': np.concatenate([lst.labels[:lst.size] for lst in order]),
+            'ids': np.array([self._ids[label] for lst in order for label in lst.labels[:lst.size].tolist()]),
+        }
+        if self.store_vectors:
+            arrays['vectors'] = np.concatenate([lst.vectors[:lst.size] for lst in order])
+        if self.pq_m:
+            arrays['codebooks'] = self.codebooks
+            arrays['codes'] = np.concatenate([lst.codes[:lst.size] for lst in order])
+        np.savez(path_or_file, **arrays)
+
+    @classmethod
+    def load(cls, path_or_file):
+        with np.load(path_or_file, allow_pickle=False) as data:
+            params = json.loads(str(data['params']))
+            params.pop('type', None)
+            index = cls(**params)
+            index.centroids = data['centroids']
+            index.codebooks = data['codebooks'] if index.pq_m else None
+            index.lists = [_InvertedList(index.dim, index.pq_m, index.store_vectors)
+                           for _ in range(index.nlist)]
+
+            offsets = data['offsets']
+            ids = [str(i) for i in data['ids'].tolist()]
+            vectors = data['vectors'] if index.store_vectors else None
+            codes = data['codes'] if index.pq_m else None
+
+        index._ids = ids
+        index._labels = {student_id: label for label, student_id in enumerate(ids)}
+        labels = np.arange(len(ids), dtype=np.int64)
+        for list_no in range(index.nlist):
+            start, end = int(offsets[list_no]), int(offsets[list_no + 1])
+            index.lists[list_no].append(
+                labels[start:end],
+                vectors[start:end] if vectors is not None else None,
+                codes[start:end] if codes is not None else None
+            )
+            for pos, label in enumerate(range(start, end)):
+                index._where[label] = (list_no, pos)
+        return index
+
+
+def recall_report(data, queries, k=10, configs=None, metric='euclidean'):
+    """
+    مقارنة الفهرس التقريبي مع البحث الكامل (brute force) لاختيار الإعدادات
+
+    Returns:
+        قائمة لكل إعداد: recall@k، زمن الاستعلام والتسريع مقارنة بالبحث الكامل
+    """
+    data = np.asarray(data, dtype=np.float32)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    ids = [str(i) for i in range(data.shape[0])]
+
+    # البحث الكامل استعلاماً واحداً في كل مرة كما في مسار المطابقة الفعلي
+    data_sq = squared_norms(data)
+    exact = []
+    start = time.perf_counter()
+    for query in queries:
+        rows, _ = top_k(pairwise_distances(query, data, metric, sq_norms=data_sq), k)
+        exact.append(set(map(str, rows[0].tolist())))
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    if configs is None:
+        configs = [
+            {'nlist': 256, 'nprobe': nprobe, 'pq_m': 0}
+            for nprobe in (1, 4, 8, 16, 32)
+        ] + [
+            {'nlist': 256, 'nprobe': 16, 'pq_m': 16, 'rerank': 0},
+            {'nlist': 256, 'nprobe': 16, 'pq_m': 16, 'rerank': 100},
+        ]
+
+    report = []
+    built = {}
+    for config in configs:
+        build_key = (config.get('nlist', 256), config.get('pq_m', 0), config.get('rerank', 0))
+        if build_key not in built:
+            start = time.perf_counter()
+            index = IVFIndex(dim=data.shape[1], metric=metric, nlist=build_key[0],
+                             pq_m=build_key[1], rerank=build_key[2]).build(data, ids)
+            built[build_key] = (index, time.perf_counter() - start)
+        index, build_seconds = built[build_key]
+
+        start = time.perf_counter()
+        found, _ = index.search(queries, k=k, nprobe=config.get('nprobe'))
+        query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        hits = sum(len(exact[i] & set(found[i])) for i in range(len(queries)))
+        report.append({
+            **index.params(),
+            'nprobe': config.get('nprobe', index.nprobe),
+            'k': k,
+            'recall': hits / float(k * len(queries)),
+            'query_ms': query_ms,
+            'exact_query_ms': exact_ms,
+            'speedup': exact_ms / query_ms if query_ms else None,
+            'build_seconds': build_seconds,
+        })
+    return report
+
+
+def _synthetic_embeddings(size, dim, seed=0, clusters=512):
+    """بصمات اصطناعية متجمعة تشبه توزيع بصمات الطلاب (للتقرير فقط)"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32) * 1.0
+    assign = rng.integers(clusters, size=size)
+    data = centers[assign] + rng.standard_normal((size, dim)).astype(np.float32)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تقرير الدقة مقابل السرعة لفهرس IVF')
+    parser.add_argument('--data', help='ملف .npy لبصمات حقيقية (N, 128)')
+    parser.add_argument('--size', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--metric', default='euclidean', choices=('euclidean', 'cosine'))
+    parser.add_argument('--json', action='store_true', help='طباعة التقرير بصيغة JSON')
+    args = parser.parse_args()
+
+    if args.data:
+        data = np.load(args.data).astype(np.float32)
+    else:
+        data = _synthetic_embeddings(args.size, 128)
+
+    rng = np.random.default_rng(1)
+    queries = data[rng.choice(data.shape[0], args.queries, replace=False)]
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * 0.3
+
+    report = recall_report(data, queries, k=args.k, metric=args.metric)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"N={data.shape[0]} queries={len(queries)} k={args.k} metric={args.metric}")
+    print(f"{'nlist':>6} {'nprobe':>6} {'pq_m':>5} {'rerank':>6} {'recall':>7} {'ms/q':>8} {'speedup':>8}")
+    for row in report:
+        print(f"{row['nlist']:>6} {row['nprobe']:>6} {row['pq_m']:>5} {row['rerank']:>6} "
+              f"{row['recall']:>7.3f} {row['query_ms']:>8.3f} {row['speedup']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
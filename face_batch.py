@@ -0,0 +1,216 @@
+"""
+استخراج البصمات دفعة واحدة - Bulk Embedding Extraction
+توزيع الصور على مجموعة عمليات (process pool) بحصة هذه العملية من الأنوية
+يُستخدم عند استيراد الطلاب بداية الفصل بدلاً من طلب لكل طالب
+
+كل عملية gunicorn تملك مجموعة واحدة مشتركة (batch_extractor) حجمها الأنوية مقسومة
+على عدد عمليات gunicorn، وتُغلق بعد مدة بدون استخدام حتى لا تبقى عملياتها
+(كل منها يحمّل cv2 و numpy) في الذاكرة بين فترات الاستيراد
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+
+from face_metrics import face_metrics
+
+logger = logging.getLogger(__name__)
+
+# خدمة الوجه داخل كل عملية عاملة
+_worker_service = None
+
+
+def _init_worker():
+    """تهيئة خدمة مستقلة داخل العملية العاملة"""
+    global _worker_service
+    import cv2
+    from face_recognition_service import face_service
+
+    # عملية لكل نواة، فلا داعي لخيوط OpenCV الداخلية
+    cv2.setNumThreads(1)
+    _worker_service = face_service
+
+
+def _extract_one(index, item, embedding_format='list'):
+    """استخراج بصمة صورة واحدة وإرجاع نتيجة موحدة الشكل"""
+    global _worker_service
+    from face_embedding_codec import format_embedding
+
+    if _worker_service is None:
+        from face_recognition_service import face_service
+        _worker_service = face_service
+
+    item_id, image = _split_item(item)
+    if not image:
+        return _result(index, item_id, {
+            'success': False,
+            'message': 'لم يتم إرسال صورة',
+            'face_count': 0
+        })
+    # المقاييس تُكتب من العملية العاملة إلى نفس المجلد المشترك
+    with face_metrics.endpoint('extract_embeddings_item'):
+        result = _worker_service.extract_face_embedding(image)
+    if result.get('success'):
+        # الترميز داخل العملية العاملة حتى تنتقل الصيغة المضغوطة بين العمليات
+        result['embedding'] = format_embedding(result['embedding'], embedding_format)
+    return _result(index, item_id, result)
+
+
+def _split_item(item):
+    if isinstance(item, dict):
+        return item.get('id'), item.get('image')
+    return None, item
+
+
+def _result(index, item_id, result):
+    return {
+        'index': index,
+        'id': item_id,
+        'success': result.get('success', False),
+        'embedding': result.get('embedding'),
+        'face_count': result.get('face_count', 0),
+        'error': None if result.get('success') else result.get('message'),
+    }
+
+
+def default_workers():
+    """
+    حصة عملية gunicorn من الأنوية (عملية استخراج واحدة على الأقل)
+    عدد عمليات gunicorn من FACE_SERVER_WORKERS (يضبطه gunicorn.conf.py) أو WEB_CONCURRENCY
+    """
+    server_workers = int(os.environ.get('FACE_SERVER_WORKERS') or os.environ.get('WEB_CONCURRENCY') or 1)
+    return max(1, (os.cpu_count() or 1) // max(1, server_workers))
+
+
+class BatchEmbeddingExtractor:
+    """
+    مستخرج البصمات المتوازي
+    يتم إنشاء مجموعة العمليات عند أول استخدام فقط، حتى لا تتحملها العمليات التي لا تحتاجها،
+    وتُغلق بعد idle_timeout ثانية بدون استخراج (0 يبقيها حتى الإغلاق)
+    """
+
+    def __init__(self, max_workers=None, start_method=None, idle_timeout=None):
+        self._max_workers = max_workers or int(os.environ.get('FACE_BATCH_WORKERS', 0)) or None
+        self.start_method = start_method or os.environ.get('FACE_BATCH_START_METHOD', 'spawn')
+        self.idle_timeout = idle_timeout if idle_timeout is not None else \
+            float(os.environ.get('FACE_BATCH_IDLE_SECONDS', 120))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._last_used = 0.0
+        self._timer = None
+
+    @property
+    def max_workers(self):
+        # يُحسب عند إنشاء المجموعة: عدد عمليات gunicorn يُعرف بعد تحميل الوحدة (preload)
+        return self._max_workers or default_workers()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                workers = self.max_workers
+                logger.info(f"تشغيل مجموعة عمليات الاستخراج ({workers} عملية)")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_worker
+                )
+            self._active += 1
+            return self._executor
+
+    def _release(self):
+        """نهاية استخدام المجموعة؛ جدولة الإغلاق بعد مدة الخمول"""
+        with self._lock:
+            self._active -= 1
+            self._last_used = time.monotonic()
+            if self.idle_timeout > 0 and self._timer is None:
+                self._schedule(self.idle_timeout)
+
+    def _schedule(self, delay):
+        self._timer = threading.Timer(delay, self._close_if_idle)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _close_if_idle(self):
+        with self._lock:
+            self._timer = None
+            if self._executor is None or self._active:
+                return
+            remaining = self._last_used + self.idle_timeout - time.monotonic()
+            if remaining > 0:
+                self._schedule(remaining)
+                return
+            logger.info("إغلاق مجموعة عمليات الاستخراج بعد الخمول")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def extract(self, images, embedding_format='list'):
+        """
+        استخراج بصمات جميع الصور مع الحفاظ على الترتيب
+
+        Args:
+            images: قائمة صور base64 أو عناصر {'id': ..., 'image': ...}
+            embedding_format: 'list' أو صيغة مضغوطة (انظر face_embedding_codec)
+
+        Returns:
+            قائمة {'index', 'id', 'success', 'embedding', 'face_count', 'error'}
+        """
+        if len(images) <= 1:
+            return [_extract_one(i, item, embedding_format) for i, item in enumerate(images)]
+
+        executor = self._get_executor()
+        chunksize = max(1, len(images) // (self.max_workers * 4))
+        try:
+            return list(executor.map(
+                _extract_one, range(len(images)), images, repeat(embedding_format), chunksize=chunksize
+            ))
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise
+        finally:
+            self._release()
+
+    def extract_stream(self, images, embedding_format='list'):
+        """
+        نفس extract لكن يُرجع النتائج فور اكتمالها (الترتيب حسب الانتهاء وليس الإدخال)
+        """
+        if len(images) <= 1:
+            for i, item in enumerate(images):
+                yield _extract_one(i, item, embedding_format)
+            return
+
+        executor = self._get_executor()
+        try:
+            futures = [executor.submit(_extract_one, i, item, embedding_format) for i, item in enumerate(images)]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise
+        finally:
+            self._release()
+
+    def shutdown(self):
+        self._reset_executor()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+batch_extractor = BatchEmbeddingExtractor()
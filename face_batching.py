@@ -0,0 +1,159 @@
+"""
+تجميع طلبات المطابقة المتزامنة - Match Micro-Batching
+عند بداية الحصة تصل طلبات كثيرة لنفس المعرض في نفس اللحظة؛ بدلاً من حساب
+المسافات لكل طلب وحده تُجمع البصمات خلال نافذة قصيرة (2-10 ms) وتُبحث دفعة واحدة
+
+أول طلب في الدفعة (القائد) ينتظر حتى امتلاء الدفعة أو انتهاء النافذة أو انضمام
+كل الطلبات الجارية، ثم يبحث للجميع ويسلّم كل طلب نتيجته
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+from face_metrics import face_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    __slots__ = ('gallery', 'matcher', 'nprobe', 'shard', 'requests', 'rows')
+
+    def __init__(self, gallery, matcher, nprobe, shard=None):
+        self.gallery = gallery
+        self.matcher = matcher
+        self.nprobe = nprobe
+        self.shard = shard
+        self.requests = []
+        self.rows = 0
+
+
+class MatchBatcher:
+    """
+    مجدول الدفعات داخل العملية الواحدة
+
+    Args:
+        window_ms: أقصى انتظار لتجميع الدفعة (0 يعطّل التجميع)
+        max_batch: أقصى عدد بصمات في الدفعة الواحدة
+    """
+
+    def __init__(self, window_ms=None, max_batch=None):
+        if window_ms is None:
+            window_ms = float(os.environ.get('FACE_MATCH_BATCH_WINDOW_MS', 5))
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max_batch or int(os.environ.get('FACE_MATCH_BATCH_MAX', 32))
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._inflight = 0
+        self._waiting = 0
+        self._stats = {'batches': 0, 'requests': 0, 'queries': 0, 'max_batch': 0, 'wait_seconds': 0.0}
+
+    @contextmanager
+    def request(self):
+        """
+        تسجيل طلب مطابقة جارٍ (من بداية استخراج البصمة)
+        القائد لا ينتظر إذا لم يكن هناك طلبات أخرى قد تنضم للدفعة
+        """
+        with self._cond:
+            self._inflight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._inflight -= 1
+                self._cond.notify_all()
+
+    def search(self, gallery, queries, matcher, k=5, nprobe=None, shard=None):
+        """
+        البحث في المعرض ضمن دفعة مشتركة (الطلبات لنفس جزء المعرض فقط تُجمع معاً)
+
+        Returns:
+            (rows, distances, student_at) حيث rows و distances بالشكل (Q, k)
+            و student_at يرجع بيانات الطالب كما كانت لحظة البحث
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        future = Future()
+        key = (id(gallery), matcher.metric, matcher.threshold, nprobe, shard)
+
+        with self._cond:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch(gallery, matcher, nprobe, shard)
+            batch.requests.append((queries, k, future))
+            batch.rows += len(queries)
+            self._waiting += 1
+
+            if batch.rows >= self.max_batch:
+                self._close(key, batch)
+            self._cond.notify_all()
+
+            if leader:
+                start = time.monotonic()
+                deadline = start + self.window
+                while self._pending.get(key) is batch and self._waiting < self._inflight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._pending.get(key) is batch:
+                    self._close(key, batch)
+                self._stats['wait_seconds'] += time.monotonic() - start
+
+        if leader:
+            self._run(batch)
+        return future.result()
+
+    def _close(self, key, batch):
+        del self._pending[key]
+        self._waiting -= len(batch.requests)
+
+    def _run(self, batch):
+        futures = [future for _, _, future in batch.requests]
+        try:
+            stacked = np.concatenate([queries for queries, _, _ in batch.requests])
+            k = max(k for _, k, _ in batch.requests)
+            gallery = batch.gallery
+
+            with gallery.lock:
+                rows, distances = gallery.search(stacked, batch.matcher, k=k, nprobe=batch.nprobe, shard=batch.shard)
+                students = {row: gallery.student_at(row) for row in np.unique(rows[rows >= 0]).tolist()}
+
+            face_metrics.inc('face_match_batches_total')
+            face_metrics.inc('face_match_batched_requests_total', len(futures))
+            with self._cond:
+                self._stats['batches'] += 1
+                self._stats['requests'] += len(futures)
+                self._stats['queries'] += len(stacked)
+                self._stats['max_batch'] = max(self._stats['max_batch'], len(futures))
+
+            start = 0
+            for queries, k, future in batch.requests:
+                end = start + len(queries)
+                future.set_result((rows[start:end, :k], distances[start:end, :k], students.__getitem__))
+                start = end
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self):
+        """
+        إحصائيات التجميع: متوسط عدد الطلبات لكل دفعة هو كفاءة التجميع
+        (1.0 = بدون تجميع)
+        """
+        with self._cond:
+            stats = dict(self._stats)
+        stats['window_ms'] = self.window * 1000.0
+        stats['max_batch_size'] = self.max_batch
+        stats['efficiency'] = stats['requests'] / stats['batches'] if stats['batches'] else None
+        stats['avg_wait_ms'] = stats['wait_seconds'] * 1000.0 / stats['batches'] if stats['batches'] else None
+        return stats
+
+
+match_batcher = MatchBatcher()
@@ -0,0 +1,194 @@
+"""
+ذاكرة نتائج خدمة الوجه - Content-Hash Result Cache
+إعادة إرسال نفس الصورة (إعادة محاولة المتصفح، نفس صورة التسجيل) لا تعيد فك الترميز والكشف والبصمة
+
+المفتاح: بصمة blake2b لبايتات الصورة المرمّزة + معاملات الكشف
+الذاكرة: LRU مع مدة صلاحية (TTL) وحد أقصى للحجم، ومجلد اختياري على القرص
+لمشاركة النتائج بين عمليات gunicorn
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from face_metrics import face_metrics
+
+logger = logging.getLogger(__name__)
+
+# عدد عمليات الحفظ بين كل تنظيف لمجلد القرص
+DISK_PRUNE_EVERY = 256
+
+
+class ResultCache:
+    """
+    ذاكرة LRU للنتائج القابلة للتحويل إلى JSON
+
+    Args:
+        name: اسم الذاكرة في المقاييس
+        max_bytes: الحد الأقصى للحجم التقريبي (حجم JSON) في الذاكرة
+        ttl: مدة صلاحية النتيجة بالثواني
+        directory: مجلد مشترك على القرص (اختياري)
+    """
+
+    def __init__(self, name, max_bytes=None, ttl=None, directory=None):
+        self.name = name
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            int(float(os.environ.get('FACE_CACHE_MAX_MB', 32)) * 1024 * 1024)
+        self.ttl = ttl if ttl is not None else float(os.environ.get('FACE_CACHE_TTL', 300))
+        self.directory = directory if directory is not None else os.environ.get('FACE_CACHE_DIR')
+        if self.directory:
+            self.directory = os.path.join(self.directory, name)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0 and self.ttl > 0
+
+    @staticmethod
+    def key(image_bytes, *params):
+        """مفتاح المحتوى: blake2b للبايتات المرمّزة (بدون فك ترميز الصورة) + المعاملات"""
+        digest = hashlib.blake2b(memoryview(image_bytes), digest_size=16)
+        digest.update(repr(params).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _count(self, result):
+        self._stats[result if result in self._stats else 'misses'] += 1
+        face_metrics.inc('face_cache_total', cache=self.name, result=result)
+
+    def get(self, key):
+        """النتيجة المحفوظة (نسخة) أو None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, size, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self._count('hits')
+                    return json.loads(value)
+                del self._entries[key]
+                self._bytes -= size
+                self._stats['expired'] += 1
+
+        value = self._disk_get(key, now)
+        if value is not None:
+            self._store(key, value, now)
+            with self._lock:
+                self._count('disk_hits')
+            return json.loads(value)
+
+        with self._lock:
+            self._count('misses')
+        return None
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        value = json.dumps(result, ensure_ascii=False)
+        now = time.time()
+        self._store(key, value, now)
+        self._disk_put(key, value, now)
+
+    def _store(self, key, value, now):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (now + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                evicted += 1
+            self._stats['evictions'] += evicted
+        if evicted:
+            face_metrics.inc('face_cache_evictions_total', evicted, cache=self.name)
+
+    # ------------------------------------------------------------------
+    # مجلد القرص المشترك بين العمليات
+    # ------------------------------------------------------------------
+    def _disk_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _disk_get(self, key, now):
+        if not self.directory:
+            return None
+        path = self._disk_path(key)
+        try:
+            if os.stat(path).st_mtime + self.ttl <= now:
+                os.remove(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_put(self, key, value, now):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"تعذر حفظ النتيجة في ذاكرة القرص: {e}")
+            return
+
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % DISK_PRUNE_EVERY == 0
+        if prune:
+            self._disk_prune(now)
+
+    def _disk_prune(self, now):
+        """حذف الملفات المنتهية والأقدم فوق الحد الأقصى للحجم"""
+        try:
+            entries = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.json'):
+                        continue
+                    stat = entry.stat()
+                    if stat.st_mtime + self.ttl <= now:
+                        os.remove(entry.path)
+                    else:
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else None
+        return stats
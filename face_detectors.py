@@ -0,0 +1,230 @@
+"""
+كاشفات الوجه القابلة للتبديل - Pluggable Face Detectors
+كل مسار في الخدمة يستخدم ملف إعدادات (profile) يحدد الكاشف ومعاملاته، فيمكن مثلاً
+استخدام أرخص كاشف للكشف الحي وأدقها للتسجيل
+
+الكاشفات:
+    haar   CascadeClassifier بملف Haar (المرفق مع OpenCV)
+    lbp    CascadeClassifier بملف LBP محلي (أسرع من Haar وأقل دقة)
+    yunet  cv2.FaceDetectorYN بنموذج ONNX محلي (الأدق، ويحتاج OpenCV >= 4.5.4)
+
+ملفات الإعدادات الافتراضية تطابق المعاملات السابقة تماماً، ويمكن تعديلها بمتغير
+البيئة FACE_DETECTORS (JSON يُدمج فوق الافتراضي)، مثلاً:
+    FACE_DETECTORS='{"live": {"backend": "lbp"}, "enroll": {"backend": "yunet"}}'
+"""
+
+import json
+import logging
+import os
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = os.environ.get('FACE_DETECTOR_MODEL_DIR', 'models')
+
+DEFAULT_MODELS = {
+    'haar': os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'),
+    'lbp': 'lbpcascade_frontalface_improved.xml',
+    'yunet': 'face_detection_yunet_2023mar.onnx',
+}
+
+# المسار -> ملف الإعدادات
+#   enroll  استخراج البصمة عند التسجيل (extract-embedding والدفعات)
+#   match   الوجه الواحد في المطابقة والمقارنة
+#   frame   كل الوجوه في إطار الفصل
+#   live    الكشف الحي detect-only
+#   track   البحث حول الوجه المتتبع (انظر face_tracker)
+DEFAULT_PROFILES = {
+    'enroll': {'backend': 'haar', 'scaleFactor': 1.1, 'minNeighbors': 4, 'minSize': [30, 30], 'maxSize': [400, 400]},
+    'match': {'backend': 'haar', 'scaleFactor': 1.1, 'minNeighbors': 4, 'minSize': [30, 30], 'maxSize': [400, 400]},
+    'frame': {'backend': 'haar', 'scaleFactor': 1.1, 'minNeighbors': 4, 'minSize': [30, 30], 'maxSize': [400, 400]},
+    'live': {'backend': 'haar', 'scaleFactor': 1.3, 'minNeighbors': 5, 'minSize': [30, 30]},
+    'track': {'backend': 'haar', 'scaleFactor': 1.2, 'minNeighbors': 3, 'minSize': [30, 30]},
+}
+
+
+class DetectorUnavailable(RuntimeError):
+    """ملف النموذج غير موجود أو OpenCV لا يدعم الكاشف"""
+
+
+def _model_path(backend, model=None):
+    """مسار النموذج كما هو، أو داخل MODEL_DIR إذا كان اسم ملف فقط"""
+    path = model or DEFAULT_MODELS[backend]
+    if not os.path.exists(path) and not os.path.dirname(path):
+        path = os.path.join(MODEL_DIR, path)
+    if not os.path.exists(path):
+        raise DetectorUnavailable(f'ملف نموذج {backend} غير موجود: {path}')
+    return path
+
+
+def _size(value):
+    return tuple(int(v) for v in value) if value else None
+
+
+class CascadeDetector:
+    """
+    كاشف Haar أو LBP
+    CascadeClassifier ليس آمناً للاستخدام المتزامن: نسخة مستقلة لكل خيط
+    """
+
+    color = False
+
+    def __init__(self, backend, model=None, scaleFactor=1.1, minNeighbors=4, minSize=None, maxSize=None):
+        self.backend = backend
+        self.model = _model_path(backend, model)
+        self.params = {'scaleFactor': float(scaleFactor), 'minNeighbors': int(minNeighbors)}
+        if minSize:
+            self.params['minSize'] = _size(minSize)
+        if maxSize:
+            self.params['maxSize'] = _size(maxSize)
+        self._local = threading.local()
+        if self.classifier.empty():
+            raise DetectorUnavailable(f'تعذر تحميل {self.model}')
+
+    @property
+    def classifier(self):
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(self.model)
+        return cascade
+
+    def detect(self, image, min_size=None, max_size=None):
+        """
+        Args:
+            image: صورة رمادية (أو BGR تُحوّل)
+            min_size / max_size: تضييق نطاق الأحجام (بكسل) فوق معاملات الملف
+
+        Returns:
+            مصفوفة (N, 4) من (x, y, w, h)
+        """
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        params = self.params
+        if min_size or max_size:
+            params = dict(params)
+            if min_size:
+                floor = params.get('minSize', (0, 0))[0]
+                params['minSize'] = (max(floor, min_size),) * 2
+            if max_size:
+                params['maxSize'] = (max_size, max_size)
+        faces = self.classifier.detectMultiScale(image, **params)
+        return np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+
+
+class YuNetDetector:
+    """
+    كاشف FaceDetectorYN (شبكة عصبية صغيرة بنموذج ONNX)
+    النموذج يحدد حجم الإدخال، فيُضبط لكل صورة، مع نسخة لكل خيط
+    """
+
+    color = True
+
+    def __init__(self, backend='yunet', model=None, score_threshold=0.8, nms_threshold=0.3, top_k=5000,
+                 minSize=None, maxSize=None):
+        if not hasattr(cv2, 'FaceDetectorYN'):
+            raise DetectorUnavailable('نسخة OpenCV لا تدعم FaceDetectorYN')
+        self.backend = backend
+        self.model = _model_path(backend, model)
+        self.params = {'score_threshold': float(score_threshold), 'nms_threshold': float(nms_threshold),
+                       'top_k': int(top_k)}
+        self.min_size = _size(minSize)[0] if minSize else 0
+        self.max_size = _size(maxSize)[0] if maxSize else 0
+        self._local = threading.local()
+        self._network((320, 320))
+
+    def _network(self, size):
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            try:
+                net = self._local.net = cv2.FaceDetectorYN.create(
+                    self.model, '', size,
+                    self.params['score_threshold'], self.params['nms_threshold'], self.params['top_k']
+                )
+            except cv2.error as e:
+                raise DetectorUnavailable(f'تعذر تحميل {self.model}: {e}')
+        net.setInputSize(size)
+        return net
+
+    def detect(self, image, min_size=None, max_size=None):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        _, faces = self._network((width, height)).detect(image)
+        if faces is None:
+            return np.empty((0, 4), dtype=np.int32)
+
+        boxes = np.round(faces[:, :4]).astype(np.int32)
+        # قص الصناديق لحدود الصورة
+        boxes[:, 0] = np.clip(boxes[:, 0], 0, width - 1)
+        boxes[:, 1] = np.clip(boxes[:, 1], 0, height - 1)
+        boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+        boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+
+        side = np.minimum(boxes[:, 2], boxes[:, 3])
+        keep = side >= max(self.min_size, min_size or 0)
+        upper = max_size or self.max_size
+        if upper:
+            keep &= np.maximum(boxes[:, 2], boxes[:, 3]) <= upper
+        return boxes[keep]
+
+
+BACKENDS = {
+    'haar': CascadeDetector,
+    'lbp': CascadeDetector,
+    'yunet': YuNetDetector,
+}
+
+
+def create_detector(profile):
+    """إنشاء كاشف من ملف إعدادات {'backend': ..., 'model': ..., المعاملات}"""
+    options = dict(profile)
+    backend = options.pop('backend', 'haar')
+    if backend not in BACKENDS:
+        raise ValueError(f'كاشف غير معروف: {backend}')
+    return BACKENDS[backend](backend, **options)
+
+
+class DetectorRegistry:
+    """
+    الكاشف المستخدم لكل مسار (يُنشأ عند أول استخدام)
+    إذا تعذر تحميل الكاشف المطلوب يُستخدم ملف الإعدادات الافتراضي لنفس المسار
+    """
+
+    def __init__(self, profiles=None):
+        self.profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+        overrides = profiles if profiles is not None else json.loads(os.environ.get('FACE_DETECTORS', '{}'))
+        for name, profile in overrides.items():
+            merged = self.profiles.get(name, {})
+            if profile.get('backend', merged.get('backend')) != merged.get('backend'):
+                # كاشف مختلف: معاملات Haar السابقة لا تنطبق عليه
+                merged = {}
+            self.profiles[name] = {**merged, **profile}
+        self._detectors = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        detector = self._detectors.get(name)
+        if detector is not None:
+            return detector
+        with self._lock:
+            detector = self._detectors.get(name)
+            if detector is None:
+                profile = self.profiles[name]
+                try:
+                    detector = create_detector(profile)
+                except (DetectorUnavailable, TypeError) as e:
+                    logger.warning(f"تعذر تحميل كاشف '{name}' ({profile.get('backend')}): {e} - استخدام الافتراضي")
+                    profile = self.profiles[name] = dict(DEFAULT_PROFILES[name])
+                    detector = create_detector(profile)
+                self._detectors[name] = detector
+        return detector
+
+    def signature(self, name):
+        """وصف ثابت لملف الإعدادات (لمفاتيح ذاكرة النتائج)"""
+        return json.dumps(self.profiles[name], sort_keys=True)
+
+    def describe(self):
+        return {name: dict(profile) for name, profile in self.profiles.items()}
@@ -0,0 +1,108 @@
+"""
+نواة حساب بصمة الوجه - Vectorized Face Embedding Kernel
+نفس قيم _compute_face_embedding السابقة تماماً لكن بدون حلقات Python
+
+البصمة السابقة كانت تأخذ أول 128 قيمة من قائمة الخصائص، وهي:
+    - أول 32 بكسل من الصف الأول للصورة الرمادية المعادلة
+    - هيستوجرام 64 خانة (تطبيع L2)
+    - أول 32 قيمة لمقدار تدرج Sobel في الصف الأول
+أما إحصائيات الكتل و Canny و ORB وعزوم الألوان فكانت تُحسب ثم تُحذف بالقص إلى 128،
+لذلك لا تُحسب هنا إطلاقاً
+"""
+
+import cv2
+import numpy as np
+
+# إصدار خوارزمية البصمة: يُرفع عند أي تغيير في القيم الناتجة حتى تُعرف البصمات القديمة
+EMBEDDING_VERSION = 1
+
+EMBEDDING_SIZE = 128
+FACE_SIZE = 64
+
+PIXEL_FEATURES = 32
+HIST_BINS = 64
+GRADIENT_FEATURES = 32
+
+
+def _gray_faces(faces):
+    """
+    (N, 64, 64, 3) BGR -> (N, 64, 64) رمادي معادل الهيستوجرام
+    التحويل للرمادي لكل البكسلات باستدعاء واحد، والمعادلة لكل وجه (تعتمد على هيستوجرامه)
+    """
+    n = faces.shape[0]
+    gray = cv2.cvtColor(
+        np.ascontiguousarray(faces).reshape(n * FACE_SIZE, FACE_SIZE, -1),
+        cv2.COLOR_BGR2GRAY
+    ).reshape(n, FACE_SIZE, FACE_SIZE)
+    for i in range(n):
+        cv2.equalizeHist(gray[i], dst=gray[i])
+    return gray
+
+
+def _first_row_gradient(gray):
+    """
+    مقدار تدرج Sobel (3x3) لأول 32 بكسل من الصف الأول فقط
+
+    مع الحدود العاكسة (BORDER_REFLECT_101) الصف -1 يساوي الصف 1، فيكون gy = 0
+    و gx هو فرق أفقي للتنعيم الرأسي 2*r0 + 2*r1 (قيم صحيحة، فالنتيجة مطابقة تماماً)
+    """
+    smooth = 2 * gray[:, 0, :GRADIENT_FEATURES + 1].astype(np.int32) \
+        + 2 * gray[:, 1, :GRADIENT_FEATURES + 1].astype(np.int32)
+    gx = np.empty((gray.shape[0], GRADIENT_FEATURES), dtype=np.int32)
+    gx[:, 0] = 0
+    gx[:, 1:] = smooth[:, 2:] - smooth[:, :-2]
+    return np.abs(gx).astype(np.float32) / 255.0
+
+
+def _histograms(gray):
+    """هيستوجرام 64 خانة لكل وجه مع تطبيع L2 (نفس cv2.normalize)"""
+    n = gray.shape[0]
+    bins = (gray.reshape(n, -1) >> 2).astype(np.intp)
+    bins += (np.arange(n, dtype=np.intp) * HIST_BINS)[:, None]
+    counts = np.bincount(bins.ravel(), minlength=n * HIST_BINS).astype(np.float32).reshape(n, HIST_BINS)
+    for i in range(n):
+        cv2.normalize(counts[i], counts[i])
+    return counts
+
+
+def embed_faces(faces):
+    """
+    بصمات دفعة من الوجوه المقصوصة بحجم 64x64
+
+    Args:
+        faces: (N, 64, 64, 3) uint8 BGR
+
+    Returns:
+        (N, 128) float32
+    """
+    faces = np.asarray(faces)
+    n = faces.shape[0]
+    if n == 0:
+        return np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+
+    gray = _gray_faces(faces)
+
+    embeddings = np.empty((n, EMBEDDING_SIZE), dtype=np.float32)
+    end_pixels = PIXEL_FEATURES
+    end_hist = end_pixels + HIST_BINS
+    embeddings[:, :end_pixels] = gray[:, 0, :PIXEL_FEATURES].astype(float) / 255.0
+    embeddings[:, end_pixels:end_hist] = _histograms(gray)
+    embeddings[:, end_hist:] = _first_row_gradient(gray)
+
+    # تطبيع كل بصمة (متوسط 0 وانحراف 1) ثم قص القيم المتطرفة
+    mean = np.mean(embeddings, axis=1, keepdims=True)
+    std = np.std(embeddings, axis=1, keepdims=True)
+    valid = std[:, 0] > 1e-6
+    embeddings[valid] = (embeddings[valid] - mean[valid]) / std[valid]
+
+    return np.clip(embeddings, -5, 5)
+
+
+def resize_face(face_image):
+    """تحجيم قصاصة الوجه إلى 64x64"""
+    return cv2.resize(face_image, (FACE_SIZE, FACE_SIZE))
+
+
+def embed_face(face_image):
+    """بصمة وجه واحد بأي حجم (128,) float32"""
+    return embed_faces(resize_face(face_image)[None])[0]
@@ -0,0 +1,194 @@
+"""
+ترميز البصمات المضغوط - Compact Versioned Embedding Format
+بدلاً من 128 رقماً عشرياً في JSON (حوالي 2.5KB) تُرسل البصمة كنص base64 لترويسة ثابتة
+متبوعة بالبيانات بصيغة float32 أو float16 أو int8 مع معامل تحجيم
+
+الترويسة (12 بايت، little-endian):
+    'FE' | إصدار الصيغة (u8) | إصدار الخوارزمية (u8) | نوع البيانات (u8) | محجوز (u8)
+    | البعد (u16) | معامل التحجيم (f32)
+
+القوائم العادية (الصيغة القديمة) مقبولة دائماً، وإصدارها غير معروف (None)
+"""
+
+import base64
+import binascii
+import os
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from face_embedding import EMBEDDING_VERSION
+
+FORMAT_MAGIC = b'FE'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<2sBBBBHf')
+
+# الاسم -> (رمز الترويسة, نوع numpy)
+DTYPES = {
+    'float32': (0, np.float32),
+    'float16': (1, np.float16),
+    'int8': (2, np.int8),
+}
+_DTYPE_NAMES = {code: name for name, (code, _) in DTYPES.items()}
+
+# صيغ الإخراج المقبولة في معامل embedding_format
+EMBEDDING_FORMATS = ('list',) + tuple(DTYPES)
+
+# أقصى عدد بصمات (لقطات تسجيل) محفوظة لكل طالب؛ الأحدث تبقى
+MAX_TEMPLATES = int(os.environ.get('FACE_MAX_TEMPLATES', 5))
+
+DecodedEmbedding = namedtuple('DecodedEmbedding', ['data', 'scale', 'dtype', 'version'])
+
+
+def quantize(vector, dtype):
+    """
+    تحويل بصمة float32 إلى نوع التخزين المطلوب
+
+    Returns:
+        (البيانات, معامل التحجيم) حيث القيمة الأصلية ≈ البيانات * المعامل
+    """
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    if dtype == 'int8':
+        peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        return np.clip(np.rint(vector / scale), -127, 127).astype(np.int8), scale
+    return vector.astype(DTYPES[dtype][1]), 1.0
+
+
+def dequantize(data, scales=None):
+    """البيانات المخزنة -> float32 (scales لكل صف عند int8)"""
+    values = np.asarray(data).astype(np.float32)
+    if scales is not None:
+        values *= np.asarray(scales, dtype=np.float32).reshape(-1, *([1] * (values.ndim - 1)))
+    return values
+
+
+def encode_embedding(vector, dtype='int8', version=EMBEDDING_VERSION):
+    """ترميز بصمة كنص base64 بالصيغة المضغوطة"""
+    if dtype not in DTYPES:
+        raise ValueError(f'نوع بيانات غير معروف: {dtype}')
+    data, scale = quantize(vector, dtype)
+    header = _HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, version, DTYPES[dtype][0], 0, data.shape[0], scale)
+    return base64.b64encode(header + data.astype(data.dtype.newbyteorder('<')).tobytes()).decode('ascii')
+
+
+def decode_embedding(value):
+    """
+    فك بصمة بأي صيغة مقبولة (قائمة أرقام أو نص مضغوط)
+
+    Raises:
+        ValueError: إذا كانت البصمة غير صالحة
+    """
+    if isinstance(value, str):
+        try:
+            raw = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError('ترميز البصمة غير صالح')
+        if len(raw) < _HEADER.size:
+            raise ValueError('ترميز البصمة غير صالح')
+        magic, fmt, version, code, _, dim, scale = _HEADER.unpack_from(raw)
+        if magic != FORMAT_MAGIC or fmt != FORMAT_VERSION or code not in _DTYPE_NAMES:
+            raise ValueError('صيغة البصمة غير مدعومة')
+        name = _DTYPE_NAMES[code]
+        dtype = np.dtype(DTYPES[name][1]).newbyteorder('<')
+        if len(raw) != _HEADER.size + dim * dtype.itemsize:
+            raise ValueError('طول البصمة لا يطابق الترويسة')
+        data = np.frombuffer(raw, dtype=dtype, offset=_HEADER.size).astype(DTYPES[name][1])
+        decoded = DecodedEmbedding(data, float(scale), name, version)
+    else:
+        try:
+            data = np.asarray(value, dtype=np.float32).reshape(-1)
+        except (TypeError, ValueError):
+            raise ValueError('البصمة غير صالحة')
+        decoded = DecodedEmbedding(data, 1.0, 'float32', None)
+
+    if not np.all(np.isfinite(decoded.data)) or not np.isfinite(decoded.scale):
+        raise ValueError('البصمة تحتوي على قيم غير صالحة')
+    return decoded
+
+
+def embedding_vector(value):
+    """البصمة كـ float32 (128,) من أي صيغة"""
+    decoded = decode_embedding(value)
+    if decoded.dtype == 'int8':
+        return decoded.data.astype(np.float32) * np.float32(decoded.scale)
+    return decoded.data.astype(np.float32)
+
+
+def decode_templates(values, dim, limit=None):
+    """
+    بصمات طالب واحد المتعددة ('embeddings': قائمة بصمات بأي صيغة مقبولة)
+    البصمات غير الصالحة تُتجاهل، ويُبقى آخر limit بصمة (MAX_TEMPLATES افتراضياً)
+
+    Returns:
+        (مصفوفة float32 (t, dim), إصدار الخوارزمية) أو (None, None) إذا لم تبق بصمة
+        الإصدار هو الأقدم إن كانت إحدى البصمات قديمة حتى تظهر في stale_ids
+    """
+    if not isinstance(values, (list, tuple)):
+        return None, None
+    vectors, versions = [], []
+    for value in values:
+        try:
+            decoded = decode_embedding(value)
+        except ValueError:
+            continue
+        if decoded.data.shape[0] != dim:
+            continue
+        vectors.append(dequantize(decoded.data, [decoded.scale] if decoded.dtype == 'int8' else None))
+        versions.append(decoded.version)
+    limit = MAX_TEMPLATES if limit is None else limit
+    vectors, versions = vectors[-limit:], versions[-limit:]
+    if not vectors:
+        return None, None
+    version = next((v for v in versions if is_stale(v)), versions[0])
+    return np.stack(vectors), version
+
+
+def format_embedding(vector, embedding_format='list'):
+    """إخراج البصمة بالصيغة المطلوبة ('list' للتوافق مع العملاء القدامى)"""
+    if embedding_format == 'list':
+        return [float(v) for v in vector]
+    return encode_embedding(vector, embedding_format)
+
+
+def is_stale(version):
+    """بصمة من إصدار أقدم لخوارزمية البصمة (القوائم القديمة إصدارها غير معروف)"""
+    return version is not None and version != EMBEDDING_VERSION
+
+
+def stack_embeddings(values, dim):
+    """
+    تجميع بصمات الطلاب في مصفوفة واحدة للمطابقة
+    إذا كانت كلها int8 تبقى مضغوطة (المطابقة تعمل مباشرة على البيانات الكمية)
+
+    Returns:
+        (أرقام البصمات الصالحة, المصفوفة, معاملات التحجيم أو None, أرقام البصمات القديمة)
+    """
+    kept, decoded, stale = [], [], []
+    for i, value in enumerate(values):
+        if value is None:
+            continue
+        try:
+            item = decode_embedding(value)
+        except ValueError:
+            continue
+        if item.data.shape[0] != dim:
+            continue
+        kept.append(i)
+        decoded.append(item)
+        if is_stale(item.version):
+            stale.append(i)
+
+    if decoded and all(item.dtype == 'int8' for item in decoded):
+        matrix = np.stack([item.data for item in decoded])
+        scales = np.array([item.scale for item in decoded], dtype=np.float32)
+        return kept, matrix, scales, stale
+
+    matrix = np.array(
+        [item.data.astype(np.float32) * np.float32(item.scale) if item.dtype == 'int8' else item.data
+         for item in decoded],
+        dtype=np.float32
+    ).reshape(len(decoded), dim)
+    return kept, matrix, None, stale
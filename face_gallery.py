@@ -0,0 +1,694 @@
+"""
+معارض بصمات الوجه - Face Gallery Registry
+يحتفظ بقائمة الطلاب كمصفوفة متصلة في الذاكرة بدلاً من إرسالها مع كل إطار
+(float32 افتراضياً، أو float16/int8 لتقليل الذاكرة مع المطابقة على البيانات الكمية مباشرة)
+
+الطالب متعدد البصمات (لقطات تسجيل بإضاءة مختلفة في 'embeddings') يشغل صفاً واحداً
+بمركز بصماته، وبصماته محفوظة بجانب المصفوفة للمرحلة الثانية من البحث
+(face_matcher.two_stage_search)
+
+أجزاء المعرض (shards): طلاب مرحلة (وشعبة اختيارياً) كمصفوفة فرعية منسوخة عند
+أول بحث فيها ومحفوظة حتى أول تعديل للمعرض، فالبحث المحدد بمرحلة لا يمر على بقية الطلاب
+"""
+
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: بدون قفل بين العمليات (عملية واحدة في التطوير)
+    fcntl = None
+
+import numpy as np
+
+from face_ann_index import IVFIndex
+from face_embedding_codec import DTYPES, decode_embedding, decode_templates, dequantize, is_stale, quantize
+from face_matcher import squared_norms, two_stage_search
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 128
+
+# حقول تقسيم المعرض بالترتيب: المرحلة ثم الشعبة
+SHARD_FIELDS = ('stage', 'section')
+
+# rows: أرقام صفوف الجزء في المعرض؛ البقية بيانات هذه الصفوف بنوع التخزين
+GalleryShard = namedtuple('GalleryShard', ['rows', 'matrix', 'scales', 'sq_norms'])
+
+DEFAULT_GALLERY_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'face_galleries'
+)
+
+# أقل مدة بين كل تنظيف لمجلد المعارض (ثوانٍ)
+PURGE_INTERVAL = 600
+
+
+def shard_key(stage=None, section=None):
+    """
+    مفتاح جزء المعرض من معاملات الطلب: ((الحقل, القيمة), ...) أو None للمعرض كاملاً
+    """
+    key = tuple((field, str(value)) for field, value in zip(SHARD_FIELDS, (stage, section)) if value)
+    return key or None
+
+
+def in_shard(student, shard):
+    """هل الطالب (قاموس فيه stage و section) من الجزء"""
+    return all(str(student.get(field)) == value for field, value in shard)
+
+
+class FaceGallery:
+    """
+    معرض بصمات واحد (فصل أو قائمة طلاب)
+    كل صف في المصفوفة يمثل بصمة طالب، ويتم التحديث تدريجياً عند الإضافة أو الحذف
+    """
+
+    def __init__(self, gallery_id, dim=EMBEDDING_DIM, capacity=64, storage='float32'):
+        if storage not in DTYPES:
+            raise ValueError(f'نوع تخزين غير معروف: {storage}')
+        self.gallery_id = gallery_id
+        self.dim = dim
+        self.storage = storage
+        self.version = 0
+        self.updated_at = time.time()
+        self.lock = threading.RLock()
+
+        self._matrix = np.zeros((max(1, capacity), dim), dtype=DTYPES[storage][1])
+        self._scales = np.ones(max(1, capacity), dtype=np.float32)
+        self._sq_norms = np.zeros(max(1, capacity), dtype=np.float32)
+        self.size = 0
+        self.ids = []          # رقم الصف -> معرف الطالب
+        self.rows = {}         # معرف الطالب -> رقم الصف
+        self.students = {}     # معرف الطالب -> {'full_name', 'stage', 'section', 'embedding_version'}
+        self.templates = {}    # معرف الطالب -> بصماته float32 (t, dim) إن كانت أكثر من واحدة
+        self.index = None      # فهرس IVF اختياري للمعارض الكبيرة
+        self._shards = {}      # مفتاح الجزء -> GalleryShard (حتى أول تعديل)
+
+    @property
+    def matrix(self):
+        """المصفوفة الفعالة (N, dim) بنوع التخزين وبدون نسخ"""
+        return self._matrix[:self.size]
+
+    @property
+    def scales(self):
+        """معاملات التحجيم لكل صف (للتخزين int8 فقط)"""
+        return self._scales[:self.size] if self.storage == 'int8' else None
+
+    def vectors(self, rows=None):
+        """بصمات float32 لصفوف محددة (أو للمعرض كاملاً)"""
+        if rows is None:
+            rows = slice(0, self.size)
+        return dequantize(self._matrix[rows], self._scales[rows] if self.storage == 'int8' else None)
+
+    @property
+    def sq_norms(self):
+        """مربعات أطوال الصفوف (N,) محدثة تدريجياً لمحرك المطابقة"""
+        return self._sq_norms[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def _ensure_capacity(self, needed):
+        if needed <= self._matrix.shape[0]:
+            return
+        capacity = max(needed, self._matrix.shape[0] * 2)
+        grown = np.zeros((capacity, self.dim), dtype=self._matrix.dtype)
+        grown[:self.size] = self._matrix[:self.size]
+        self._matrix = grown
+        grown_scales = np.ones(capacity, dtype=np.float32)
+        grown_scales[:self.size] = self._scales[:self.size]
+        self._scales = grown_scales
+        grown_norms = np.zeros(capacity, dtype=np.float32)
+        grown_norms[:self.size] = self._sq_norms[:self.size]
+        self._sq_norms = grown_norms
+
+    def _parse_embedding(self, embedding):
+        """
+        Returns:
+            (البيانات بنوع التخزين, معامل التحجيم, إصدار البصمة) أو None
+        """
+        if embedding is None:
+            return None
+        try:
+            decoded = decode_embedding(embedding)
+        except ValueError:
+            return None
+        if decoded.data.shape[0] != self.dim:
+            return None
+        if decoded.dtype == self.storage:
+            # نفس صيغة التخزين: تُخزن كما وصلت بدون إعادة تكميم
+            return decoded.data, decoded.scale, decoded.version
+        vector = dequantize(decoded.data, [decoded.scale] if decoded.dtype == 'int8' else None)
+        data, scale = quantize(vector, self.storage)
+        return data, scale, decoded.version
+
+    def _parse_student(self, student):
+        """
+        Returns:
+            (البيانات, معامل التحجيم, الإصدار, البصمات المتعددة أو None) أو None
+        """
+        templates, version = decode_templates(student.get('embeddings'), self.dim)
+        if templates is None:
+            parsed = self._parse_embedding(student.get('embedding'))
+            return None if parsed is None else (*parsed, None)
+        data, scale = quantize(templates.mean(axis=0), self.storage)
+        return data, scale, version, templates if len(templates) > 1 else None
+
+    def upsert(self, students):
+        """
+        إضافة أو تحديث طلاب في المعرض
+        ('embedding' بصمة واحدة، أو 'embeddings' قائمة بصمات للطالب نفسه)
+
+        Returns:
+            (عدد المضاف, عدد المحدث, قائمة المعرفات المرفوضة)
+        """
+        added, updated, skipped = 0, 0, []
+        changed = []
+        with self.lock:
+            for student in students:
+                student_id = student.get('id')
+                parsed = self._parse_student(student)
+                if student_id is None or parsed is None:
+                    skipped.append(student_id)
+                    continue
+                data, scale, embedding_version, templates = parsed
+
+                student_id = str(student_id)
+                row = self.rows.get(student_id)
+                if row is None:
+                    self._ensure_capacity(self.size + 1)
+                    row = self.size
+                    self.size += 1
+                    self.ids.append(student_id)
+                    self.rows[student_id] = row
+                    added += 1
+                else:
+                    updated += 1
+
+                self._matrix[row] = data
+                self._scales[row] = scale
+                vector = self.vectors(row)
+                self._sq_norms[row] = np.dot(vector, vector)
+                self.students[student_id] = {
+                    'full_name': student.get('full_name'),
+                    'stage': student.get('stage'),
+                    'section': student.get('section'),
+                    'embedding_version': embedding_version,
+                }
+                if templates is None:
+                    self.templates.pop(student_id, None)
+                else:
+                    self.templates[student_id] = templates
+                changed.append(student_id)
+
+            if changed:
+                self._update_index(changed)
+                self._touch()
+        return added, updated, skipped
+
+    def remove(self, student_ids):
+        """حذف طلاب من المعرض بنقل الصف الأخير مكان الصف المحذوف"""
+        removed = 0
+        with self.lock:
+            for student_id in student_ids:
+                student_id = str(student_id)
+                row = self.rows.pop(student_id, None)
+                if row is None:
+                    continue
+                last = self.size - 1
+                if row != last:
+                    moved_id = self.ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._scales[row] = self._scales[last]
+                    self._sq_norms[row] = self._sq_norms[last]
+                    self.ids[row] = moved_id
+                    self.rows[moved_id] = row
+                self.ids.pop()
+                self.size -= 1
+                self.students.pop(student_id, None)
+                self.templates.pop(student_id, None)
+                if self.index is not None and self.index.is_trained:
+                    self.index.remove([student_id])
+                removed += 1
+
+            if removed:
+                self._touch()
+        return removed
+
+    def enable_index(self, params):
+        """
+        تفعيل فهرس IVF للمعرض (يُدرَّب عند وصول المعرض للحجم الكافي)
+        """
+        params = {key: value for key, value in (params or {}).items() if key not in ('type', 'dim', 'trained')}
+        unknown = set(params) - set(IVFIndex(dim=self.dim).params())
+        if unknown:
+            raise ValueError(f"إعدادات فهرس غير معروفة: {', '.join(sorted(unknown))}")
+        with self.lock:
+            self.index = IVFIndex(dim=self.dim, **params)
+            self._update_index(self.ids)
+
+    def _update_index(self, student_ids):
+        if self.index is None:
+            return
+        if not self.index.is_trained:
+            if self.size >= self.index.min_train_size:
+                self.index.build(self.vectors(), self.ids)
+            return
+        rows = [self.rows[student_id] for student_id in student_ids]
+        self.index.add(self.vectors(rows), student_ids)
+
+    def templates_at(self, row):
+        """بصمات الطالب في صف معين (None للطالب ببصمة واحدة)"""
+        return self.templates.get(self.ids[row])
+
+    def shard(self, key):
+        """
+        جزء المعرض لمفتاح shard_key (يُبنى عند أول طلب ويُحفظ حتى أول تعديل)
+        """
+        with self.lock:
+            shard = self._shards.get(key)
+            if shard is None:
+                rows = np.array([row for row, student_id in enumerate(self.ids)
+                                 if in_shard(self.students.get(student_id, {}), key)], dtype=np.intp)
+                shard = self._shards[key] = GalleryShard(
+                    rows,
+                    self._matrix[rows],
+                    self._scales[rows] if self.storage == 'int8' else None,
+                    self._sq_norms[rows]
+                )
+            return shard
+
+    def in_shard(self, student_id, key):
+        return in_shard(self.students.get(student_id, {}), key)
+
+    def shard_sizes(self):
+        """عدد الطلاب في كل جزء (مرحلة، شعبة)"""
+        with self.lock:
+            counts = Counter(tuple(info.get(field) for field in SHARD_FIELDS) for info in self.students.values())
+        return [
+            {**dict(zip(SHARD_FIELDS, values)), 'size': size}
+            for values, size in sorted(counts.items(), key=lambda item: tuple(str(v) for v in item[0]))
+        ]
+
+    def search(self, queries, matcher, k=5, nprobe=None, shard=None):
+        """
+        أفضل k صفوف لكل استعلام؛ عبر الفهرس التقريبي إن كان مفعلاً ومدرباً
+        مع وجود طلاب متعددي البصمات: قائمة مختصرة بالمراكز ثم أقرب بصمة
+
+        Args:
+            shard: مفتاح shard_key للبحث في طلاب الجزء فقط (بحث مباشر بدون الفهرس)
+        
+        Returns:
+            (rows, distances) بالشكل (Q, k) بأرقام صفوف المعرض؛ مع الفهرس قد ينتهي
+            الصف بـ -1 (مسافة inf) إذا لم تحوِ القوائم المفحوصة k عنصراً
+        """
+        with self.lock:
+            if self.templates:
+                search = two_stage_search(
+                    lambda q, shortlist: self._search(q, matcher, shortlist, nprobe, shard),
+                    self.templates_at,
+                    matcher.metric
+                )
+                return search(queries, k)
+            return self._search(queries, matcher, k, nprobe, shard)
+
+    def _search(self, queries, matcher, k, nprobe, shard=None):
+        if shard is not None:
+            part = self.shard(shard)
+            rows, distances = matcher.search(queries, part.matrix, k=k, sq_norms=part.sq_norms, scales=part.scales)
+            return part.rows[rows], distances
+
+        index = self.index
+        if index is None or not index.is_trained or index.metric != matcher.metric:
+            return matcher.search(queries, self.matrix, k=k, sq_norms=self.sq_norms, scales=self.scales)
+
+        # القوائم المفحوصة قد تحوي أقل من k عنصراً لبعض الاستعلامات: تُكمل الصفوف
+        # بـ -1 والمسافات بـ inf (في آخر الصف) حتى تكون النتيجة مصفوفة (Q, k)
+        found, distances = index.search(queries, k=k, nprobe=nprobe)
+        width = max([min(k, self.size)] + [len(ids) for ids in found])
+        rows = np.full((len(found), width), -1, dtype=np.intp)
+        padded = np.full((len(found), width), np.inf, dtype=np.float32)
+        for q, (ids, dist) in enumerate(zip(found, distances)):
+            rows[q, :len(ids)] = [self.rows[student_id] for student_id in ids]
+            padded[q, :len(ids)] = dist
+        return rows, padded
+
+    def clear(self):
+        with self.lock:
+            self.size = 0
+            self.ids = []
+            self.rows = {}
+            self.students = {}
+            self.templates = {}
+            if self.index is not None:
+                self.index = IVFIndex(**{k: v for k, v in self.index.params().items() if k != 'type'})
+            self._touch()
+
+    def _touch(self):
+        self._shards = {}
+        self.version += 1
+        self.updated_at = time.time()
+
+    def student_at(self, row):
+        """بيانات الطالب في صف معين بالشكل المستخدم في نتائج المطابقة"""
+        student_id = self.ids[row]
+        info = self.students.get(student_id, {})
+        return {
+            'id': student_id,
+            'full_name': info.get('full_name'),
+            'stage': info.get('stage'),
+        }
+
+    def stale_ids(self):
+        """الطلاب الذين سُجلت بصماتهم بإصدار أقدم من خوارزمية البصمة"""
+        return [
+            student_id for student_id, info in self.students.items()
+            if is_stale(info.get('embedding_version'))
+        ]
+
+    def info(self):
+        return {
+            'gallery_id': self.gallery_id,
+            'version': self.version,
+            'size': self.size,
+            'dim': self.dim,
+            'storage': self.storage,
+            'stale_count': len(self.stale_ids()),
+            'multi_template_students': len(self.templates),
+            'templates': self.size + sum(len(t) - 1 for t in self.templates.values()),
+            'shards': self.shard_sizes(),
+            'updated_at': self.updated_at,
+            'index': self._index_info(),
+        }
+
+    def _index_info(self):
+        if self.index is None:
+            return None
+        return {**self.index.params(), 'trained': self.index.is_trained}
+
+    @staticmethod
+    def _index_path(path):
+        """ملف الفهرس المنفصل في الإصدارات السابقة (يُقرأ فقط إن لم يكن الفهرس داخل المعرض)"""
+        return path[:-len('.npz')] + '.ivf.npz' if path.endswith('.npz') else path + '.ivf'
+
+    def save(self, path):
+        """
+        حفظ المعرض بشكل ذري حتى تراه بقية عمليات gunicorn
+        الفهرس محفوظ داخل نفس الملف فلا تقرأ عملية أخرى معرضاً بفهرس من إصدار آخر
+        """
+        with self.lock:
+            meta = {
+                'gallery_id': self.gallery_id,
+                'version': self.version,
+                'storage': self.storage,
+                'updated_at': self.updated_at,
+                'ids': self.ids,
+                'students': self.students,
+                'index': self._index_info(),
+                'templates': [[student_id, len(t)] for student_id, t in self.templates.items()],
+            }
+            arrays = {}
+            if self.index is not None and self.index.is_trained:
+                buffer = io.BytesIO()
+                self.index.save(buffer)
+                arrays['index'] = np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+
+            templates = (np.concatenate(list(self.templates.values())) if self.templates
+                         else np.empty((0, self.dim), dtype=np.float32))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, matrix=self.matrix, scales=self._scales[:self.size], templates=templates,
+                         meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            matrix = data['matrix']
+            scales = data['scales'] if 'scales' in data.files else None
+            templates = data['templates'] if 'templates' in data.files else None
+            index = data['index'].tobytes() if 'index' in data.files else None
+            meta = json.loads(str(data['meta']))
+
+        gallery = cls(meta['gallery_id'], dim=matrix.shape[1], capacity=matrix.shape[0],
+                      storage=meta.get('storage', 'float32'))
+        gallery._matrix[:matrix.shape[0]] = matrix
+        if scales is not None:
+            gallery._scales[:matrix.shape[0]] = scales
+        gallery.size = matrix.shape[0]
+        gallery._sq_norms[:gallery.size] = squared_norms(gallery.matrix, gallery.scales)
+        gallery.ids = list(meta['ids'])
+        gallery.rows = {student_id: row for row, student_id in enumerate(gallery.ids)}
+        gallery.students = meta['students']
+        start = 0
+        for student_id, count in meta.get('templates', []):
+            gallery.templates[student_id] = templates[start:start + count]
+            start += count
+        gallery.version = meta['version']
+        gallery.updated_at = meta['updated_at']
+
+        index_info = meta.get('index')
+        if index_info:
+            index_path = cls._index_path(path)
+            if index is not None:
+                gallery.index = IVFIndex.load(io.BytesIO(index))
+            elif index_info.get('trained') and os.path.exists(index_path):
+                gallery.index = IVFIndex.load(index_path)
+            if gallery.index is None or set(gallery.index._labels) != set(gallery.rows):
+                # فهرس قديم منفصل لا يطابق طلاب المعرض: إعادة البناء
+                gallery.enable_index(index_info)
+        return gallery
+
+
+class GalleryRegistry:
+    """
+    سجل المعارض المسجلة
+    المعارض محفوظة في الذاكرة ومنسوخة إلى القرص لمشاركتها بين عمليات gunicorn
+
+    التعديل (تسجيل، تحديث، حذف) يتم داخل قفل ملف لكل معرض (flock على ملف .lock
+    بجانبه): إعادة تحميل آخر نسخة على القرص ثم التعديل ثم الحفظ، فلا يضيع تعديل
+    عملية أخرى ولا يتكرر رقم الإصدار
+
+    Args:
+        max_galleries: أقصى عدد معارض في ذاكرة العملية (الأقدم استخداماً يُزال من
+                       الذاكرة فقط ويُعاد تحميله من القرص عند الطلب)
+        ttl: المعرض الذي لم يُسجل أو يُعدّل منذ ttl ثانية يُحذف من القرص مع ملف قفله
+             (الصفحة تعيد التسجيل عند 404)
+    """
+
+    def __init__(self, storage_dir=None, max_galleries=None, ttl=None):
+        self.storage_dir = storage_dir or os.environ.get('FACE_GALLERY_DIR', DEFAULT_GALLERY_DIR)
+        self.max_galleries = max_galleries or int(os.environ.get('FACE_GALLERY_MAX', 32))
+        self.ttl = ttl if ttl is not None else float(os.environ.get('FACE_GALLERY_TTL_HOURS', 168)) * 3600
+        self._galleries = OrderedDict()
+        self._mtimes = {}
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    @staticmethod
+    def _valid_id(gallery_id):
+        return bool(gallery_id) and all(c.isalnum() or c in '-_' for c in gallery_id)
+
+    def _path(self, gallery_id):
+        return os.path.join(self.storage_dir, f"{gallery_id}.npz")
+
+    @contextmanager
+    def _file_lock(self, gallery_id):
+        """
+        قفل حصري بين العمليات (والخيوط) لتعديل معرض واحد
+        الحذف يزيل ملف القفل وهو مقفل، فمن انتظر على الملف المحذوف يعيد المحاولة
+        على الملف الجديد حتى لا يحمل عمليتان قفلين مختلفين لنفس المعرض
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.storage_dir, exist_ok=True)
+        lock_path = self._path(gallery_id) + '.lock'
+        while True:
+            f = open(lock_path, 'a')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                current = os.stat(lock_path).st_ino == os.fstat(f.fileno()).st_ino
+            except OSError:
+                current = False
+            if current:
+                break
+            f.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    @staticmethod
+    def _stamp(path):
+        """
+        بصمة نسخة الملف: الحفظ الذري ينشئ ملفاً جديداً (inode جديد) فلا تتشابه
+        نسختان حُفظتا في نفس نبضة ساعة نظام الملفات
+        """
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+    def _persist(self, gallery):
+        try:
+            os.makedirs(self.storage_dir, exist_ok=True)
+            path = self._path(gallery.gallery_id)
+            gallery.save(path)
+            self._mtimes[gallery.gallery_id] = self._stamp(path)
+        except OSError as e:
+            logger.warning(f"تعذر حفظ المعرض {gallery.gallery_id}: {e}")
+
+    def get(self, gallery_id):
+        """
+        جلب معرض مسجل، مع إعادة تحميله إذا عدّلته عملية أخرى
+        """
+        if not self._valid_id(gallery_id):
+            return None
+
+        path = self._path(gallery_id)
+        with self._lock:
+            gallery = self._galleries.get(gallery_id)
+            try:
+                mtime = self._stamp(path)
+            except OSError:
+                mtime = None
+
+            if mtime is None and gallery_id in self._mtimes:
+                # حُذف المعرض من عملية أخرى
+                self._galleries.pop(gallery_id, None)
+                self._mtimes.pop(gallery_id, None)
+                return None
+
+            if mtime is not None and mtime != self._mtimes.get(gallery_id):
+                try:
+                    gallery = FaceGallery.load(path)
+                    self._remember(gallery)
+                    self._mtimes[gallery_id] = mtime
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"تعذر تحميل المعرض {gallery_id}: {e}")
+            elif gallery is not None:
+                self._galleries.move_to_end(gallery_id)
+            return gallery
+
+    def _remember(self, gallery):
+        """إضافة المعرض للذاكرة وإزالة الأقدم استخداماً بعد max_galleries (داخل self._lock)"""
+        self._galleries[gallery.gallery_id] = gallery
+        self._galleries.move_to_end(gallery.gallery_id)
+        while len(self._galleries) > self.max_galleries:
+            evicted, _ = self._galleries.popitem(last=False)
+            self._mtimes.pop(evicted, None)
+
+    def register(self, students, gallery_id=None, index=None, storage='float32'):
+        """
+        تسجيل قائمة طلاب كاملة (تستبدل المحتوى السابق إن وجد)
+        
+        Args:
+            index: إعدادات فهرس IVF اختيارية للمعارض الكبيرة
+                   مثل {'type': 'ivf', 'nlist': 256, 'nprobe': 8, 'pq_m': 0}
+            storage: نوع تخزين البصمات 'float32' أو 'float16' أو 'int8'
+        """
+        gallery_id = gallery_id or uuid.uuid4().hex[:12]
+        if not self._valid_id(gallery_id):
+            raise ValueError('معرف المعرض غير صالح')
+        self.purge()
+
+        with self._file_lock(gallery_id):
+            previous = self.get(gallery_id)
+            with self._lock:
+                gallery = FaceGallery(gallery_id, capacity=len(students), storage=storage)
+                if previous is not None:
+                    gallery.version = previous.version
+                if index:
+                    gallery.enable_index(index)
+                added, _, skipped = gallery.upsert(students)
+                if not added:
+                    gallery._touch()
+                self._remember(gallery)
+                self._persist(gallery)
+        return gallery, skipped
+
+    def update(self, gallery_id, upsert=None, remove=None):
+        """تحديث تدريجي لمعرض مسجل (على آخر نسخة محفوظة)"""
+        if not self._valid_id(gallery_id):
+            return None, []
+
+        with self._file_lock(gallery_id):
+            gallery = self.get(gallery_id)
+            if gallery is None:
+                return None, []
+
+            with self._lock:
+                removed = gallery.remove(remove or [])
+                added, updated, skipped = gallery.upsert(upsert or [])
+                if removed or added or updated:
+                    self._persist(gallery)
+        return gallery, skipped
+
+    def delete(self, gallery_id):
+        if not self._valid_id(gallery_id):
+            return False
+        with self._file_lock(gallery_id), self._lock:
+            existed = self._galleries.pop(gallery_id, None) is not None
+            return self._remove_files(gallery_id) or existed
+
+    def _remove_files(self, gallery_id):
+        """حذف ملفات المعرض وملف قفله (داخل قفل الملف)"""
+        self._mtimes.pop(gallery_id, None)
+        path = self._path(gallery_id)
+        existed = False
+        for name in (path, FaceGallery._index_path(path), path + '.lock'):
+            try:
+                os.remove(name)
+                existed = existed or name == path
+            except OSError:
+                pass
+        return existed
+
+    def purge(self, now=None, force=False):
+        """
+        حذف المعارض المنتهية (لم تُسجل أو تُعدّل منذ ttl) من القرص والذاكرة
+        يُستدعى مع التسجيل، مرة كل PURGE_INTERVAL ثانية على الأكثر لكل عملية
+
+        Returns:
+            معرفات المعارض المحذوفة
+        """
+        now = time.time() if now is None else now
+        if self.ttl <= 0 or (not force and now - self._last_purge < PURGE_INTERVAL):
+            return []
+        self._last_purge = now
+        try:
+            names = os.listdir(self.storage_dir)
+        except OSError:
+            return []
+
+        gallery_ids = {
+            name[:-len(suffix)] for name in names for suffix in ('.npz', '.npz.lock')
+            if name.endswith(suffix) and not name.endswith('.ivf.npz')
+        }
+        purged = []
+        for gallery_id in sorted(gallery_ids):
+            if not self._valid_id(gallery_id) or not self._expired(gallery_id, now):
+                continue
+            with self._file_lock(gallery_id), self._lock:
+                # قد تكون عملية أخرى أعادت تسجيله قبل الحصول على القفل
+                if self._expired(gallery_id, now):
+                    self._galleries.pop(gallery_id, None)
+                    self._remove_files(gallery_id)
+                    purged.append(gallery_id)
+        if purged:
+            logger.info(f"تم حذف {len(purged)} معرض منتهي الصلاحية")
+        return purged
+
+    def _expired(self, gallery_id, now):
+        """لم يُحفظ منذ ttl، أو ملف قفل بقي بدون معرض (تحديث معرف غير موجود مثلاً)"""
+        path = self._path(gallery_id)
+        try:
+            return os.stat(path).st_mtime + self.ttl <= now
+        except OSError:
+            return os.path.exists(path + '.lock')
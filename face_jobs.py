@@ -0,0 +1,459 @@
+"""
+مهام الوجه غير المتزامنة - Asynchronous Face Jobs
+العمليات الطويلة (تسجيل دفعة طلاب، إعادة استخراج البصمات، إعادة بناء المعارض) تُرسل
+كمهمة وتُرجع معرفاً فوراً، ويتابع العميل الحالة والتقدم ثم يجلب النتيجة
+
+- المهام محفوظة في SQLite محلي (instance/face_jobs.sqlite3 أو FACE_JOBS_DB) مشترك
+  بين عمليات gunicorn
+- كل عملية gunicorn تشغّل منفذاً (JobRunner) يحجز المهام المنتظرة من القاعدة،
+  والعدد الكلي للمهام الجارية محدود بـ FACE_JOB_CONCURRENCY في كل العمليات
+- استخراج البصمات داخل المهمة يتم في مجموعة العمليات (face_batch)، فلا تنشغل خيوط
+  الطلبات التفاعلية
+- المهمة الجارية محجوزة بعقد (lease) يجدده المنفذ كل ثانية. إذا توقفت العملية
+  (إعادة تشغيل أو انهيار) ينتهي العقد وتعود المهمة للانتظار لتنفذها عملية أخرى،
+  حتى FACE_JOB_MAX_ATTEMPTS محاولات
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from face_metrics import face_metrics
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DB = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'face_jobs.sqlite3'
+)
+
+JOB_CONCURRENCY = int(os.environ.get('FACE_JOB_CONCURRENCY', 1))
+LEASE_SECONDS = float(os.environ.get('FACE_JOB_LEASE_SECONDS', 30))
+MAX_ATTEMPTS = int(os.environ.get('FACE_JOB_MAX_ATTEMPTS', 3))
+RETENTION_SECONDS = float(os.environ.get('FACE_JOB_RETENTION_HOURS', 168)) * 3600
+POLL_INTERVAL = 1.0
+
+# أقل فاصل بين كتابتي تقدم لنفس المهمة
+PROGRESS_INTERVAL = 0.5
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobCancelled(Exception):
+    """طلب إلغاء المهمة أثناء تنفيذها"""
+
+
+class JobStore(SQLiteStore):
+    """
+    مخزن المهام في SQLite
+    الحجز داخل معاملة BEGIN IMMEDIATE حتى لا تحجز عمليتان نفس المهمة
+    """
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path=None):
+        super().__init__(path or os.environ.get('FACE_JOBS_DB', DEFAULT_JOBS_DB))
+
+    @staticmethod
+    def _row(row, with_result=False):
+        if row is None:
+            return None
+        job = {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'done': row['done'],
+            'total': row['total'],
+            'progress': row['done'] / row['total'] if row['total'] else (1.0 if row['status'] == SUCCEEDED else 0.0),
+            'attempts': row['attempts'],
+            'cancel_requested': bool(row['cancel_requested']),
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+        }
+        if with_result:
+            job['result'] = json.loads(row['result']) if row['result'] else None
+        return job
+
+    def create(self, kind, params):
+        job_id = uuid.uuid4().hex
+        with self._transaction() as db:
+            db.execute(
+                'INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, QUEUED, json.dumps(params), time.time())
+            )
+            return self._row(db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def get(self, job_id, with_result=False):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row(row, with_result)
+
+    def claim(self, owner, limit=None):
+        """
+        حجز أقدم مهمة منتظرة إذا كان عدد المهام الجارية أقل من الحد
+
+        Returns:
+            (المهمة, المعاملات) أو None
+        """
+        limit = limit or JOB_CONCURRENCY
+        now = time.time()
+        with self._transaction() as db:
+            running = db.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (RUNNING,)).fetchone()[0]
+            if running >= limit:
+                return None
+            row = db.execute(
+                'SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1', (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                'UPDATE jobs SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1, '
+                'started_at = ?, done = 0 WHERE id = ?',
+                (RUNNING, owner, now + LEASE_SECONDS, now, row['id'])
+            )
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone()
+            return self._row(row), json.loads(row['params'])
+
+    def renew(self, owner):
+        """تجديد عقود كل المهام الجارية في هذه العملية"""
+        self._connect().execute(
+            'UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?',
+            (time.time() + LEASE_SECONDS, owner, RUNNING)
+        )
+
+    def progress(self, job_id, owner, done, total):
+        """
+        Returns:
+            True إذا طُلب إلغاء المهمة أو لم تعد محجوزة لهذه العملية
+        """
+        db = self._connect()
+        db.execute(
+            'UPDATE jobs SET done = ?, total = ? WHERE id = ? AND owner = ? AND status = ?',
+            (done, total, job_id, owner, RUNNING)
+        )
+        row = db.execute('SELECT status, owner, cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row is None or row['cancel_requested'] or row['owner'] != owner or row['status'] != RUNNING
+
+    def finish(self, job_id, owner, status, result=None, error=None):
+        """حفظ النتيجة النهائية (المعاملات تُحذف، فقد تحوي صوراً كبيرة)"""
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL, "
+                "params = '{}' WHERE id = ? AND owner = ? AND status = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(),
+                 job_id, owner, RUNNING)
+            ).rowcount
+        return bool(updated)
+
+    def cancel(self, job_id):
+        """إلغاء مهمة منتظرة فوراً، أو طلب إلغاء مهمة جارية"""
+        with self._transaction() as db:
+            row = db.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row['status'] == QUEUED:
+                db.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, params = '{}' WHERE id = ?",
+                    (CANCELLED, time.time(), job_id)
+                )
+            elif row['status'] == RUNNING:
+                db.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+            return self._row(db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def recover(self):
+        """
+        إعادة المهام التي انتهى عقدها (توقفت عمليتها) إلى الانتظار،
+        أو إفشالها بعد MAX_ATTEMPTS محاولات
+
+        Returns:
+            عدد المهام المستعادة
+        """
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, owner = NULL, lease_until = NULL, params = '{}' "
+                "WHERE status = ? AND lease_until < ? AND cancel_requested = 1",
+                (CANCELLED, now, RUNNING, now)
+            )
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, owner = NULL, lease_until = NULL, "
+                "params = '{}' WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, 'توقفت العملية المنفذة للمهمة', now, RUNNING, now, MAX_ATTEMPTS)
+            )
+            return db.execute(
+                'UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, done = 0 '
+                'WHERE status = ? AND lease_until < ?',
+                (QUEUED, RUNNING, now)
+            ).rowcount
+
+    def purge(self, older_than=None):
+        """حذف المهام المنتهية الأقدم من مدة الاحتفاظ"""
+        cutoff = time.time() - (RETENTION_SECONDS if older_than is None else older_than)
+        return self._connect().execute(
+            'DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?', (*FINISHED, cutoff)
+        ).rowcount
+
+
+# ----------------------------------------------------------------------
+# أنواع المهام
+# ----------------------------------------------------------------------
+def _validate_images(params):
+    images = params.get('images')
+    if not images or not isinstance(images, list):
+        raise ValueError('لم يتم إرسال صور')
+    _validate_format(params)
+
+
+def _validate_format(params):
+    from face_embedding_codec import EMBEDDING_FORMATS
+
+    embedding_format = params.get('embedding_format', 'list')
+    if embedding_format not in EMBEDDING_FORMATS:
+        raise ValueError(f'صيغة بصمة غير معروفة: {embedding_format}')
+
+
+def _validate_gallery(params):
+    from face_embedding_codec import DTYPES
+    from face_gallery import GalleryRegistry
+
+    students = params.get('students')
+    if not isinstance(students, list):
+        raise ValueError('قائمة الطلاب غير صالحة')
+    if params.get('gallery_id') and not GalleryRegistry._valid_id(params['gallery_id']):
+        raise ValueError('معرف المعرض غير صالح')
+    index = params.get('index')
+    if index and not isinstance(index, dict):
+        raise ValueError('إعدادات الفهرس غير صالحة')
+    if index and index.get('type', 'ivf') != 'ivf':
+        raise ValueError('نوع الفهرس غير مدعوم')
+    storage = params.get('storage', 'float32')
+    if storage not in DTYPES:
+        raise ValueError(f'نوع تخزين غير معروف: {storage}')
+    _validate_format(params)
+
+
+def _run_extract_embeddings(params, progress):
+    """
+    استخراج بصمات دفعة صور (تسجيل أو إعادة استخراج)
+    params: {'images': [...], 'embedding_format': 'list'} كما في /api/face/extract-embeddings
+    """
+    from face_batch import batch_extractor
+    from face_embedding import EMBEDDING_VERSION
+
+    images = params['images']
+    embedding_format = params.get('embedding_format', 'list')
+    results = [None] * len(images)
+    progress(0, len(images))
+    for done, item in enumerate(batch_extractor.extract_stream(images, embedding_format), 1):
+        results[item['index']] = item
+        progress(done, len(images))
+    return {
+        'results': results,
+        'embedding_version': EMBEDDING_VERSION,
+        'embedding_format': embedding_format,
+    }
+
+
+def _run_build_gallery(params, progress):
+    """
+    بناء معرض (أو إعادة بنائه) من قائمة طلاب
+    الطلاب الذين أُرسلت صورتهم ('image') أو عدة صور ('images'، لقطات تسجيل متعددة)
+    بدل البصمة تُستخرج بصمتهم أولاً، وتُرجع البصماتُ الجديدة في 'embeddings'
+    ليحفظها العميل (قائمة بصمات لمن أُرسلت له عدة صور)
+    """
+    from face_batch import batch_extractor
+    from face_embedding import EMBEDDING_VERSION
+    from face_embedding_codec import format_embedding
+    from face_loader import load
+
+    students = params['students']
+    embedding_format = params.get('embedding_format', 'list')
+    # (رقم الطالب, الصورة) لكل صورة تحتاج استخراجاً
+    pending = []
+    for i, student in enumerate(students):
+        if student.get('embedding') or student.get('embeddings'):
+            continue
+        if student.get('images'):
+            pending.extend((i, image) for image in student['images'])
+        elif student.get('image'):
+            pending.append((i, student['image']))
+    total = len(pending) + 1
+    embeddings, failed = {}, []
+
+    progress(0, total)
+    extracted = {}
+    for done, item in enumerate(batch_extractor.extract_stream([image for _, image in pending]), 1):
+        i = pending[item['index']][0]
+        if item['success']:
+            extracted.setdefault(i, []).append(item['embedding'])
+        else:
+            failed.append({'id': students[i].get('id'), 'error': item['error']})
+        progress(done, total)
+
+    for i, vectors in extracted.items():
+        student = students[i]
+        if student.get('images'):
+            student['embeddings'] = vectors
+            embeddings[student.get('id')] = [format_embedding(v, embedding_format) for v in vectors]
+        else:
+            student['embedding'] = vectors[0]
+            embeddings[student.get('id')] = format_embedding(vectors[0], embedding_format)
+    for student in students:
+        student.pop('image', None)
+        student.pop('images', None)
+
+    gallery, skipped = load().galleries.register(
+        students,
+        gallery_id=params.get('gallery_id'),
+        index=params.get('index'),
+        storage=params.get('storage', 'float32')
+    )
+    progress(total, total)
+    return {
+        **gallery.info(),
+        'skipped': skipped,
+        'stale_embeddings': gallery.stale_ids(),
+        'failed': failed,
+        'embeddings': embeddings,
+        'embedding_version': EMBEDDING_VERSION,
+        'embedding_format': embedding_format,
+    }
+
+
+# النوع -> (التحقق عند الإرسال, التنفيذ)
+JOB_KINDS = {
+    'extract_embeddings': (_validate_images, _run_extract_embeddings),
+    'build_gallery': (_validate_gallery, _run_build_gallery),
+}
+
+
+class JobRunner:
+    """
+    منفذ المهام داخل عملية gunicorn واحدة
+    خيط يحجز المهام من المخزن ويجدد عقودها، وخيط لكل مهمة جارية
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._active = set()
+        self._last_purge = 0.0
+
+    def start(self):
+        """تشغيل المنفذ مرة واحدة في كل عملية (بعد fork يبدأ منفذ جديد)"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self.owner = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:6]}"
+                self._active = set()
+                self._thread = threading.Thread(target=self._loop, name='face-jobs', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        self._wake.set()
+
+    def submit(self, kind, params):
+        if kind not in JOB_KINDS:
+            raise ValueError(f'نوع مهمة غير معروف: {kind}')
+        JOB_KINDS[kind][0](params)
+        job = self.store.create(kind, params)
+        face_metrics.inc('face_jobs_total', kind=kind, status=QUEUED)
+        self.start()
+        self.notify()
+        return job
+
+    def _loop(self):
+        while True:
+            try:
+                if self._active:
+                    self.store.renew(self.owner)
+                self.store.recover()
+                while True:
+                    claimed = self.store.claim(self.owner)
+                    if claimed is None:
+                        break
+                    job, params = claimed
+                    self._active.add(job['job_id'])
+                    threading.Thread(
+                        target=self._run, args=(job, params), name=f"face-job-{job['job_id'][:8]}", daemon=True
+                    ).start()
+                if time.monotonic() - self._last_purge > 3600:
+                    self.store.purge()
+                    self._last_purge = time.monotonic()
+            except Exception as e:
+                logger.warning(f"خطأ في منفذ المهام: {e}")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _run(self, job, params):
+        job_id, kind = job['job_id'], job['kind']
+        last_write = [0.0]
+
+        def progress(done, total):
+            now = time.monotonic()
+            if done < total and now - last_write[0] < PROGRESS_INTERVAL:
+                return
+            last_write[0] = now
+            if self.store.progress(job_id, self.owner, done, total):
+                raise JobCancelled()
+
+        start = time.perf_counter()
+        status, result, error = SUCCEEDED, None, None
+        try:
+            with face_metrics.endpoint(f'job_{kind}'):
+                result = JOB_KINDS[kind][1](params, progress)
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as e:
+            import traceback
+            logger.error(f"فشل المهمة {job_id} ({kind}): {e}")
+            logger.error(traceback.format_exc())
+            face_metrics.error(e)
+            status, error = FAILED, str(e)
+        finally:
+            self._active.discard(job_id)
+
+        if self.store.finish(job_id, self.owner, status, result, error):
+            face_metrics.inc('face_jobs_total', kind=kind, status=status)
+            face_metrics.observe('face_job_seconds', time.perf_counter() - start, kind=kind, endpoint=f'job_{kind}')
+            face_metrics.maybe_flush()
+        else:
+            logger.warning(f"المهمة {job_id} لم تعد محجوزة لهذه العملية، تم تجاهل نتيجتها")
+        self.notify()
+
+
+job_store = JobStore()
+job_runner = JobRunner(job_store)
@@ -0,0 +1,145 @@
+"""
+تحميل نظام الوجه عند الحاجة - Lazy Face Subsystem Loading
+استيراد face_recognition_service يحمّل cv2 و NumPy و PIL ونماذج الكشف، وكان يحدث في
+كل عملية gunicorn حتى التي لا تخدم إلا صفحات القوالب
+
+FACE_LOAD:
+    lazy     (افتراضي) التحميل عند أول طلب وجه في كل عملية
+    eager    التحميل عند استيراد app (السلوك السابق)
+    preload  التحميل مرة واحدة في عملية gunicorn الرئيسية قبل fork، فتتشارك العمليات
+             صفحات الذاكرة (copy-on-write). يفعّل preload_app في gunicorn.conf.py
+
+FACE_WARMUP=1: تشغيل كشف وبصمة على صورة صغيرة في كل عملية بعد بدئها، على كل خيط
+من مجموعة الكشف (الكاشفات نسخة لكل خيط)، فلا يدفع أول طلب حقيقي تكلفة التهيئة.
+الافتراضي مفعّل مع preload فقط
+"""
+
+import importlib
+import logging
+import os
+import threading
+import time
+
+from face_metrics import face_metrics
+
+logger = logging.getLogger(__name__)
+
+LOAD_MODES = ('lazy', 'eager', 'preload')
+
+FACE_LOAD = os.environ.get('FACE_LOAD', 'lazy')
+if FACE_LOAD not in LOAD_MODES:
+    logger.warning(f"FACE_LOAD غير معروف: {FACE_LOAD} - استخدام lazy")
+    FACE_LOAD = 'lazy'
+
+_lock = threading.Lock()
+_service = None
+
+# أزمنة التحميل والتسخين في هذه العملية (ثوانٍ)، وعدد خيوط الكشف المسخّنة
+startup = {'mode': FACE_LOAD, 'load_seconds': None, 'warmup_seconds': None, 'warmup_threads': 0}
+
+# أقصى انتظار لاجتماع مهام التسخين على خيوط مختلفة (الخيوط المشغولة بطلبات تُترك)
+WARMUP_GATHER_SECONDS = 10.0
+
+
+def loaded():
+    return _service is not None
+
+
+def load():
+    """تحميل خدمة الوجه مرة واحدة في العملية (آمن للخيوط)"""
+    global _service
+    if _service is not None:
+        return _service
+    with _lock:
+        if _service is None:
+            start = time.perf_counter()
+            module = importlib.import_module('face_recognition_service')
+            startup['load_seconds'] = time.perf_counter() - start
+            logger.info(f"✓ تحميل نظام الوجه ({FACE_LOAD}): {startup['load_seconds'] * 1000:.0f}ms")
+            _service = module.face_service
+    return _service
+
+
+class _LazyService:
+    """واجهة face_service: أول وصول لأي خاصية يحمّل الخدمة"""
+
+    def __getattr__(self, name):
+        if _service is None:
+            # زمن التحميل داخل أول طلب يظهر كمرحلة 'load' في مقاييس ذلك الطلب
+            with face_metrics.stage('load'):
+                load()
+        return getattr(_service, name)
+
+
+face_service = _LazyService()
+
+
+def _warm_thread(service, gather):
+    """تسخين خيط الكشف الحالي: نسخة كاشف كل مسار وبصمة واحدة"""
+    import numpy as np
+
+    try:
+        image = np.full((240, 320), 128, dtype=np.uint8)
+        for profile in service.detectors.profiles:
+            service.detectors.get(profile).detect(image)
+        service._compute_face_embedding(np.full((64, 64, 3), 128, dtype=np.uint8))
+    finally:
+        # إبقاء الخيط مشغولاً حتى تصل بقية المهام فتذهب كل منها لخيط جديد
+        try:
+            gather.wait(WARMUP_GATHER_SECONDS)
+        except threading.BrokenBarrierError:
+            pass
+    return threading.get_ident()
+
+
+def warm_up(pool=None):
+    """
+    تسخين العملية: تحميل الخدمة ثم مهمة تسخين على كل خيط من مجموعة الكشف
+    (الكاشفات نسخة لكل خيط، فالتسخين في خيط آخر لا يفيد الطلبات)
+
+    Returns:
+        عدد الخيوط المسخّنة
+    """
+    from face_workers import PoolSaturated, detection_pool
+
+    pool = pool or detection_pool
+    start = time.perf_counter()
+    service = load()
+
+    gather = threading.Barrier(pool.max_workers)
+    futures = []
+    for _ in range(pool.max_workers):
+        try:
+            futures.append(pool.submit(_warm_thread, service, gather))
+        except PoolSaturated:
+            break
+    if len(futures) < pool.max_workers:
+        gather.abort()
+    threads = set()
+    for future in futures:
+        try:
+            threads.add(future.result())
+        except Exception as e:
+            logger.warning(f"تعذر تسخين خيط كشف: {e}")
+    warmed = len(threads)
+
+    startup['warmup_seconds'] = time.perf_counter() - start
+    startup['warmup_threads'] = warmed
+    face_metrics.observe('face_stage_seconds', startup['warmup_seconds'], stage='warmup', endpoint='startup')
+    logger.info(f"✓ تسخين نظام الوجه ({warmed} خيط كشف): {startup['warmup_seconds'] * 1000:.0f}ms")
+    return warmed
+
+
+def warm_up_in_background():
+    thread = threading.Thread(target=warm_up, name='face-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def warmup_enabled():
+    default = '1' if FACE_LOAD == 'preload' else '0'
+    return os.environ.get('FACE_WARMUP', default) in ('1', 'true', 'yes', 'on')
+
+
+if FACE_LOAD in ('eager', 'preload'):
+    load()
@@ -0,0 +1,370 @@
+"""
+محرك مطابقة البصمات - Vectorized Face Matcher
+حساب جميع المسافات بعملية مصفوفات واحدة (BLAS) واختيار أفضل k بفرز جزئي
+
+حدود المطابقة: القيم الافتراضية أدناه، أو الحدود المعايرة على قائمة الطلاب الفعلية
+(benchmarks/calibrate_thresholds.py) من ملف FACE_THRESHOLDS_FILE عند بدء التشغيل
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('euclidean', 'cosine')
+
+# حد المطابقة لكل مقياس (يُستبدل بالقيم المعايرة إن وُجد ملفها)
+DEFAULT_THRESHOLDS = {
+    'euclidean': 50.0,
+    'cosine': 0.5,
+}
+
+DEFAULT_THRESHOLDS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'face_thresholds.json'
+)
+
+
+# عدد الطلاب المرشحين بمراكز بصماتهم قبل المقارنة مع بصمات كل منهم (انظر two_stage_search)
+TEMPLATE_SHORTLIST = int(os.environ.get('FACE_TEMPLATE_SHORTLIST', 20))
+
+# عدد الصفوف المحوّلة إلى float32 في كل مرة عند المطابقة على بيانات float16/int8
+QUANTIZED_CHUNK_ROWS = 4096
+
+
+def load_thresholds(path=None):
+    """
+    تحميل الحدود المعايرة إلى DEFAULT_THRESHOLDS (المقاييس غير الموجودة في الملف
+    تبقى على قيمها الافتراضية)
+
+    الملف: {"thresholds": {"euclidean": 41.7, ...}, "target_far": 0.001, ...}
+
+    Returns:
+        الحدود المحملة من الملف
+    """
+    path = path or os.environ.get('FACE_THRESHOLDS_FILE', DEFAULT_THRESHOLDS_FILE)
+    try:
+        with open(path, encoding='utf-8') as f:
+            thresholds = json.load(f).get('thresholds', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"تعذر قراءة ملف حدود المطابقة {path}: {e}")
+        return {}
+
+    loaded = {}
+    for metric, value in thresholds.items():
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = None
+        if metric not in METRICS or not value or value <= 0:
+            logger.warning(f"حد مطابقة غير صالح في {path}: {metric}={thresholds[metric]}")
+            continue
+        loaded[metric] = value
+    DEFAULT_THRESHOLDS.update(loaded)
+    if loaded:
+        logger.info(f"✓ حدود المطابقة المعايرة: {loaded}")
+    return loaded
+
+
+def _chunks(matrix, scales=None):
+    """أجزاء المصفوفة كـ float32 (بدون نسخ إن كانت float32 أصلاً)"""
+    if matrix.dtype == np.float32 and scales is None:
+        yield 0, matrix
+        return
+    for start in range(0, matrix.shape[0], QUANTIZED_CHUNK_ROWS):
+        block = matrix[start:start + QUANTIZED_CHUNK_ROWS].astype(np.float32)
+        if scales is not None:
+            block *= scales[start:start + QUANTIZED_CHUNK_ROWS, None]
+        yield start, block
+
+
+def squared_norms(matrix, scales=None):
+    """مربعات أطوال الصفوف (N,) مع مراعاة التحجيم للبيانات الكمية"""
+    if matrix.dtype == np.float32 and scales is None:
+        return np.einsum('ij,ij->i', matrix, matrix)
+    norms = np.empty(matrix.shape[0], dtype=np.float32)
+    for start, block in _chunks(matrix, scales):
+        norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+    return norms
+
+
+def _dots(queries, matrix, scales=None):
+    """حاصل الضرب (Q, N)؛ البيانات المضغوطة تُحوّل جزءاً بجزء فلا تُفك المصفوفة كاملة"""
+    if matrix.dtype == np.float32 and scales is None:
+        return queries @ matrix.T
+    dots = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+    for start, block in _chunks(matrix, scales):
+        np.matmul(queries, block.T, out=dots[:, start:start + len(block)])
+    return dots
+
+
+def pairwise_distances(queries, matrix, metric='euclidean', sq_norms=None, scales=None):
+    """
+    مصفوفة المسافات (Q, N) بين الاستعلامات وصفوف المعرض باستدعاء GEMM واحد
+
+    Args:
+        queries: (Q, dim) أو (dim,)
+        matrix: (N, dim) float32 أو float16 أو int8
+        metric: 'euclidean' أو 'cosine' (1 - تشابه جيب التمام)
+        sq_norms: مربعات أطوال صفوف المعرض إن كانت محسوبة مسبقاً
+        scales: معامل تحجيم لكل صف عندما تكون المصفوفة int8
+    """
+    if metric not in METRICS:
+        raise ValueError(f'مقياس غير معروف: {metric}')
+
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if sq_norms is None:
+        sq_norms = squared_norms(matrix, scales)
+
+    dots = _dots(queries, matrix, scales)
+    query_sq = squared_norms(queries)
+
+    if metric == 'euclidean':
+        # ||q - m||² = ||q||² + ||m||² - 2 q·m
+        dots *= -2.0
+        dots += query_sq[:, None]
+        dots += sq_norms[None, :]
+        np.maximum(dots, 0.0, out=dots)
+        return np.sqrt(dots, out=dots)
+
+    denom = np.sqrt(query_sq)[:, None] * np.sqrt(sq_norms)[None, :]
+    np.maximum(denom, 1e-12, out=denom)
+    dots /= denom
+    np.subtract(1.0, dots, out=dots)
+    np.maximum(dots, 0.0, out=dots)
+    return dots
+
+
+def top_k(distances, k):
+    """
+    أفضل k صفوف لكل استعلام بفرز جزئي (argpartition) بدلاً من فرز القائمة كاملة
+
+    Returns:
+        (indices, distances) بالشكل (Q, k) مرتبة تصاعدياً
+    """
+    distances = np.atleast_2d(distances)
+    n = distances.shape[1]
+    k = max(1, min(k, n))
+
+    if k < n:
+        part = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), distances.shape).copy()
+
+    part_dist = np.take_along_axis(distances, part, axis=1)
+    order = np.argsort(part_dist, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_dist, order, axis=1)
+
+
+def template_distances(queries, rows, distances, templates_at, metric='euclidean'):
+    """
+    مسافات المرشحين بأقرب بصمة لكل طالب متعدد البصمات
+
+    Args:
+        rows: صفوف المرشحين (R,)
+        distances: مسافات الاستعلامات لصفوفهم (Q, R) (لمراكز البصمات)
+        templates_at: دالة ترجع بصمات صف (t, dim) float32 أو None لطالب ببصمة واحدة
+
+    Returns:
+        (Q, R): أقل مسافة بين الاستعلام ومركز الطالب أو أي من بصماته (المركز يبقى
+        مرشحاً: متوسط اللقطات أقرب للإضاءة التي لم تُسجل)
+    """
+    columns, blocks = [], []
+    for col, row in enumerate(np.asarray(rows).tolist()):
+        templates = templates_at(row)
+        if templates is not None:
+            columns.append(col)
+            blocks.append(templates)
+    if not blocks:
+        return distances
+
+    # استدعاء GEMM واحد لكل بصمات المرشحين ثم أقل مسافة لكل طالب
+    starts = np.cumsum([0] + [len(block) for block in blocks[:-1]])
+    per_template = pairwise_distances(queries, np.concatenate(blocks), metric)
+    distances = np.array(distances, dtype=np.float32)
+    distances[:, columns] = np.minimum(distances[:, columns], np.minimum.reduceat(per_template, starts, axis=1))
+    return distances
+
+
+def two_stage_search(search, templates_at, metric='euclidean', shortlist=None):
+    """
+    بحث على مرحلتين للطلاب متعددي البصمات: أقرب shortlist طالب بمركز بصماته
+    (صف واحد لكل طالب في المصفوفة)، ثم إعادة الترتيب بأقرب بصمة لكل منهم
+    التكلفة O(الطلاب) + O(shortlist × البصمات) بدلاً من O(الطلاب × البصمات)
+
+    Args:
+        search: دالة (queries, k) -> (rows, distances) على المراكز
+
+    Returns:
+        دالة بنفس شكل search
+    """
+    shortlist = TEMPLATE_SHORTLIST if shortlist is None else shortlist
+
+    def search_templates(queries, k):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        rows, distances = search(queries, max(k, shortlist))
+        k = min(k, rows.shape[1])
+        refined_rows = np.empty((rows.shape[0], k), dtype=np.intp)
+        refined = np.empty((rows.shape[0], k), dtype=np.float32)
+        for q in range(rows.shape[0]):
+            valid = rows[q] >= 0
+            exact = np.full(rows.shape[1], np.inf, dtype=np.float32)
+            exact[valid] = template_distances(queries[q], rows[q][valid], distances[q:q + 1, valid],
+                                              templates_at, metric)[0]
+            order = np.argsort(exact, kind='stable')[:k]
+            refined_rows[q], refined[q] = rows[q][order], exact[order]
+        return refined_rows, refined
+
+    return search_templates
+
+
+def linear_assignment(cost):
+    """
+    التعيين الأمثل (الخوارزمية المجرية) لمصفوفة تكلفة مستطيلة
+
+    Returns:
+        (rows, cols) أزواج التعيين بحيث يكون مجموع التكلفة أقل ما يمكن
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # الإمكانات u للصفوف و v للأعمدة، p[j] = الصف المعيّن للعمود j (الفهرسة من 1)
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.intp)
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            current = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (current < minv[1:])
+            minv[1:][better] = current[better]
+            way[1:][better] = j0
+
+            masked = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(masked)) + 1
+            delta = masked[j1 - 1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.nonzero(p[1:])[0]
+    rows = p[1:][cols] - 1
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    if transposed:
+        rows, cols = cols, rows
+        order = np.argsort(rows)
+        rows, cols = rows[order], cols[order]
+    return rows, cols
+
+
+def greedy_assignment(cost, threshold=np.inf):
+    """
+    تعيين جشع: الأزواج الأقرب أولاً، كل صف وعمود مرة واحدة فقط
+
+    Returns:
+        (rows, cols) للأزواج التي لا تتجاوز تكلفتها الحد
+    """
+    cost = np.asarray(cost)
+    order = np.argsort(cost, axis=None, kind='stable')
+    used_rows, used_cols = set(), set()
+    rows, cols = [], []
+    limit = min(cost.shape) if cost.size else 0
+    for flat in order.tolist():
+        row, col = divmod(flat, cost.shape[1])
+        if cost[row, col] > threshold or len(rows) == limit:
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        rows.append(row)
+        cols.append(col)
+    return np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)
+
+
+class FaceMatcher:
+    """مطابقة بصمة (أو دفعة بصمات) مع مصفوفة معرض كاملة"""
+
+    def __init__(self, metric='euclidean', threshold=None):
+        if metric not in METRICS:
+            raise ValueError(f'مقياس غير معروف: {metric}')
+        self.metric = metric
+        self.threshold = DEFAULT_THRESHOLDS[metric] if threshold is None else float(threshold)
+
+    def search(self, queries, matrix, k=5, sq_norms=None, scales=None):
+        """
+        Returns:
+            (indices, distances) بالشكل (Q, k)
+        """
+        if matrix.shape[0] == 0:
+            q = np.atleast_2d(queries).shape[0]
+            return np.empty((q, 0), dtype=np.intp), np.empty((q, 0), dtype=np.float32)
+        distances = pairwise_distances(queries, matrix, self.metric, sq_norms, scales)
+        return top_k(distances, k)
+
+    def similarity(self, distance):
+        """تحويل المسافة إلى تشابه بين 0 و 1 بالنسبة للحد"""
+        return max(0.0, min(1.0, 1 - (distance / self.threshold)))
+
+    def is_match(self, distance):
+        return distance <= self.threshold
+
+    def distance(self, embedding1, embedding2):
+        """المسافة بين بصمتين بنفس مقياس البحث"""
+        return float(pairwise_distances(embedding1, np.atleast_2d(embedding2), self.metric)[0, 0])
+
+    @staticmethod
+    def candidates(rows, distances, student_at):
+        """
+        قائمة المرشحين مع الهامش عن أفضل مرشح
+
+        Args:
+            rows, distances: صف واحد من نتيجة search (صفوف الإكمال -1 تُتجاهل)
+            student_at: دالة ترجع بيانات الطالب لرقم الصف
+        """
+        valid = np.asarray(rows) >= 0
+        rows, distances = np.asarray(rows)[valid], np.asarray(distances)[valid]
+        if len(distances) == 0:
+            return []
+        best = float(distances[0])
+        result = []
+        for row, distance in zip(rows.tolist(), distances.tolist()):
+            student = student_at(row)
+            result.append({
+                'student_id': student['id'],
+                'student_name': student['full_name'],
+                'stage': student.get('stage'),
+                'distance': distance,
+                'margin': distance - best,
+            })
+        return result
+
+
+load_thresholds()
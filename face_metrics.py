@@ -0,0 +1,266 @@
+"""
+مقاييس أداء خدمة الوجه - Face Pipeline Metrics
+مؤقتات لكل مرحلة (فك الترميز، التحجيم، الكشف، البصمة، المطابقة) وعدادات،
+مجمعة كـ histograms لكل endpoint ومعروضة بصيغة Prometheus النصية
+
+التجميع بين عمليات gunicorn: كل عملية تكتب لقطة من مقاييسها في مجلد مشترك
+(FACE_METRICS_DIR أو PROMETHEUS_MULTIPROC_DIR) و /metrics يجمع كل اللقطات
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'face_metrics'
+)
+
+# حدود histograms بالثواني
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    'face_request_seconds': ('histogram', 'Total handling time of face API requests'),
+    'face_stage_seconds': ('histogram', 'Time spent in each face pipeline stage'),
+    'face_images_total': ('counter', 'Images processed by the face pipeline'),
+    'face_faces_found_total': ('counter', 'Faces found by detection'),
+    'face_match_total': ('counter', 'Match decisions by result (hit or miss)'),
+    'face_errors_total': ('counter', 'Errors in the face pipeline by exception type'),
+    'face_match_batches_total': ('counter', 'Batched gallery searches executed'),
+    'face_match_batched_requests_total': ('counter', 'Match requests served by batched gallery searches'),
+    'face_cache_total': ('counter', 'Result cache lookups by result (hits, disk_hits, misses)'),
+    'face_cache_evictions_total': ('counter', 'Result cache entries evicted by the memory cap'),
+    'face_rejected_total': ('counter', 'Requests shed with HTTP 429 because the detection pool was saturated'),
+    'face_stream_frames_total': ('counter', 'Live stream frames by outcome (processed, dropped as stale, busy)'),
+    'face_track_total': ('counter', 'Live detect-only frames by tracking mode (full frame or ROI around tracked faces)'),
+    'face_jobs_total': ('counter', 'Background face jobs by kind and status (queued on submit, final status on finish)'),
+    'face_job_seconds': ('histogram', 'Run time of background face jobs'),
+    'attendance_records_total': ('counter', 'Attendance records flushed by the buffered writer (written or duplicate)'),
+    'face_shard_searches_total': ('counter', 'Stage-scoped match searches by result (hit in shard or global fallback)'),
+    'face_shard_rows_total': ('counter', 'Gallery rows per stage shard: compared in shard, in global fallback, or saved'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+class FaceMetrics:
+    """
+    سجل المقاييس داخل العملية الواحدة
+    endpoint الحالي محفوظ لكل thread حتى تُنسب المراحل للطلب الصحيح
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory if directory is not None else (
+            os.environ.get('FACE_METRICS_DIR')
+            or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+            or DEFAULT_METRICS_DIR
+        )
+        self.flush_interval = flush_interval
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_flush = 0.0
+        self._dirty = False
+        self._file = None
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # التسجيل
+    # ------------------------------------------------------------------
+    @property
+    def current_endpoint(self):
+        return getattr(self._local, 'endpoint', None) or 'direct'
+
+    def inc(self, name, value=1, **labels):
+        labels.setdefault('endpoint', self.current_endpoint)
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._dirty = True
+
+    def observe(self, name, seconds, **labels):
+        labels.setdefault('endpoint', self.current_endpoint)
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+            self._dirty = True
+
+    def error(self, exc):
+        self.inc('face_errors_total', type=type(exc).__name__)
+
+    @contextmanager
+    def stage(self, name):
+        """قياس زمن مرحلة داخل الطلب الحالي"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('face_stage_seconds', time.perf_counter() - start, stage=name)
+
+    @contextmanager
+    def labelled(self, name):
+        """نسب المراحل داخل هذا السياق إلى endpoint معين (مثلاً داخل thread آخر)"""
+        previous = getattr(self._local, 'endpoint', None)
+        self._local.endpoint = name
+        try:
+            yield
+        finally:
+            self._local.endpoint = previous
+
+    @contextmanager
+    def endpoint(self, name):
+        """نسب كل المراحل داخل هذا السياق إلى endpoint معين وقياس الزمن الكلي"""
+        start = time.perf_counter()
+        try:
+            with self.labelled(name):
+                try:
+                    yield
+                finally:
+                    self.observe('face_request_seconds', time.perf_counter() - start)
+        finally:
+            self.maybe_flush()
+
+    def instrument(self, name):
+        """decorator لدوال Flask"""
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.endpoint(name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ------------------------------------------------------------------
+    # اللقطات والتجميع بين العمليات
+    # ------------------------------------------------------------------
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(map(list, labels)), value]
+                             for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(map(list, labels)), list(hist)]
+                               for (name, labels), hist in self._histograms.items()],
+            }
+
+    def _snapshot_path(self):
+        if self._file is None or not self._file.startswith(f"{self.directory}{os.sep}face_metrics_{os.getpid()}_"):
+            # اسم فريد لكل عملية (pid + وقت البدء) حتى لا تكتب عملية جديدة فوق لقطة سابقة
+            self._file = os.path.join(self.directory, f"face_metrics_{os.getpid()}_{int(time.time() * 1000)}.json")
+        return self._file
+
+    def flush(self):
+        if not self.directory or not self._dirty:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._snapshot_path()
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        except OSError as e:
+            logger.warning(f"تعذر حفظ المقاييس: {e}")
+
+    def maybe_flush(self):
+        if self._dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def clear_directory(self):
+        """حذف لقطات العمليات السابقة (يُستدعى عند بدء gunicorn)"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.startswith('face_metrics_'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def collect(self):
+        """جمع لقطات جميع العمليات (أو هذه العملية فقط بدون مجلد مشترك)"""
+        snapshots = []
+        if self.directory:
+            self.flush()
+            try:
+                names = os.listdir(self.directory)
+            except OSError:
+                names = []
+            for name in names:
+                if not (name.startswith('face_metrics_') and name.endswith('.json')):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        if not snapshots:
+            snapshots.append(self.snapshot())
+
+        counters, histograms = {}, {}
+        for snap in snapshots:
+            for name, labels, value in snap['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, hist in snap['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = list(hist)
+                else:
+                    for i, value in enumerate(hist):
+                        merged[i] += value
+        return counters, histograms
+
+    def render(self):
+        """المقاييس بصيغة Prometheus النصية"""
+        counters, histograms = self.collect()
+        lines = []
+        names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+        for name in names:
+            kind, help_text = METRIC_HELP.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            for (metric, labels), hist in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, hist):
+                    lines.append(f'{name}_bucket{_format_labels(labels, [("le", repr(bound))])} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {hist[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {hist[-2]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {hist[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+face_metrics = FaceMetrics()
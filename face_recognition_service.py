@@ -11,72 +11,227 @@ from PIL import Image
 import logging
 import os
 
+from face_batching import match_batcher
+from face_cache import ResultCache
+from face_embedding import EMBEDDING_SIZE, EMBEDDING_VERSION, embed_face, embed_faces, resize_face
+from face_detectors import DetectorRegistry
+from face_embedding_codec import decode_templates, dequantize, embedding_vector, is_stale, stack_embeddings
+from face_gallery import GalleryRegistry, in_shard
+from face_metrics import face_metrics
+from face_tracker import FaceTracker
+from face_matcher import (
+    FaceMatcher,
+    greedy_assignment,
+    linear_assignment,
+    pairwise_distances,
+    template_distances,
+    two_stage_search
+)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# وضع الوجوه المتعددة (صورة الفصل): دقة أعلى لالتقاط الوجوه الصغيرة
+MULTI_FACE_MAX_WIDTH = 1600
+MAX_FACES_PER_FRAME = 60
+
+# أقصى عرض للصورة في مسارات البصمة (الاستخراج والمطابقة)
+# الكاشف ومعاملاته لكل مسار في face_detectors (ملفات enroll/match/frame/live/track)
+EMBED_MAX_WIDTH = 1000
+
+# أقصى عرض في الكشف الحي السريع (detect-only)
+LIVE_MAX_WIDTH = 800
+
+# الكشف حول الوجه المتتبع: المنطقة صغيرة ونطاق الأحجام ضيق (0.7x - 1.4x من حجمه
+# في الإطار السابق)، فيستخدم ملف 'track' خطوة تحجيم أدق وحد جيران أقل (الوجه متوقع
+# في هذا الموضع) بتكلفة أقل من الإطار كاملاً
+TRACK_MIN_SCALE = 0.7
+TRACK_MAX_SCALE = 1.4
+
+
+# أعلام فك الترميز الرمادي المصغّر حسب معامل التصغير
+REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def _encoded_image_size(buffer):
+    """
+    قراءة أبعاد JPEG/PNG من الترويسة فقط بدون فك الترميز
+
+    Returns:
+        (width, height) أو None إذا لم تُعرف الصيغة
+    """
+    data = buffer[:2].tobytes()
+    
+    # PNG: الأبعاد في مقطع IHDR
+    if buffer[:8].tobytes() == b'\x89PNG\r\n\x1a\n' and len(buffer) >= 24:
+        width = int.from_bytes(buffer[16:20].tobytes(), 'big')
+        height = int.from_bytes(buffer[20:24].tobytes(), 'big')
+        return width, height
+    
+    if data != b'\xff\xd8':
+        return None
+    
+    # JPEG: البحث عن مقطع SOFn
+    pos = 2
+    length = len(buffer)
+    while pos + 9 < length:
+        if buffer[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = int(buffer[pos + 1])
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            pos += 1 if marker == 0xFF else 2
+            continue
+        segment = (int(buffer[pos + 2]) << 8) | int(buffer[pos + 3])
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (int(buffer[pos + 5]) << 8) | int(buffer[pos + 6])
+            width = (int(buffer[pos + 7]) << 8) | int(buffer[pos + 8])
+            return width, height
+        pos += 2 + segment
+    return None
+
 
 class FaceRecognitionService:
     """خدمة معالجة الوجه المحترفة"""
     
     def __init__(self):
-        # تحميل نموذج الكشف عن الوجه من OpenCV
-        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        self.face_cascade = cv2.CascadeClassifier(cascade_path)
+        # كاشف الوجه لكل مسار (Haar افتراضياً، انظر face_detectors)
+        self.detectors = DetectorRegistry()
+        for profile in self.detectors.profiles:
+            self.detectors.get(profile)
+        
+        # معارض بصمات الطلاب المسجلة مسبقاً
+        self.galleries = GalleryRegistry()
+        
+        # نتائج الصور المكررة (إعادة المحاولة، نفس صورة التسجيل)
+        self.extract_cache = ResultCache('extract')
+        self.detect_cache = ResultCache('detect')
+        
+        # تتبع الوجوه بين إطارات كل جلسة كاميرا (الكشف الحي)
+        self.tracker = FaceTracker()
         logger.info("✓ تم تهيئة خدمة معالجة الوجه")
     
+    @staticmethod
+    def image_bytes(image_base64):
+        """
+        بايتات الصورة المرمّزة (JPEG/PNG) من Base64 أو من الرفع الثنائي كما هي
+        """
+        if isinstance(image_base64, (bytes, bytearray, memoryview)):
+            return image_base64
+        
+        # إزالة بادئة data:image/jpeg;base64,
+        if ',' in image_base64:
+            image_base64 = image_base64.split(',')[1]
+        
+        # فك ترميز Base64
+        return base64.b64decode(image_base64)
+    
     @staticmethod
     def load_image_from_base64(image_base64):
         """
-        تحميل صورة من Base64 (من المتصفح)
+        تحميل صورة من Base64 (من المتصفح) أو من بايتات الصورة مباشرة (رفع ثنائي)
+        """
+        try:
+            image_data = FaceRecognitionService.image_bytes(image_base64)
+            return FaceRecognitionService.decode_image_bytes(image_data)
+        except Exception as e:
+            logger.error(f"خطأ في تحميل الصورة: {e}")
+            raise
+    
+    @staticmethod
+    def load_gray_image(image_base64, max_width=800, with_scale=False):
+        """
+        تحميل صورة رمادية بأصغر دقة كافية لمسارات الكشف فقط
+        
+        يتم التصغير أثناء فك ترميز JPEG (في مجال DCT بمعامل 2/4/8) وفك الترميز
+        مباشرة إلى الرمادي، فلا تُنشأ الصورة الملونة الكاملة إطلاقاً
+        
+        with_scale: إرجاع (الصورة، نسبة عرض الصورة الأصلية إلى المصغّرة) لإعادة
+        الصناديق إلى إحداثيات الصورة الأصلية
         """
         try:
-            # إزالة بادئة data:image/jpeg;base64,
-            if ',' in image_base64:
-                image_base64 = image_base64.split(',')[1]
+            image_data = FaceRecognitionService.image_bytes(image_base64)
+            buffer = np.frombuffer(memoryview(image_data), dtype=np.uint8)
             
-            # فك ترميز Base64
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_data))
+            size = _encoded_image_size(buffer)
+            factor = 1
+            if size is not None:
+                width = size[0]
+                while factor < 8 and width // (factor * 2) >= max_width:
+                    factor *= 2
             
-            # تحويل إلى numpy array
-            image_np = np.array(image)
+            gray = cv2.imdecode(buffer, REDUCED_GRAYSCALE_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION)
+            if gray is None:
+                image_np = FaceRecognitionService.decode_image_bytes(image_data)
+                gray = cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY) if image_np.ndim == 3 else image_np
+                factor = 1
             
-            # تحويل RGB إلى BGR لـ OpenCV
-            if len(image_np.shape) == 3:
-                if image_np.shape[2] == 4:  # RGBA
-                    image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2BGR)
-                elif image_np.shape[2] == 3:  # RGB
-                    image_np = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+            # التحجيم النهائي للعرض المطلوب
+            height, width = gray.shape[:2]
+            original_width = size[0] if size is not None else width * factor
+            if width > max_width:
+                scale = float(max_width) / width
+                gray = cv2.resize(gray, (max_width, int(height * scale)))
             
-            return image_np
+            if with_scale:
+                return gray, float(original_width) / gray.shape[1]
+            return gray
         except Exception as e:
             logger.error(f"خطأ في تحميل الصورة: {e}")
             raise
     
-    def extract_face_embedding(self, image_base64):
+    @staticmethod
+    def decode_image_bytes(image_data):
         """
-        استخراج بصمة الوجه من الصورة
-        يُستخدم عند إضافة طالب جديد
+        فك ترميز JPEG/PNG مباشرة من الذاكرة إلى BGR بدون نسخ وسيطة
+        (np.frombuffer على memoryview لا ينسخ البيانات)
+        """
+        buffer = np.frombuffer(memoryview(image_data), dtype=np.uint8)
+        
+        # تجاهل اتجاه EXIF للحصول على نفس البكسلات التي كان يعطيها PIL
+        image_np = cv2.imdecode(buffer, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image_np is not None:
+            return image_np
+        
+        # صيغ لا يدعمها OpenCV: الرجوع إلى PIL
+        image = Image.open(io.BytesIO(bytes(image_data)))
+        
+        # تحويل إلى numpy array
+        image_np = np.array(image)
+        
+        # تحويل RGB إلى BGR لـ OpenCV
+        if len(image_np.shape) == 3:
+            if image_np.shape[2] == 4:  # RGBA
+                image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2BGR)
+            elif image_np.shape[2] == 3:  # RGB
+                image_np = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
+        
+        return image_np
+    
+    def _detect_faces(self, image_base64, max_width=EMBED_MAX_WIDTH, profile='match'):
+        """
+        تحميل الصورة وتحجيمها والكشف عن الوجوه بكاشف المسار المحدد
         
         Returns:
-            {
-                'success': bool,
-                'embedding': list (128 قيمة عددية),
-                'face_count': int,
-                'message': str
-            }
+            (الصورة بعد التحجيم, الوجوه [(x, y, w, h)], معامل التحجيم)
         """
-        try:
-            logger.info("بدء استخراج بصمة الوجه...")
-            
-            # تحميل الصورة
+        # تحميل الصورة
+        with face_metrics.stage('decode'):
             image_np = self.load_image_from_base64(image_base64)
-            
-            # تحجيم الصورة إذا كانت كبيرة جداً
-            height, width = image_np.shape[:2]
-            if width > 1000:
-                scale = 1000.0 / width
-                new_width = 1000
+        face_metrics.inc('face_images_total')
+        
+        # تحجيم الصورة إذا كانت كبيرة جداً
+        scale = 1.0
+        height, width = image_np.shape[:2]
+        with face_metrics.stage('resize'):
+            if width > max_width:
+                scale = float(max_width) / width
+                new_width = max_width
                 new_height = int(height * scale)
                 image_np = cv2.resize(image_np, (new_width, new_height))
             
@@ -85,64 +240,136 @@ class FaceRecognitionService:
             
             # تحسين الصورة (معادلة الهيستوجرام)
             gray = cv2.equalizeHist(gray)
+        
+        # الكشف عن الوجوه
+        with face_metrics.stage('detect'):
+            detector = self.detectors.get(profile)
+            faces = detector.detect(image_np if detector.color else gray)
+        face_metrics.inc('face_faces_found_total', len(faces))
+        
+        logger.info(f"تم العثور على {len(faces)} وجه(وه)")
+        
+        return image_np, faces, scale
+    
+    @staticmethod
+    def _crop_face(image_np, face):
+        """قص الوجه مع قليل من المساحة حوله"""
+        x, y, w, h = face
+        
+        # إضافة قليل من المساحة حول الوجه
+        padding = int(min(w, h) * 0.1)
+        x = max(0, x - padding)
+        y = max(0, y - padding)
+        w = min(image_np.shape[1] - x, w + padding * 2)
+        h = min(image_np.shape[0] - y, h + padding * 2)
+        
+        return image_np[y:y+h, x:x+w]
+    
+    def _embed_largest_face(self, image_base64, profile='match'):
+        """
+        تحميل الصورة، الكشف عن الوجوه وحساب بصمة الوجه الأكبر
+
+        Returns:
+            (البصمة كـ list أو None, عدد الوجوه, رسالة الخطأ أو None)
+        """
+        image_np, faces, _ = self._detect_faces(image_base64, profile=profile)
+        
+        if len(faces) == 0:
+            return None, 0, 'لم يتم العثور على وجه في الصورة'
+        
+        # إذا كان هناك وجوه متعددة، اختر الأكبر
+        if len(faces) > 1:
+            faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)[:1]
+            logger.warning(f"تم العثور على وجوه متعددة، استخدام الأكبر")
+        
+        # استخراج الوجه الأول
+        face_roi = self._crop_face(image_np, faces[0])
+        
+        if face_roi.size == 0:
+            return None, 0, 'خطأ في استخراج الوجه'
+        
+        # حساب الـ embedding من خصائص الوجه
+        with face_metrics.stage('embed'):
+            embedding = self._compute_face_embedding(face_roi)
+        return embedding, len(faces), None
+    
+    def _embed_all_faces(self, image_base64, max_faces=MAX_FACES_PER_FRAME):
+        """
+        حساب بصمة كل وجه مكتشف في الإطار (صورة الفصل)
+        
+        Returns:
+            (قائمة الصناديق بإحداثيات الصورة الأصلية, مصفوفة البصمات (F, 128))
+        """
+        image_np, faces, scale = self._detect_faces(image_base64, max_width=MULTI_FACE_MAX_WIDTH, profile='frame')
+        
+        # الأكبر أولاً، مع حد أقصى لعدد الوجوه
+        faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)[:max_faces]
+        
+        boxes, crops = [], []
+        with face_metrics.stage('embed'):
+            for face in faces:
+                face_roi = self._crop_face(image_np, face)
+                if face_roi.size == 0:
+                    continue
+                x, y, w, h = (int(round(v / scale)) for v in face)
+                boxes.append({'x': x, 'y': y, 'w': w, 'h': h})
+                crops.append(resize_face(face_roi))
             
-            # الكشف عن الوجوه
-            faces = self.face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=4,
-                minSize=(30, 30),
-                maxSize=(400, 400)
+            # كل الوجوه دفعة واحدة
+            embeddings = embed_faces(np.stack(crops)) if crops else np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+        
+        return boxes, embeddings
+    
+    def extract_face_embedding(self, image_base64):
+        """
+        استخراج بصمة الوجه من الصورة
+        يُستخدم عند إضافة طالب جديد (النتيجة محفوظة لنفس الصورة، انظر face_cache)
+        
+        Returns:
+            {
+                'success': bool,
+                'embedding': list (128 قيمة عددية),
+                'face_count': int,
+                'message': str
+            }
+        """
+        try:
+            image_data = self.image_bytes(image_base64)
+            cache_key = self.extract_cache.key(
+                image_data, 'extract', EMBEDDING_VERSION, EMBED_MAX_WIDTH, self.detectors.signature('enroll')
             )
+            cached = self.extract_cache.get(cache_key)
+            if cached is not None:
+                logger.info("✓ بصمة محفوظة لنفس الصورة")
+                return cached
             
-            logger.info(f"تم العثور على {len(faces)} وجه(وه)")
-            
-            if len(faces) == 0:
-                return {
-                    'success': False,
-                    'message': 'لم يتم العثور على وجه في الصورة',
-                    'face_count': 0
-                }
-            
-            # إذا كان هناك وجوه متعددة، اختر الأكبر
-            if len(faces) > 1:
-                faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)[:1]
-                logger.warning(f"تم العثور على وجوه متعددة، استخدام الأكبر")
-            
-            # استخراج الوجه الأول
-            x, y, w, h = faces[0]
-            
-            # إضافة قليل من المساحة حول الوجه
-            padding = int(min(w, h) * 0.1)
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(image_np.shape[1] - x, w + padding * 2)
-            h = min(image_np.shape[0] - y, h + padding * 2)
+            logger.info("بدء استخراج بصمة الوجه...")
             
-            face_roi = image_np[y:y+h, x:x+w]
+            embedding, face_count, error = self._embed_largest_face(image_data, profile='enroll')
             
-            if face_roi.size == 0:
-                return {
+            if error:
+                result = {
                     'success': False,
-                    'message': 'خطأ في استخراج الوجه',
+                    'message': error,
                     'face_count': 0
                 }
+            else:
+                logger.info("✓ تم استخراج بصمة الوجه بنجاح")
+                logger.info(f"طول البصمة: {len(embedding)}")
+                
+                result = {
+                    'success': True,
+                    'embedding': embedding,
+                    'face_count': face_count,
+                    'message': 'تم استخراج بصمة الوجه بنجاح'
+                }
             
-            # حساب الـ embedding من خصائص الوجه
-            embedding = self._compute_face_embedding(face_roi)
-            
-            logger.info("✓ تم استخراج بصمة الوجه بنجاح")
-            logger.info(f"طول البصمة: {len(embedding)}")
-            
-            return {
-                'success': True,
-                'embedding': embedding,
-                'face_count': len(faces),
-                'message': 'تم استخراج بصمة الوجه بنجاح'
-            }
+            self.extract_cache.put(cache_key, result)
+            return result
         
         except Exception as e:
             logger.error(f"خطأ في استخراج البصمة: {e}")
+            face_metrics.error(e)
             import traceback
             logger.error(traceback.format_exc())
             return {
@@ -154,258 +381,557 @@ class FaceRecognitionService:
     def _compute_face_embedding(self, face_image):
         """
         حساب بصمة الوجه من الصورة باستخدام خصائص الصورة محسّنة
+        (النواة المتجهة في face_embedding)
         """
         try:
-            # تعديل حجم الصورة
-            face_resized = cv2.resize(face_image, (64, 64))
-            
-            # تحويل إلى رمادي
-            gray = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY)
-            
-            # معالجة محسّنة للصورة
-            gray = cv2.equalizeHist(gray)
-            
-            # استخراج ميزات قوية
-            features = []
-            
-            # 1. Pixel intensities (الكثافة المباشرة)
-            pixel_features = gray.flatten().astype(float) / 255.0
-            features.extend(pixel_features[:32])  # أول 32 pixel
-            
-            # 2. Histogram features (موزعة بشكل أفضل)
-            hist = cv2.calcHist([gray], [0], None, [64], [0, 256])
-            hist = cv2.normalize(hist, hist).flatten().tolist()
-            features.extend(hist[:64])
-            
-            # 3. HOG-like features (تدرجات الصورة)
-            gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
-            gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
-            magnitude = np.sqrt(gx**2 + gy**2)
-            features.extend(magnitude.flatten()[:32] / 255.0)
-            
-            # 4. Local Binary Pattern-like (تغيرات محلية)
-            for i in range(0, 64, 8):
-                for j in range(0, 64, 8):
-                    region = gray[i:i+8, j:j+8]
-                    if region.size > 0:
-                        features.append(float(np.mean(region)) / 255.0)
-                        features.append(float(np.std(region)) / 255.0)
-            
-            # 5. Edges
-            edges = cv2.Canny(gray, 30, 100)
-            features.extend(edges.flatten()[:32] / 255.0)
-            
-            # 6. ORB features (كشف النقاط المميزة)
-            orb = cv2.ORB_create(nfeatures=32)
-            try:
-                kp = orb.detect(gray, None)
-                features.append(float(len(kp)))
-                for k in kp[:8]:
-                    features.append(float(k.pt[0]) / 64.0)
-                    features.append(float(k.pt[1]) / 64.0)
-                    features.append(float(k.size) / 100.0)
-            except:
-                features.extend([0.0] * 25)
-            
-            # 7. Color moments إذا كان لدينا صورة ملونة
-            if len(face_resized.shape) == 3 and face_resized.shape[2] >= 3:
-                for channel in cv2.split(face_resized)[:3]:
-                    features.append(float(np.mean(channel)) / 255.0)
-                    features.append(float(np.std(channel)) / 255.0)
-            
-            # Padding إلى 128 عنصر
-            embedding = features[:128]
-            while len(embedding) < 128:
-                embedding.append(0.0)
-            
-            # تطبيع القيم بشكل آمن
-            embedding_array = np.array(embedding[:128], dtype=np.float32)
-            mean_val = np.mean(embedding_array)
-            std_val = np.std(embedding_array)
-            
-            if std_val > 1e-6:
-                embedding_array = (embedding_array - mean_val) / std_val
-            
-            # قص القيم المتطرفة
-            embedding_array = np.clip(embedding_array, -5, 5)
-            
-            return embedding_array.tolist()
+            return embed_face(face_image).tolist()
         
         except Exception as e:
             logger.error(f"خطأ في حساب البصمة: {e}")
             # إرجاع بصمة افتراضية
             return [0.0] * 128
     
-    def match_face_with_students(self, image_base64, students_with_embeddings):
+    def match_face_with_students(self, image_base64, students_with_embeddings,
+                                 metric='euclidean', top_k=5, shard=None):
         """
         مطابقة الوجه مع الطلاب المسجلين
         يُستخدم عند تسجيل الحضور
         
+        shard: مفتاح face_gallery.shard_key (مرحلة/شعبة): البحث في طلابها أولاً
+        والرجوع للقائمة كاملة فقط إذا لم يبلغ أفضلهم حد المطابقة
+        
         Returns:
             {
                 'success': bool,
                 'student_id': str,
                 'student_name': str,
                 'distance': float,
-                'similarity': float (0-1)
+                'similarity': float (0-1),
+                'margin': float (الفرق بين أفضل مرشحَين),
+                'candidates': [أفضل k طلاب مع المسافة والهامش],
+                'shard', 'shard_size', 'fallback', 'matched_in': مع shard فقط
             }
         """
         try:
-            logger.info("بدء مطابقة الوجه...")
-            
-            # تحميل الصورة
-            image_np = self.load_image_from_base64(image_base64)
+            matcher = FaceMatcher(metric)
             
-            # تحجيم الصورة إذا كانت كبيرة جداً
-            height, width = image_np.shape[:2]
-            if width > 1000:
-                scale = 1000.0 / width
-                new_width = 1000
-                new_height = int(height * scale)
-                image_np = cv2.resize(image_np, (new_width, new_height))
+            logger.info("بدء مطابقة الوجه...")
             
-            # الكشف عن الوجه مع معاملات أفضل
-            gray = cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
-            gray = cv2.equalizeHist(gray)
+            input_embedding, _, error = self._embed_largest_face(image_base64)
             
-            faces = self.face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,       # أكثر دقة من 1.05
-                minNeighbors=4,        # توازن بين الدقة والحساسية
-                minSize=(30, 30),      # حجم أصغر معقول
-                maxSize=(400, 400)
-            )
-            
-            if len(faces) == 0:
-                logger.warning("لم يتم العثور على وجه في الصورة")
+            if error:
+                logger.warning(error)
                 return {
                     'success': False,
-                    'message': 'لم يتم العثور على وجه في الصورة',
+                    'message': error,
                     'distance': None,
                     'similarity': 0
                 }
             
-            # إذا كان هناك وجوه متعددة، اختر الأكبر
-            if len(faces) > 1:
-                faces = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)[:1]
-                logger.info(f"تم العثور على وجوه متعددة، استخدام الأكبر")
+            # تحويل جميع البصمات إلى مصفوفة واحدة (البصمات غير الصالحة تُتجاهل)
+            students, matrix, scales, stale, templates_at = self._roster_matrix(
+                students_with_embeddings, len(input_embedding)
+            )
             
-            # استخراج الوجه الأول
-            x, y, w, h = faces[0]
+            logger.info(f"جاري المقارنة مع {len(students)} طالب...")
             
-            # إضافة قليل من المساحة حول الوجه
-            padding = int(min(w, h) * 0.1)
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(image_np.shape[1] - x, w + padding * 2)
-            h = min(image_np.shape[0] - y, h + padding * 2)
+            search = self._roster_search(matrix, scales, matcher, templates_at)
+            if shard is not None:
+                rows = np.array([row for row, student in enumerate(students) if in_shard(student, shard)],
+                                dtype=np.intp)
+                state = {'shard_size': len(rows)}
+                search = self._sharded_search(
+                    shard, self._roster_search(matrix, scales, matcher, templates_at, rows), search,
+                    len(rows), len(students), matcher, state
+                )
             
-            face_roi = image_np[y:y+h, x:x+w]
+            result = self._match_embedding(
+                input_embedding,
+                search,
+                lambda row: students[row],
+                matcher,
+                top_k
+            )
+            result['stale_embeddings'] = stale
+            if shard is not None:
+                self._shard_result(result, shard, state)
+            return result
+        
+        except Exception as e:
+            logger.error(f"خطأ في المطابقة: {e}")
+            face_metrics.error(e)
+            import traceback
+            logger.error(traceback.format_exc())
+            return {
+                'success': False,
+                'message': f'خطأ في المطابقة: {str(e)}',
+                'distance': None,
+                'similarity': 0
+            }
+    
+    def match_face_with_gallery(self, image_base64, gallery_id, metric='euclidean', top_k=5,
+                                nprobe=None, shard=None):
+        """
+        مطابقة الوجه مع معرض مسجل مسبقاً (بدون إرسال بصمات الطلاب مع كل إطار)
+        المعارض الكبيرة ذات الفهرس التقريبي تُبحث عبر IVF (nprobe يتحكم في الدقة/السرعة)
+        الطلبات المتزامنة لنفس المعرض تُبحث دفعة واحدة (انظر face_batching)
+        shard: البحث في جزء المعرض أولاً كما في match_face_with_students
+        
+        Returns:
+            نفس شكل match_face_with_students مع 'gallery_id' و 'gallery_version'
+        """
+        try:
+            matcher = FaceMatcher(metric)
+            gallery = self.galleries.get(gallery_id)
             
-            if face_roi.size == 0:
-                logger.warning("الوجه المستخرج فارغ")
+            if gallery is None:
                 return {
                     'success': False,
-                    'message': 'خطأ في استخراج الوجه',
+                    'error': 'gallery_not_found',
+                    'message': 'المعرض غير مسجل، يرجى تسجيل قائمة الطلاب من جديد',
                     'distance': None,
                     'similarity': 0
                 }
             
-            # حساب الـ embedding
-            input_embedding = self._compute_face_embedding(face_roi)
-            input_embedding_array = np.array(input_embedding, dtype=np.float32)
-            
-            # مقارنة مع جميع الطلاب
-            best_match = None
-            best_distance = float('inf')
-            DISTANCE_THRESHOLD = 50.0  # زيادة الحد للسماح بتطابقات أفضل
+            logger.info(f"بدء مطابقة الوجه مع المعرض {gallery_id}...")
+            top_k = max(1, min(top_k, gallery.size))
             
-            logger.info(f"جاري المقارنة مع {len(students_with_embeddings)} طالب...")
-            
-            distances_log = []
-            
-            for student in students_with_embeddings:
-                if not student.get('embedding'):
-                    continue
+            with match_batcher.request():
+                input_embedding, _, error = self._embed_largest_face(image_base64)
                 
-                try:
-                    stored_embedding = np.array(student['embedding'], dtype=np.float32)
+                if error:
+                    logger.warning(error)
+                    result = {
+                        'success': False,
+                        'message': error,
+                        'distance': None,
+                        'similarity': 0
+                    }
+                else:
+                    # بيانات الطلاب تُؤخذ من لقطة المعرض لحظة البحث المشترك
+                    snapshot = {}
                     
-                    # حساب المسافة الإقليدية
-                    distance = float(np.linalg.norm(input_embedding_array - stored_embedding))
+                    def gallery_search(query, k, scope=None):
+                        rows, distances, snapshot['student_at'] = match_batcher.search(
+                            gallery, query, matcher, k=k, nprobe=nprobe, shard=scope
+                        )
+                        return rows, distances
                     
-                    distances_log.append({
-                        'name': student['full_name'],
-                        'distance': distance
-                    })
+                    search = gallery_search
+                    if shard is not None:
+                        state = {'shard_size': len(gallery.shard(shard).rows)}
+                        search = self._sharded_search(
+                            shard, lambda query, k: gallery_search(query, k, shard), gallery_search,
+                            state['shard_size'], gallery.size, matcher, state
+                        )
                     
-                    if distance < best_distance:
-                        best_distance = distance
-                        best_match = student
-                
-                except Exception as e:
-                    logger.warning(f"خطأ في مقارنة {student.get('full_name')}: {e}")
-                    continue
+                    result = self._match_embedding(
+                        input_embedding,
+                        search,
+                        lambda row: snapshot['student_at'](row),
+                        matcher,
+                        top_k
+                    )
+                    if shard is not None:
+                        self._shard_result(result, shard, state)
             
-            # طباعة السجل للتصحيح
-            distances_log.sort(key=lambda x: x['distance'])
-            for log in distances_log[:5]:
-                logger.info(f"  {log['name']}: {log['distance']:.3f}")
+            result['gallery_id'] = gallery.gallery_id
+            result['gallery_version'] = gallery.version
+            return result
+        
+        except Exception as e:
+            logger.error(f"خطأ في المطابقة: {e}")
+            face_metrics.error(e)
+            import traceback
+            logger.error(traceback.format_exc())
+            return {
+                'success': False,
+                'message': f'خطأ في المطابقة: {str(e)}',
+                'distance': None,
+                'similarity': 0
+            }
+    
+    def match_faces_in_frame(self, image_base64, students_with_embeddings=None, gallery_id=None,
+                             metric='euclidean', assignment='greedy', gallery=None, shard=None):
+        """
+        مطابقة جميع الوجوه في إطار واحد (صورة الفصل) مع الطلاب دفعة واحدة
+        كل طالب يُعيَّن لوجه واحد على الأكثر (تعيين جشع أو أمثل)
+        
+        gallery: معرض جاهز غير مسجل (مثلاً قائمة قناة البث، انظر face_stream)
+        shard: مرشحو جزء المعرض أولاً؛ إذا لم يبلغ أقرب مرشح لأحد الوجوه الحد يُستخدم
+               مرشحو المعرض كاملاً للتعيين، وكل تطابق يذكر 'matched_in'
+        
+        Returns:
+            {
+                'success': bool (تم التعرف على طالب واحد على الأقل),
+                'face_count': int,
+                'recognized_count': int,
+                'matches': [{'student_id', 'student_name', 'stage', 'distance',
+                             'similarity', 'box': {'x', 'y', 'w', 'h'}}],
+                'unmatched_faces': [{'box', 'best_distance'}]
+            }
+        """
+        try:
+            if assignment not in ('greedy', 'optimal'):
+                raise ValueError(f'طريقة تعيين غير معروفة: {assignment}')
             
-            # التحقق من وجود تطابق
-            if best_match and best_distance <= DISTANCE_THRESHOLD:
-                similarity = 1 - (best_distance / DISTANCE_THRESHOLD)
-                similarity = max(0, min(1, similarity))
-                
-                logger.info(f"✓ تطابق وجد: {best_match['full_name']} (المسافة: {best_distance:.3f}, التشابه: {similarity:.2%})")
-                
-                return {
-                    'success': True,
-                    'student_id': best_match['id'],
-                    'student_name': best_match['full_name'],
-                    'stage': best_match.get('stage'),
-                    'distance': best_distance,
-                    'similarity': similarity,
-                    'message': f"تم العثور على تطابق: {best_match['full_name']}"
-                }
-            else:
-                best_distance_msg = f"{best_distance:.3f}" if best_distance != float('inf') else "N/A"
-                logger.warning(f"لم يتم العثور على تطابق (أفضل مسافة: {best_distance_msg})")
-                
+            matcher = FaceMatcher(metric)
+            
+            if gallery is None and gallery_id:
+                gallery = self.galleries.get(gallery_id)
+                if gallery is None:
+                    return {
+                        'success': False,
+                        'error': 'gallery_not_found',
+                        'message': 'المعرض غير مسجل، يرجى تسجيل قائمة الطلاب من جديد',
+                        'face_count': 0,
+                        'matches': []
+                    }
+            
+            logger.info("بدء مطابقة الوجوه المتعددة...")
+            
+            boxes, embeddings = self._embed_all_faces(image_base64)
+            
+            if not boxes:
                 return {
                     'success': False,
-                    'message': f'لم يتم العثور على طالب مطابق (أفضل مسافة: {best_distance_msg})',
-                    'distance': best_distance if best_distance != float('inf') else None,
-                    'similarity': 0
+                    'message': 'لم يتم العثور على وجه في الصورة',
+                    'face_count': 0,
+                    'recognized_count': 0,
+                    'matches': [],
+                    'unmatched_faces': []
                 }
+            
+            if gallery is not None:
+                with gallery.lock:
+                    def gallery_search(queries, k, scope=None):
+                        return gallery.search(queries, matcher, k=k, shard=scope)
+                    
+                    search = gallery_search
+                    if shard is not None:
+                        state = {'shard_size': len(gallery.shard(shard).rows)}
+                        search = self._sharded_search(
+                            shard, lambda queries, k: gallery_search(queries, k, shard), gallery_search,
+                            state['shard_size'], gallery.size, matcher, state
+                        )
+                    
+                    result = self._assign_faces(
+                        boxes,
+                        embeddings,
+                        search,
+                        gallery.vectors,
+                        gallery.student_at,
+                        matcher,
+                        assignment,
+                        gallery.templates_at if gallery.templates else None
+                    )
+                    if shard is not None:
+                        self._shard_result(result, shard, state,
+                                           lambda match: gallery.in_shard(match['student_id'], shard))
+                    result['gallery_id'] = gallery.gallery_id
+                    result['gallery_version'] = gallery.version
+                return result
+            
+            students, matrix, scales, stale, templates_at = self._roster_matrix(
+                students_with_embeddings or [], embeddings.shape[1]
+            )
+            
+            search = self._roster_search(matrix, scales, matcher, templates_at)
+            if shard is not None:
+                rows = np.array([row for row, student in enumerate(students) if in_shard(student, shard)],
+                                dtype=np.intp)
+                shard_ids = {students[row].get('id') for row in rows.tolist()}
+                state = {'shard_size': len(rows)}
+                search = self._sharded_search(
+                    shard, self._roster_search(matrix, scales, matcher, templates_at, rows), search,
+                    len(rows), len(students), matcher, state
+                )
+            
+            result = self._assign_faces(
+                boxes,
+                embeddings,
+                search,
+                lambda rows: dequantize(matrix[rows], None if scales is None else scales[rows]),
+                lambda row: students[row],
+                matcher,
+                assignment,
+                templates_at
+            )
+            result['stale_embeddings'] = stale
+            if shard is not None:
+                self._shard_result(result, shard, state, lambda match: match['student_id'] in shard_ids)
+            return result
         
         except Exception as e:
-            logger.error(f"خطأ في المطابقة: {e}")
+            logger.error(f"خطأ في مطابقة الوجوه المتعددة: {e}")
+            face_metrics.error(e)
             import traceback
             logger.error(traceback.format_exc())
             return {
                 'success': False,
                 'message': f'خطأ في المطابقة: {str(e)}',
-                'distance': None,
+                'face_count': 0,
+                'matches': []
+            }
+    
+    @staticmethod
+    def _roster_search(matrix, scales, matcher, templates_at, rows=None):
+        """
+        دالة بحث (queries, k) في بصمات الطلاب المرسلة مع الطلب
+        (أو في الصفوف rows فقط) وترجع أرقام الصفوف في القائمة كاملة
+        """
+        if rows is not None:
+            scales = None if scales is None else scales[rows]
+            subset, matrix = rows, matrix[rows]
+        
+        def search(queries, k):
+            found, distances = matcher.search(queries, matrix, k=k, scales=scales)
+            return (found if rows is None else subset[found]), distances
+        
+        if templates_at is not None:
+            search = two_stage_search(search, templates_at, matcher.metric)
+        return search
+    
+    @staticmethod
+    def _sharded_search(shard, shard_search, global_search, shard_size, total, matcher, state):
+        """
+        بحث في جزء المعرض أولاً، وفي المعرض كاملاً فقط إذا لم يبلغ أفضل مرشح في
+        الجزء حد المطابقة (لأي استعلام)؛ state['fallback'] يُسجل الرجوع
+        
+        عدادات face_shard_rows_total لكل جزء: الصفوف المقارنة في الجزء، وفي الرجوع
+        للمعرض كاملاً، والصفوف التي لم تُقارن مقارنة بالبحث في المعرض كاملاً (saved)
+        
+        عند الرجوع تُرجع نتائج المعرض كاملاً وحدها: طلاب الجزء ضمنها فلا يتكرر طالب
+        في مرشحي الاستعلام الواحد
+        """
+        label = '/'.join(value for _, value in shard)
+        
+        def search(queries, k):
+            count = np.atleast_2d(queries).shape[0]
+            rows, distances = shard_search(queries, k)
+            face_metrics.inc('face_shard_rows_total', shard_size * count, shard=label, scope='shard')
+            if distances.shape[1] and not np.any(distances[:, 0] > matcher.threshold):
+                face_metrics.inc('face_shard_searches_total', shard=label, result='shard')
+                face_metrics.inc('face_shard_rows_total', (total - shard_size) * count, shard=label, scope='saved')
+                return rows, distances
+            
+            state['fallback'] = True
+            face_metrics.inc('face_shard_searches_total', shard=label, result='fallback')
+            face_metrics.inc('face_shard_rows_total', total * count, shard=label, scope='fallback')
+            return global_search(queries, k)
+        
+        return search
+    
+    @staticmethod
+    def _shard_result(result, shard, state, matched_in_shard=None):
+        """
+        وصف الجزء في نتيجة المطابقة: 'matched_in' = 'shard' أو 'global' (None بدون تطابق)
+        
+        Args:
+            matched_in_shard: للوجوه المتعددة، دالة تحدد لكل تطابق هل طالبه من الجزء
+        """
+        fallback = bool(state.get('fallback'))
+        result['shard'] = dict(shard)
+        result['shard_size'] = state['shard_size']
+        result['fallback'] = fallback
+        if 'matches' in result:
+            for match in result['matches']:
+                match['matched_in'] = 'shard' if not fallback or matched_in_shard(match) else 'global'
+        else:
+            result['matched_in'] = ('global' if fallback else 'shard') if result.get('success') else None
+    
+    @staticmethod
+    def _roster_matrix(students_with_embeddings, dim):
+        """
+        مصفوفة بصمات الطلاب المرسلة مع الطلب (قوائم أو صيغة مضغوطة)
+        الطالب ذو 'embeddings' (عدة بصمات) يُمثَّل بمركز بصماته
+        
+        Returns:
+            (الطلاب الصالحون, المصفوفة, معاملات int8 أو None, معرفات البصمات القديمة,
+             دالة بصمات الصف للبحث على مرحلتين أو None إن لم يكن هناك طالب متعدد البصمات)
+        """
+        values, templates, stale_templates = [], {}, set()
+        for i, student in enumerate(students_with_embeddings):
+            vectors, version = decode_templates(student.get('embeddings'), dim)
+            if vectors is None:
+                values.append(student.get('embedding'))
+                continue
+            values.append(vectors.mean(axis=0))
+            if len(vectors) > 1:
+                templates[i] = vectors
+            if is_stale(version):
+                stale_templates.add(i)
+        
+        kept, matrix, scales, stale = stack_embeddings(values, dim)
+        stale = sorted(set(stale) | stale_templates)
+        if len(kept) < len(students_with_embeddings):
+            logger.warning(f"تم تجاهل {len(students_with_embeddings) - len(kept)} بصمة غير صالحة")
+        if stale:
+            logger.warning(f"{len(stale)} بصمة من إصدار أقدم لخوارزمية البصمة")
+        students = [students_with_embeddings[i] for i in kept]
+        row_templates = {row: templates[i] for row, i in enumerate(kept) if i in templates}
+        return (students, matrix, scales, [students_with_embeddings[i].get('id') for i in stale],
+                row_templates.get if row_templates else None)
+    
+    def _assign_faces(self, boxes, embeddings, search, vectors_at, student_at, matcher, assignment,
+                      templates_at=None):
+        """
+        تعيين الوجوه للطلاب بمصفوفة مسافات واحدة (وجوه × مرشحين)
+        
+        يكفي لكل وجه أفضل F مرشحين (F عدد الوجوه): في أي تعيين أمثل لا يحتاج وجه
+        لمرشح أبعد من ذلك لأن F-1 وجوه أخرى فقط قد تحجز مرشحيه الأقرب
+        
+        templates_at: بصمات الطلاب متعددي البصمات (التكلفة أقرب بصمة بدل المركز)
+        """
+        face_count = len(boxes)
+        with face_metrics.stage('match'):
+            matches, matched_faces, best_distances = self._assign_candidates(
+                boxes, embeddings, search, vectors_at, student_at, matcher, assignment, templates_at
+            )
+        
+        face_metrics.inc('face_match_total', len(matches), result='hit')
+        face_metrics.inc('face_match_total', face_count - len(matches), result='miss')
+        
+        matches.sort(key=lambda m: m['distance'])
+        unmatched = [
+            {'box': boxes[face], 'best_distance': best_distances[face]}
+            for face in range(face_count) if face not in matched_faces
+        ]
+        
+        logger.info(f"✓ تم التعرف على {len(matches)} من {face_count} وجه(وه)")
+        
+        return {
+            'success': bool(matches),
+            'message': f"تم التعرف على {len(matches)} من {face_count} وجه(وه)",
+            'face_count': face_count,
+            'recognized_count': len(matches),
+            'metric': matcher.metric,
+            'assignment': assignment,
+            'matches': matches,
+            'unmatched_faces': unmatched
+        }
+    
+    @staticmethod
+    def _assign_candidates(boxes, embeddings, search, vectors_at, student_at, matcher, assignment,
+                           templates_at=None):
+        """
+        Returns:
+            (التطابقات, أرقام الوجوه المعيّنة, أفضل مسافة لكل وجه)
+        """
+        face_count = len(boxes)
+        rows, _ = search(embeddings, face_count)
+        candidates = np.unique(rows[rows >= 0])
+        
+        matches, matched_faces = [], set()
+        best_distances = [None] * face_count
+        
+        if candidates.size:
+            cost = pairwise_distances(embeddings, vectors_at(candidates), matcher.metric)
+            if templates_at is not None:
+                cost = template_distances(embeddings, candidates, cost, templates_at, matcher.metric)
+            best_distances = cost.min(axis=1).tolist()
+            
+            if assignment == 'optimal':
+                blocked = cost > matcher.threshold
+                # التكلفة الكبيرة تجعل الخوارزمية تفضل أكبر عدد من التطابقات الصالحة أولاً
+                padded = np.where(blocked, float(cost.max()) + matcher.threshold + 1.0, cost)
+                face_rows, cand_cols = linear_assignment(padded)
+                valid = ~blocked[face_rows, cand_cols]
+                face_rows, cand_cols = face_rows[valid], cand_cols[valid]
+            else:
+                face_rows, cand_cols = greedy_assignment(cost, matcher.threshold)
+            
+            for face, col in zip(face_rows.tolist(), cand_cols.tolist()):
+                student = student_at(int(candidates[col]))
+                distance = float(cost[face, col])
+                matched_faces.add(face)
+                matches.append({
+                    'student_id': student['id'],
+                    'student_name': student['full_name'],
+                    'stage': student.get('stage'),
+                    'distance': distance,
+                    'similarity': matcher.similarity(distance),
+                    'box': boxes[face],
+                })
+        
+        return matches, matched_faces, best_distances
+    
+    def _match_embedding(self, input_embedding, search, student_at, matcher, top_k=5):
+        """
+        مطابقة بصمة واحدة وبناء النتيجة
+        
+        Args:
+            search: دالة (query, k) -> (rows, distances) بالشكل (1, k)
+            student_at: دالة ترجع بيانات الطالب لرقم الصف
+        """
+        with face_metrics.stage('match'):
+            rows, distances = search(input_embedding, max(1, top_k))
+            rows, distances = rows[0], distances[0]
+            
+            candidates = matcher.candidates(rows, distances, student_at)
+        
+        # طباعة السجل للتصحيح
+        for candidate in candidates[:5]:
+            logger.info(f"  {candidate['student_name']}: {candidate['distance']:.3f}")
+        
+        if candidates:
+            best_match = student_at(int(rows[0]))
+            best_distance = float(distances[0])
+        else:
+            best_match, best_distance = None, float('inf')
+        
+        result = self._build_match_result(best_match, best_distance, matcher)
+        result['metric'] = matcher.metric
+        result['margin'] = candidates[1]['margin'] if len(candidates) > 1 else None
+        result['candidates'] = candidates[:top_k]
+        return result
+    
+    def _build_match_result(self, best_match, best_distance, matcher):
+        """
+        بناء نتيجة المطابقة بناءً على أفضل مسافة
+        """
+        # التحقق من وجود تطابق
+        if best_match and matcher.is_match(best_distance):
+            face_metrics.inc('face_match_total', result='hit')
+            similarity = matcher.similarity(best_distance)
+            
+            logger.info(f"✓ تطابق وجد: {best_match['full_name']} (المسافة: {best_distance:.3f}, التشابه: {similarity:.2%})")
+            
+            return {
+                'success': True,
+                'student_id': best_match['id'],
+                'student_name': best_match['full_name'],
+                'stage': best_match.get('stage'),
+                'distance': best_distance,
+                'similarity': similarity,
+                'message': f"تم العثور على تطابق: {best_match['full_name']}"
+            }
+        else:
+            face_metrics.inc('face_match_total', result='miss')
+            best_distance_msg = f"{best_distance:.3f}" if best_distance != float('inf') else "N/A"
+            logger.warning(f"لم يتم العثور على تطابق (أفضل مسافة: {best_distance_msg})")
+            
+            return {
+                'success': False,
+                'message': f'لم يتم العثور على طالب مطابق (أفضل مسافة: {best_distance_msg})',
+                'distance': best_distance if best_distance != float('inf') else None,
                 'similarity': 0
             }
     
-    def compare_face_encodings(self, embedding1, embedding2):
+    def compare_face_encodings(self, embedding1, embedding2, metric='euclidean'):
         """
-        مقارنة بصمتي وجه مباشرة
+        مقارنة بصمتي وجه مباشرة (بنفس حد المطابقة المستخدم في مطابقة الحضور)
         """
         try:
-            arr1 = np.array(embedding1, dtype=np.float32)
-            arr2 = np.array(embedding2, dtype=np.float32)
-            
-            distance = np.linalg.norm(arr1 - arr2)
-            similarity = 1 - (distance / 30.0)
-            similarity = max(0, min(1, similarity))
+            matcher = FaceMatcher(metric)
+            distance = matcher.distance(embedding_vector(embedding1), embedding_vector(embedding2))
             
             return {
                 'distance': distance,
-                'similarity': similarity,
-                'match': distance <= 30.0
+                'similarity': matcher.similarity(distance),
+                'match': bool(matcher.is_match(distance)),
+                'metric': matcher.metric,
+                'threshold': matcher.threshold
             }
         except Exception as e:
             logger.error(f"خطأ في المقارنة: {e}")
@@ -415,71 +941,112 @@ class FaceRecognitionService:
                 'match': False
             }
     
-    def detect_faces_only(self, image_base64):
+    def _detect_live(self, gray):
+        """كشف سريع في الإطار كاملاً"""
+        return self.detectors.get('live').detect(gray)
+    
+    def _detect_live_near(self, gray_roi, box):
+        """كشف داخل منطقة التتبع: نطاق أحجام ضيق حول حجم الوجه السابق"""
+        _, _, w, h = box
+        return self.detectors.get('track').detect(
+            gray_roi,
+            min_size=int(min(w, h) * TRACK_MIN_SCALE),
+            max_size=int(max(w, h) * TRACK_MAX_SCALE)
+        )
+    
+    def detect_faces_only(self, image_base64, session_id=None, track=None):
         """
         الكشف السريع عن الوجوه بدون استخراج بصمة
-        يُستخدم للكشف الحي في الفيديو
+        يُستخدم للكشف الحي في الفيديو (النتيجة محفوظة لنفس الصورة، انظر face_cache)
+        
+        Args:
+            session_id: معرّف جلسة الكاميرا؛ عند تمريره يُبحث حول الوجوه السابقة فقط
+                        (انظر face_tracker) ولا تُستخدم ذاكرة النتائج
+            track: حالة التتبع المعادة في الرد السابق (للمتابعة عبر عمليات gunicorn)
         """
         try:
-            image_np = self.load_image_from_base64(image_base64)
+            image_data = self.image_bytes(image_base64)
+            cache_key = None
+            if not session_id:
+                cache_key = self.detect_cache.key(image_data, 'detect', LIVE_MAX_WIDTH, self.detectors.signature('live'))
+                cached = self.detect_cache.get(cache_key)
+                if cached is not None:
+                    return cached
             
-            # طباعة معلومات الصورة
-            logger.info(f"صورة مستلمة: الشكل={image_np.shape}, dtype={image_np.dtype}")
+            # الكشف لا يحتاج الألوان: فك ترميز رمادي مصغّر مباشرة (عرض 800 كحد أقصى)
+            with face_metrics.stage('decode'):
+                gray, scale = self.load_gray_image(image_data, max_width=LIVE_MAX_WIDTH, with_scale=True)
+            face_metrics.inc('face_images_total')
             
             # تحقق من أن الصورة ليست فارغة
-            if image_np is None or image_np.size == 0:
+            if gray is None or gray.size == 0:
                 logger.error("الصورة فارغة!")
                 return {
                     'success': False,
                     'face_count': 0,
+                    'boxes': [],
                     'message': 'الصورة فارغة'
                 }
             
-            # تحجيم الصورة إذا كانت كبيرة جداً
-            height, width = image_np.shape[:2]
-            if width > 800:
-                scale = 800.0 / width
-                new_width = 800
-                new_height = int(height * scale)
-                image_np = cv2.resize(image_np, (new_width, new_height))
-            
-            gray = cv2.cvtColor(image_np, cv2.COLOR_BGR2GRAY)
             logger.info(f"الصورة الرمادية: الشكل={gray.shape}")
             
             # الكشف عن الوجوه بمعاملات بسيطة
+            tracking = None
             try:
-                faces = self.face_cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.3,       
-                    minNeighbors=5,        
-                    minSize=(30, 30)      
-                )
+                with face_metrics.stage('detect'):
+                    if session_id:
+                        faces, tracking, track = self.tracker.detect(
+                            session_id, gray, self._detect_live, self._detect_live_near, hint=track
+                        )
+                    else:
+                        faces = self._detect_live(gray)
                 face_count = len(faces)
+                face_metrics.inc('face_faces_found_total', face_count)
                 logger.info(f"المحاولة الأولى: وجوه مكتشفة={face_count}")
                 
             except cv2.error as e:
-                logger.error(f"خطأ في detectMultiScale: {e}")
+                logger.error(f"خطأ في كاشف الوجه: {e}")
+                face_metrics.error(e)
                 # إذا فشلت المحاولة الأولى، حاول بدون معالجة
                 faces = []
                 face_count = 0
+                cache_key = None
+            
+            # الصناديق بإحداثيات الصورة المرسلة (قبل التصغير)
+            boxes = [
+                {'x': int(round(x * scale)), 'y': int(round(y * scale)),
+                 'w': int(round(w * scale)), 'h': int(round(h * scale))}
+                for x, y, w, h in faces
+            ]
             
             if face_count > 0:
                 logger.info(f"✓ تم الكشف عن {face_count} وجه(وه)")
-                return {
+                result = {
                     'success': True,
                     'face_count': face_count,
+                    'boxes': boxes,
                     'message': f"تم الكشف عن {face_count} وجه(وه)"
                 }
             else:
                 logger.info("لم يتم الكشف عن أي وجه")
-                return {
+                result = {
                     'success': False,
                     'face_count': 0,
+                    'boxes': [],
                     'message': 'لم يتم الكشف عن وجه - تأكد من الإضاءة والموضع'
                 }
+            
+            if tracking is not None:
+                result['tracking'] = tracking
+                result['track'] = track
+            
+            if cache_key is not None:
+                self.detect_cache.put(cache_key, result)
+            return result
         
         except Exception as e:
             logger.error(f"خطأ في الكشف: {e}")
+            face_metrics.error(e)
             import traceback
             logger.error(traceback.format_exc())
             return {
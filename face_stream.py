@@ -0,0 +1,320 @@
+"""
+قناة البث الحي للحضور - Live Attendance Stream
+بدلاً من طلب POST مستقل لكل إطار (data URL + JSON ورد JSON كامل) يفتح الجهاز
+اتصالاً واحداً طويلاً: جسم الطلب مقطّع (chunked) يحمل الإطارات الثنائية،
+والرد سطر JSON لكل حدث (NDJSON) طوال مدة الاتصال
+
+رسائل جسم الطلب: نوع (بايت واحد) + الطول (4 بايت big-endian) + المحتوى
+    'J': رسالة تحكم JSON لربط القناة بقائمة طلاب:
+         {'gallery_id': '...'} أو {'students': [...], 'storage': 'float32'}
+         ومعها اختيارياً 'metric' و 'assignment'
+    'F': إطار JPEG/PNG
+    'E': نهاية البث
+
+أحداث الرد:
+    ready   بداية القناة
+    bound   تم ربط القائمة (أو error)
+    frame   نتيجة إطار: الوجوه والمطابقات وزمن المعالجة
+    match   أول تعرف على طالب في هذه القناة
+    ping    كل FACE_STREAM_PING ثانية بدون أحداث (إبقاء الاتصال)
+    end     إحصائيات القناة
+
+إذا تأخر الخادم تُستبدل الإطارات المنتظرة بأحدث إطار (لا طابور)، ويُعد المستبدل
+في 'dropped'. الإطار الذي يُرفض لامتلاء مجموعة الكشف يُعد كذلك
+"""
+
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+
+from face_metrics import face_metrics
+from face_workers import PoolSaturated
+
+logger = logging.getLogger(__name__)
+
+FRAME = b'F'
+CONTROL = b'J'
+END = b'E'
+
+HEADER = struct.Struct('>cI')
+
+# أقصى حجم لرسالة واحدة (إطار أو قائمة طلاب)
+MAX_MESSAGE_BYTES = int(os.environ.get('FACE_STREAM_MAX_MESSAGE_MB', 8)) * 1024 * 1024
+
+# أقصى عدد قنوات مفتوحة في كل عملية (كل قناة تحجز خيطاً من خيوط gunicorn)
+MAX_CHANNELS = int(os.environ.get('FACE_STREAM_MAX_CHANNELS', 4))
+
+PING_INTERVAL = float(os.environ.get('FACE_STREAM_PING', 15))
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_message(kind, payload=b''):
+    """رسالة واحدة من رسائل جسم الطلب"""
+    if isinstance(payload, (dict, list)):
+        payload = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return HEADER.pack(kind, len(payload)) + bytes(payload)
+
+
+def _read_exact(stream, size):
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_message(stream):
+    """
+    قراءة رسالة من جسم الطلب
+
+    Returns:
+        (النوع, المحتوى) أو (END, b'') عند انتهاء الجسم
+    """
+    header = _read_exact(stream, HEADER.size)
+    if header is None:
+        return END, b''
+    kind, size = HEADER.unpack(header)
+    if kind not in (FRAME, CONTROL, END):
+        raise ProtocolError(f'نوع رسالة غير معروف: {kind!r}')
+    if size > MAX_MESSAGE_BYTES:
+        raise ProtocolError(f'حجم الرسالة ({size}) أكبر من الحد المسموح')
+    payload = _read_exact(stream, size) if size else b''
+    if payload is None:
+        return END, b''
+    return kind, payload
+
+
+def encode_event(event):
+    return (json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class _Mailbox:
+    """
+    صندوق الرسائل بين خيط القراءة وخيط المعالجة:
+    رسائل التحكم بالترتيب، والإطارات خانة واحدة يستبدلها الأحدث
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._controls = []
+        self._frame = None
+        self._closed = False
+        self.error = None
+        self.received = 0
+        self.dropped = 0
+
+    def put_control(self, message):
+        with self._cond:
+            self._controls.append(message)
+            self._cond.notify()
+
+    def drop(self, reason):
+        with self._cond:
+            self.dropped += 1
+        face_metrics.inc('face_stream_frames_total', result=reason)
+
+    def put_frame(self, data):
+        with self._cond:
+            self.received += 1
+            if self._frame is not None:
+                self.drop('dropped')
+            self._frame = (self.received, data, time.perf_counter())
+            self._cond.notify()
+
+    def close(self, error=None):
+        with self._cond:
+            self._closed = True
+            self.error = error
+            self._cond.notify()
+
+    def take(self, timeout):
+        """
+        Returns:
+            ('control', رسالة) أو ('frame', (الرقم, البايتات, وقت الاستلام))
+            أو ('closed', None) أو (None, None) عند انتهاء المهلة
+        """
+        with self._cond:
+            if not self._controls and self._frame is None and not self._closed:
+                self._cond.wait(timeout)
+            if self._controls:
+                return 'control', self._controls.pop(0)
+            if self._frame is not None:
+                frame, self._frame = self._frame, None
+                return 'frame', frame
+            if self._closed:
+                return 'closed', None
+            return None, None
+
+
+class StreamChannel:
+    """
+    قناة بث واحدة (اتصال واحد من جهاز الحضور)
+
+    Args:
+        service: خدمة الوجه (face_service)
+        pool: مجموعة الكشف (detection_pool)
+        stream: جسم الطلب القابل للقراءة تدريجياً
+        options: معاملات الاتصال (gallery_id, metric, assignment)
+    """
+
+    def __init__(self, service, pool, stream, options=None):
+        self.service = service
+        self.pool = pool
+        self.stream = stream
+        self.channel_id = uuid.uuid4().hex[:12]
+        self.options = dict(options or {})
+        self.gallery = None
+        self.gallery_id = None
+        self.mailbox = _Mailbox()
+        self.processed = 0
+        self.recognized = {}
+
+    def _reader(self):
+        try:
+            while True:
+                kind, payload = read_message(self.stream)
+                if kind == END:
+                    break
+                if kind == CONTROL:
+                    self.mailbox.put_control(json.loads(payload))
+                else:
+                    self.mailbox.put_frame(payload)
+            self.mailbox.close()
+        except Exception as e:
+            logger.warning(f"انقطاع قناة البث {self.channel_id}: {e}")
+            self.mailbox.close(str(e))
+
+    def _bind(self, message):
+        """ربط القناة بمعرض مسجل أو بقائمة طلاب مرسلة"""
+        for key in ('metric', 'assignment'):
+            if key in message:
+                self.options[key] = message[key]
+
+        if message.get('gallery_id'):
+            gallery = self.service.galleries.get(message['gallery_id'])
+            if gallery is None:
+                return {'event': 'error', 'error': 'gallery_not_found',
+                        'message': 'المعرض غير مسجل، يرجى تسجيل قائمة الطلاب من جديد'}
+            self.gallery = gallery
+            self.gallery_id = gallery.gallery_id
+            return {'event': 'bound', 'gallery_id': gallery.gallery_id,
+                    'version': gallery.version, 'size': gallery.size, 'skipped': []}
+
+        students = message.get('students')
+        if isinstance(students, list):
+            from face_embedding_codec import DTYPES
+            from face_gallery import FaceGallery
+
+            storage = message.get('storage', 'float32')
+            if storage not in DTYPES:
+                return {'event': 'error', 'message': f'نوع تخزين غير معروف: {storage}'}
+            # معرض خاص بالقناة: لا يُسجل ولا يُحفظ على القرص
+            gallery = FaceGallery(f"stream-{self.channel_id}", capacity=len(students), storage=storage)
+            _, _, skipped = gallery.upsert(students)
+            self.gallery = gallery
+            self.gallery_id = None
+            return {'event': 'bound', 'gallery_id': None, 'version': gallery.version,
+                    'size': gallery.size, 'skipped': skipped}
+
+        return {'event': 'error', 'message': 'رسالة تحكم غير معروفة'}
+
+    def _process(self, seq, data):
+        """معالجة إطار: مطابقة إذا كانت القناة مربوطة بقائمة، وإلا كشف فقط مع التتبع"""
+        if self.gallery is None:
+            result = self.pool.run(self.service.detect_faces_only, data, self.channel_id)
+            return {
+                'face_count': result.get('face_count', 0),
+                'boxes': result.get('boxes', []),
+                'matches': []
+            }
+
+        if self.gallery_id:
+            # المعرض المسجل قد يُحدَّث من عملية أخرى أثناء البث
+            self.gallery = self.service.galleries.get(self.gallery_id) or self.gallery
+
+        result = self.pool.run(
+            self.service.match_faces_in_frame,
+            data,
+            metric=self.options.get('metric', 'euclidean'),
+            assignment=self.options.get('assignment', 'greedy'),
+            gallery=self.gallery
+        )
+        matches = result.get('matches', [])
+        return {
+            'face_count': result.get('face_count', 0),
+            'boxes': [m['box'] for m in matches] + [f['box'] for f in result.get('unmatched_faces', [])],
+            'matches': matches
+        }
+
+    def events(self):
+        """مولد الأحداث (قواميس) حتى نهاية البث"""
+        reader = threading.Thread(target=self._reader, name=f"face-stream-{self.channel_id}", daemon=True)
+        reader.start()
+        yield {'event': 'ready', 'channel': self.channel_id, 'max_message_bytes': MAX_MESSAGE_BYTES}
+
+        if self.options.get('gallery_id'):
+            yield self._bind({'gallery_id': self.options['gallery_id']})
+
+        last_event = time.monotonic()
+        while True:
+            kind, item = self.mailbox.take(PING_INTERVAL)
+            if kind == 'closed':
+                break
+            if kind is None:
+                if time.monotonic() - last_event >= PING_INTERVAL:
+                    last_event = time.monotonic()
+                    yield {'event': 'ping'}
+                continue
+
+            if kind == 'control':
+                yield self._bind(item)
+                last_event = time.monotonic()
+                continue
+
+            seq, data, received_at = item
+            try:
+                with face_metrics.endpoint('stream_frame'):
+                    frame = self._process(seq, data)
+            except PoolSaturated:
+                self.mailbox.drop('busy')
+                continue
+
+            self.processed += 1
+            face_metrics.inc('face_stream_frames_total', result='processed')
+            frame.update({
+                'event': 'frame',
+                'frame': seq,
+                'latency_ms': round((time.perf_counter() - received_at) * 1000, 1),
+                'dropped': self.mailbox.dropped
+            })
+            yield frame
+
+            for match in frame['matches']:
+                if match['student_id'] not in self.recognized:
+                    self.recognized[match['student_id']] = seq
+                    yield dict(match, event='match', frame=seq)
+            last_event = time.monotonic()
+
+        self.service.tracker.end(self.channel_id)
+        if self.mailbox.error:
+            yield {'event': 'error', 'message': self.mailbox.error}
+        yield {
+            'event': 'end',
+            'frames_received': self.mailbox.received,
+            'frames_processed': self.processed,
+            'frames_dropped': self.mailbox.dropped,
+            'recognized': list(self.recognized)
+        }
+
+
+channel_slots = threading.BoundedSemaphore(MAX_CHANNELS)
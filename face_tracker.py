@@ -0,0 +1,139 @@
+"""
+تتبع الوجوه لكل جلسة كاميرا - Session Face Tracker
+الكشف الحي يُرسل إطاراً كل 200ms والوجه لا يتحرك كثيراً بين الإطارات، فبدلاً من
+البحث في الإطار كاملاً يُبحث فقط في منطقة موسعة حول آخر صناديق معروفة،
+مع كشف كامل كل N إطار أو عند فقدان أحد الوجوه
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from face_metrics import face_metrics
+
+
+def _overlap(a, b):
+    """نسبة التقاطع إلى الاتحاد (IoU) لصندوقين (x, y, w, h)"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+class _Session:
+    __slots__ = ('boxes', 'age', 'shape', 'seen', 'lock')
+
+    def __init__(self):
+        self.boxes = []
+        self.age = 0
+        self.shape = None
+        self.seen = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class FaceTracker:
+    """
+    Args:
+        redetect_every: كشف كامل كل N إطار حتى مع نجاح التتبع
+        margin: توسيع منطقة البحث حول الصندوق (نسبة من عرضه/ارتفاعه في كل اتجاه)
+        max_sessions: أقصى عدد جلسات محفوظة (الأقدم يُحذف أولاً)
+        session_ttl: حذف الجلسة بعد هذه المدة بدون إطارات (ثوانٍ)
+    """
+
+    def __init__(self, redetect_every=None, margin=0.3, max_sessions=1024, session_ttl=60.0):
+        self.redetect_every = redetect_every or int(os.environ.get('FACE_TRACK_REDETECT_EVERY', 10))
+        self.margin = margin
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session(self, session_id, hint):
+        now = time.monotonic()
+        with self._lock:
+            # حذف الجلسات المنتهية من الأقدم
+            while self._sessions:
+                oldest_id, oldest = next(iter(self._sessions.items()))
+                if now - oldest.seen <= self.session_ttl and len(self._sessions) < self.max_sessions:
+                    break
+                del self._sessions[oldest_id]
+
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session()
+                # جلسة بدأت في عملية أخرى: المتابعة من حالة التتبع التي أعادها العميل
+                if hint:
+                    session.boxes = [tuple(int(v) for v in box) for box in hint.get('boxes', [])]
+                    session.age = int(hint.get('age', 0))
+                    session.shape = tuple(hint['shape']) if hint.get('shape') else None
+            else:
+                self._sessions.move_to_end(session_id)
+            session.seen = now
+            return session
+
+    def _roi(self, box, shape):
+        x, y, w, h = box
+        dx, dy = int(w * self.margin), int(h * self.margin)
+        x0, y0 = max(0, x - dx), max(0, y - dy)
+        x1, y1 = min(shape[1], x + w + dx), min(shape[0], y + h + dy)
+        return x0, y0, x1, y1
+
+    def _track(self, gray, boxes, detect_roi):
+        """البحث حول كل صندوق سابق؛ None إذا فُقد أي وجه"""
+        found = []
+        for box in boxes:
+            x0, y0, x1, y1 = self._roi(box, gray.shape)
+            if x1 - x0 < box[2] or y1 - y0 < box[3]:
+                return None
+            faces = detect_roi(gray[y0:y1, x0:x1], box)
+            if len(faces) == 0:
+                return None
+            # الأقرب للصندوق السابق
+            candidates = [(x + x0, y + y0, w, h) for x, y, w, h in faces]
+            best = max(candidates, key=lambda c: _overlap(c, box))
+            if any(_overlap(best, other) > 0.3 for other in found):
+                continue
+            found.append(best)
+        return found
+
+    def detect(self, session_id, gray, detect_full, detect_roi, hint=None):
+        """
+        كشف الوجوه في إطار جلسة
+
+        Args:
+            detect_full: دالة (gray) -> صناديق في الإطار كاملاً
+            detect_roi: دالة (gray_roi, الصندوق السابق) -> صناديق داخل المنطقة
+            hint: حالة التتبع من رد سابق {'boxes', 'age', 'shape'} (اختياري)
+
+        Returns:
+            (الصناديق [(x, y, w, h)], 'full' أو 'roi', حالة التتبع)
+        """
+        session = self._session(session_id, hint)
+        with session.lock:
+            faces = None
+            mode = 'roi'
+            if session.boxes and session.shape == gray.shape[:2] and session.age < self.redetect_every:
+                faces = self._track(gray, session.boxes, detect_roi)
+
+            if faces is None:
+                mode = 'full'
+                faces = [tuple(int(v) for v in face) for face in detect_full(gray)]
+                session.age = 0
+            else:
+                session.age += 1
+
+            session.boxes = [tuple(int(v) for v in face) for face in faces]
+            session.shape = gray.shape[:2]
+            state = {'boxes': [list(box) for box in session.boxes], 'age': session.age, 'shape': list(session.shape)}
+
+        face_metrics.inc('face_track_total', mode=mode)
+        return faces, mode, state
+
+    def end(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
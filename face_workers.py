@@ -0,0 +1,120 @@
+"""
+مجموعة خيوط الكشف - Detection Worker Pool
+تنفيذ أعمال الوجه الثقيلة في خيوط داخل كل عملية gunicorn مع طابور محدود
+
+OpenCV يحرر الـ GIL أثناء فك الترميز والكشف، فتعمل الخيوط بالتوازي فعلياً
+عند امتلاء الطابور يُرفض الطلب فوراً (HTTP 429 + Retry-After) بدلاً من انتظار غير محدود
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from face_metrics import face_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturated(Exception):
+    """الطابور ممتلئ، retry_after بالثواني"""
+
+    def __init__(self, retry_after):
+        super().__init__('مجموعة الكشف مشغولة')
+        self.retry_after = retry_after
+
+
+class DetectionPool:
+    """
+    مجموعة خيوط بطابور محدود
+    السعة الكلية = عدد الخيوط (قيد التنفيذ) + حجم الطابور (بانتظار خيط)
+    """
+
+    def __init__(self, max_workers=None, max_queue=None):
+        self.max_workers = max_workers or int(os.environ.get('FACE_DETECT_THREADS', 0)) or os.cpu_count() or 1
+        if max_queue is None:
+            max_queue = int(os.environ.get('FACE_DETECT_QUEUE', self.max_workers * 2))
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # متوسط متحرك لزمن المهمة لتقدير Retry-After
+        self._avg_seconds = 0.1
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                logger.info(f"تشغيل مجموعة خيوط الكشف ({self.max_workers} خيط، طابور {self.max_queue})")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='face-detect'
+                )
+            return self._executor
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def retry_after(self):
+        """تقدير الوقت اللازم لتفريغ الطابور الحالي (ثانية واحدة على الأقل)"""
+        with self._lock:
+            backlog = self._pending * self._avg_seconds / self.max_workers
+        return max(1, math.ceil(backlog))
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        جدولة مهمة دون انتظار
+
+        Raises:
+            PoolSaturated: إذا امتلأت الخيوط والطابور
+        """
+        if not self._slots.acquire(blocking=False):
+            face_metrics.inc('face_rejected_total')
+            raise PoolSaturated(self.retry_after())
+
+        with self._lock:
+            self._pending += 1
+
+        endpoint = face_metrics.current_endpoint
+        submitted = time.perf_counter()
+
+        def task():
+            start = time.perf_counter()
+            with face_metrics.labelled(endpoint):
+                face_metrics.observe('face_stage_seconds', start - submitted, stage='queue')
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    with self._lock:
+                        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+
+        try:
+            future = self._get_executor().submit(task)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """تنفيذ مهمة في المجموعة وانتظار نتيجتها"""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        # خارج القفل: إلغاء المهام المنتظرة يستدعي _release الذي يأخذ نفس القفل
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+detection_pool = DetectionPool()
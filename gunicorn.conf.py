@@ -0,0 +1,32 @@
+"""
+إعدادات gunicorn (تُقرأ تلقائياً من مجلد التشغيل)
+خيارات سطر الأوامر في Procfile / render.yaml لها الأولوية
+
+FACE_LOAD=preload: تحميل التطبيق ونظام الوجه في العملية الرئيسية قبل fork (انظر face_loader)
+"""
+
+import os
+
+# العملية الرئيسية تحمّل الوحدات والكاشفات فقط بدون تشغيل أي كشف، حتى لا تُنشأ
+# خيوط OpenCV قبل fork
+preload_app = os.environ.get('FACE_LOAD') == 'preload'
+
+
+def on_starting(server):
+    """حذف لقطات المقاييس من التشغيل السابق قبل بدء العمليات"""
+    from face_metrics import FaceMetrics
+    FaceMetrics().clear_directory()
+
+
+def post_worker_init(worker):
+    """
+    تسخين نظام الوجه في خيط خلفي (FACE_WARMUP) دون تأخير قبول الطلبات،
+    وتشغيل منفذ المهام حتى تُستأنف المهام المنتظرة بعد إعادة التشغيل
+    عدد العمليات يحدد حصة كل عملية من الأنوية لمجموعة الاستخراج (face_batch)
+    """
+    import face_jobs
+    import face_loader
+    os.environ.setdefault('FACE_SERVER_WORKERS', str(worker.cfg.workers))
+    if face_loader.warmup_enabled():
+        face_loader.warm_up_in_background()
+    face_jobs.job_runner.start()
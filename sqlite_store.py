@@ -0,0 +1,52 @@
+"""
+أساس المخازن المحلية في SQLite (المهام، الحضور، قائمة الطلاب)
+اتصال لكل خيط (واتصال جديد في العملية بعد fork)، وضع WAL حتى لا تُوقف القراءةُ
+الكتابة بين عمليات gunicorn، والكتابة داخل معاملات BEGIN IMMEDIATE
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLiteStore:
+    """
+    المخزن الفرعي يحدد SCHEMA، ويمكنه تجاوز _prepare لترحيل البيانات عند أول اتصال
+    """
+
+    SCHEMA = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            if not self._schema_ready:
+                self._prepare(connection)
+                self._schema_ready = True
+        return connection
+
+    def _prepare(self, connection):
+        connection.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
@@ -72,6 +72,7 @@ async function addStudent(data) {
     phone: data.phone || '',
     age: data.age || null,
     face_embedding: data.face_embedding || null,
+    face_embeddings: data.face_embeddings || null,
     created_at: serverTimestamp(),
     updated_at: serverTimestamp()
   };
@@ -40,6 +40,131 @@ const PythonFaceAPI = {
         }
     },
 
+    /**
+     * استخراج بصمات عدة صور دفعة واحدة (استيراد الطلاب)
+     * onResult اختياري: يستقبل نتيجة كل صورة فور اكتمالها
+     */
+    async extractEmbeddings(images, onResult) {
+        try {
+            const response = await fetch('/api/face/extract-embeddings', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    images: images,
+                    stream: Boolean(onResult)
+                })
+            });
+
+            if (!onResult) {
+                return await response.json();
+            }
+
+            const results = new Array(images.length);
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let newline;
+                while ((newline = buffer.indexOf('\n')) >= 0) {
+                    const line = buffer.slice(0, newline).trim();
+                    buffer = buffer.slice(newline + 1);
+                    if (!line) continue;
+                    const result = JSON.parse(line);
+                    results[result.index] = result;
+                    onResult(result);
+                }
+            }
+
+            return { success: true, results: results };
+
+        } catch (err) {
+            console.error('خطأ في الاتصال:', err);
+            return {
+                success: false,
+                message: 'خطأ في الاتصال بالخادم: ' + err.message
+            };
+        }
+    },
+
+    // المعرض المسجل على الخادم لقائمة الطلاب الحالية
+    gallery: null,
+
+    /**
+     * بصمة مختصرة لقائمة الطلاب لمعرفة متى يجب إعادة تسجيل المعرض
+     */
+    rosterSignature(studentsData) {
+        return studentsData.map(s => {
+            const emb = s.embedding || [];
+            return `${s.id}:${emb.length}:${emb[0]}:${emb[emb.length - 1]}:${(s.embeddings || []).length}`;
+        }).join('|');
+    },
+
+    /**
+     * معرف ثابت للمعرض: معرف الجهاز (محفوظ في localStorage) مع المراحل في القائمة
+     * فإعادة تحميل الصفحة تستبدل نفس المعرض على الخادم بدلاً من إنشاء معرض جديد
+     */
+    galleryId(studentsData) {
+        let device;
+        try {
+            device = localStorage.getItem('faceGalleryDevice');
+            if (!device) {
+                device = (window.crypto && crypto.randomUUID
+                    ? crypto.randomUUID().replace(/-/g, '')
+                    : Date.now().toString(36) + Math.random().toString(36).slice(2)).slice(0, 16);
+                localStorage.setItem('faceGalleryDevice', device);
+            }
+        } catch (err) {
+            // localStorage غير متاح: الخادم ينشئ معرفاً جديداً
+            return undefined;
+        }
+
+        // FNV-1a للمراحل حتى لا تستبدل صفحتان بمرحلتين مختلفتين معرض بعضهما
+        const stages = [...new Set(studentsData.map(s => String(s.stage ?? '')))].sort().join('|');
+        let hash = 0x811c9dc5;
+        for (let i = 0; i < stages.length; i++) {
+            hash = Math.imul(hash ^ stages.charCodeAt(i), 0x01000193);
+        }
+        return `${device}-${(hash >>> 0).toString(16)}`;
+    },
+
+    /**
+     * تسجيل قائمة الطلاب كمعرض على الخادم (مرة واحدة بدلاً من كل إطار)
+     */
+    async registerGallery(studentsData) {
+        const response = await fetch('/api/face/galleries', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                gallery_id: this.gallery ? this.gallery.id : this.galleryId(studentsData),
+                students: studentsData
+            })
+        });
+
+        const result = await response.json();
+
+        if (!result.success) {
+            throw new Error(result.message || 'فشل تسجيل المعرض');
+        }
+
+        this.gallery = {
+            id: result.gallery_id,
+            version: result.version,
+            signature: this.rosterSignature(studentsData)
+        };
+        console.log(`✓ تم تسجيل المعرض ${result.gallery_id} (${result.size} طالب)`);
+
+        return this.gallery;
+    },
+
     /**
      * مطابقة الوجه لتسجيل الحضور
      */
@@ -52,20 +177,42 @@ const PythonFaceAPI = {
                 id: s.id,
                 full_name: s.full_name,
                 stage: s.stage,
-                embedding: s.face_embedding || s.embedding
-            }));
+                embedding: s.face_embedding || s.embedding,
+                // لقطات التسجيل المتعددة (إن وجدت) للمطابقة على مرحلتين
+                embeddings: s.face_embeddings || undefined
+            })).filter(s => s.embedding);
 
-            const response = await fetch('/api/face/match-attendance', {
+            const signature = this.rosterSignature(studentsData);
+            if (!this.gallery || this.gallery.signature !== signature) {
+                await this.registerGallery(studentsData);
+            }
+
+            const send = () => fetch('/api/face/match-attendance', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify({
                     image: imageData,
-                    students: studentsData
+                    gallery_id: this.gallery.id
                 })
             });
 
+            let response = await send();
+
+            // المعرض غير موجود على الخادم (إعادة تشغيل مثلاً) - إعادة التسجيل مرة واحدة
+            if (response.status === 404) {
+                await this.registerGallery(studentsData);
+                response = await send();
+            }
+
+            // الخادم مشغول (429) - الانتظار حسب Retry-After ثم المحاولة مرة واحدة
+            if (response.status === 429) {
+                const wait = parseInt(response.headers.get('Retry-After') || '1', 10);
+                await new Promise(resolve => setTimeout(resolve, wait * 1000));
+                response = await send();
+            }
+
             const result = await response.json();
 
             if (result.success) {
@@ -0,0 +1,213 @@
+"""
+قائمة الطلاب على الخادم مع رقم إصدار للتغييرات - Student Roster
+الكشك يحمّل قائمة الطلاب (مع face_embedding) قبل كل جلسة حضور؛ مع رقم الإصدار
+يحمّل فقط ما تغير منذ آخر تحميل، ولا شيء إذا لم يتغير شيء
+
+- كل إضافة أو تعديل أو حذف يأخذ رقم الإصدار التالي (تصاعدي في كل العمليات، داخل
+  معاملة BEGIN IMMEDIATE)، والحذف يُحفظ كعلامة (tombstone) حتى يصل للعملاء
+- إعادة إرسال طالب بنفس البيانات لا تغير الإصدار
+- القراءة بترتيب الإصدار: نفس الاستعلام يخدم التحميل الكامل والتغييرات منذ إصدار
+  (since) والترقيم بالمؤشر (cursor = إصدار آخر صف في الصفحة)
+"""
+
+import json
+import logging
+import os
+import time
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROSTER_DB = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'instance', 'roster.sqlite3'
+)
+
+MAX_PAGE_SIZE = 5000
+
+# عدد الطلاب في كل جزء من الرد المتدفق
+STREAM_CHUNK = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS students_version ON students (version);
+"""
+
+
+def _encode(student):
+    """نص JSON ثابت للمقارنة والتخزين (بدون id، فهو مفتاح الصف)"""
+    return json.dumps({k: v for k, v in student.items() if k != 'id'},
+                      ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+class RosterStore(SQLiteStore):
+    """الطلاب مع رقم إصدار لكل تغيير (رقم إصدار القائمة = أكبرها)"""
+
+    SCHEMA = SCHEMA
+
+    def __init__(self, path=None):
+        super().__init__(path or os.environ.get('ROSTER_DB', DEFAULT_ROSTER_DB))
+
+    @staticmethod
+    def _version(db):
+        return db.execute('SELECT COALESCE(MAX(version), 0) FROM students').fetchone()[0]
+
+    def version(self):
+        return self._version(self._connect())
+
+    def upsert(self, students, replace=False):
+        """
+        إضافة أو تحديث طلاب (كل طالب قاموس فيه 'id')
+
+        Args:
+            replace: القائمة كاملة، فالطلاب غير الموجودين فيها يُحذفون
+
+        Returns:
+            {'version', 'changed', 'deleted'}
+        """
+        rows = {}
+        for student in students:
+            if not isinstance(student, dict) or not student.get('id'):
+                raise ValueError('كل طالب يحتاج id')
+            rows[str(student['id'])] = _encode(student)
+
+        changed = deleted = 0
+        now = time.time()
+        with self._transaction() as db:
+            version = self._version(db)
+            existing = {}
+            if rows:
+                # دفعات حتى لا يتجاوز عدد المعاملات حد SQLite
+                ids = list(rows)
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    existing.update(
+                        (row['id'], (row['data'], row['deleted'])) for row in db.execute(
+                            f"SELECT id, data, deleted FROM students WHERE id IN ({', '.join('?' * len(chunk))})",
+                            chunk
+                        )
+                    )
+            for student_id, data in rows.items():
+                if existing.get(student_id) == (data, 0):
+                    continue
+                version += 1
+                changed += 1
+                db.execute(
+                    'INSERT INTO students (id, version, deleted, data, updated_at) VALUES (?, ?, 0, ?, ?) '
+                    'ON CONFLICT (id) DO UPDATE SET version = excluded.version, deleted = 0, '
+                    'data = excluded.data, updated_at = excluded.updated_at',
+                    (student_id, version, data, now)
+                )
+            if replace:
+                missing = [row['id'] for row in db.execute('SELECT id FROM students WHERE deleted = 0')
+                           if row['id'] not in rows]
+                deleted, version = self._tombstone(db, missing, version, now)
+        return {'version': version, 'changed': changed, 'deleted': deleted}
+
+    def delete(self, student_ids):
+        with self._transaction() as db:
+            deleted, version = self._tombstone(db, [str(i) for i in student_ids], self._version(db), time.time())
+        return {'version': version, 'changed': 0, 'deleted': deleted}
+
+    @staticmethod
+    def _tombstone(db, student_ids, version, now):
+        deleted = 0
+        for student_id in student_ids:
+            cursor = db.execute(
+                "UPDATE students SET version = ?, deleted = 1, data = '{}', updated_at = ? "
+                "WHERE id = ? AND deleted = 0",
+                (version + 1, now, student_id)
+            )
+            if cursor.rowcount:
+                version += 1
+                deleted += 1
+        return deleted, version
+
+    def snapshot(self):
+        """
+        بدء قراءة متسقة: الإصدار والصفوف من نفس لقطة القاعدة حتى لو تغيرت أثناء
+        إرسال الرد (يجب إغلاقها بـ RosterSnapshot.close)
+        """
+        return RosterSnapshot(self._connect())
+
+
+class RosterSnapshot:
+    """معاملة قراءة مفتوحة على اتصال الخيط الحالي"""
+
+    def __init__(self, db):
+        self.db = db
+        if db.in_transaction:
+            # قراءة سابقة لم يُغلق ردها (عميل قطع الاتصال قبل بدء الجسم)
+            db.execute('ROLLBACK')
+        db.execute('BEGIN')
+        self.version = RosterStore._version(db)
+
+    def rows(self, since=0, cursor=None, limit=None):
+        """
+        الطلاب الذين تغيروا بعد max(since, cursor) بترتيب الإصدار
+        بدون since (تحميل كامل) لا تُرجع المحذوفات
+
+        Yields:
+            (الإصدار, المعرف, محذوف, نص JSON للبيانات)
+        """
+        after = max(int(since or 0), int(cursor or 0))
+        sql = 'SELECT id, version, deleted, data FROM students WHERE version > ?'
+        if not since:
+            sql += ' AND deleted = 0'
+        sql += ' ORDER BY version'
+        params = [after]
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(max(1, min(int(limit), MAX_PAGE_SIZE)))
+        for row in self.db.execute(sql, params):
+            yield row['version'], row['id'], bool(row['deleted']), row['data']
+
+    def close(self):
+        """إنهاء القراءة (آمن للاستدعاء أكثر من مرة)"""
+        if not self.db.in_transaction:
+            return
+        try:
+            self.db.execute('COMMIT')
+        except Exception as e:
+            logger.warning(f"تعذر إغلاق قراءة القائمة: {e}")
+
+
+def stream_roster(snapshot, since=0, cursor=None, limit=None):
+    """
+    جسم الرد كـ JSON متدفق على أجزاء (لا تُبنى القائمة كاملة في الذاكرة):
+        {"success": true, "version": V, "since": S,
+         "students": [...], "deleted": [...], "next_cursor": C أو null}
+    """
+    try:
+        yield ('{"success":true,"version":%d,"since":%d,"students":['
+               % (snapshot.version, int(since or 0)))
+        deleted, chunk, count, written, last = [], [], 0, 0, None
+        for version, student_id, is_deleted, data in snapshot.rows(since, cursor, limit):
+            count += 1
+            last = version
+            if is_deleted:
+                deleted.append(student_id)
+                continue
+            # البيانات مخزنة كنص JSON: إضافة id بدون إعادة تحليلها
+            chunk.append('{"id":%s%s' % (json.dumps(student_id, ensure_ascii=False),
+                                         ',' + data[1:] if data != '{}' else '}'))
+            if len(chunk) >= STREAM_CHUNK:
+                yield (',' if written else '') + ','.join(chunk)
+                written += len(chunk)
+                chunk = []
+        if chunk:
+            yield (',' if written else '') + ','.join(chunk)
+        more = limit and count >= max(1, min(int(limit), MAX_PAGE_SIZE)) and last < snapshot.version
+        yield '],"deleted":%s,"next_cursor":%s}' % (
+            json.dumps(deleted, ensure_ascii=False), json.dumps(last if more else None))
+    finally:
+        snapshot.close()
+
+
+roster_store = RosterStore()
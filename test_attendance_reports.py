@@ -0,0 +1,145 @@
+"""
+اختبار تجميعات تقارير الحضور (attendance_reports): التحديث التدريجي مع كل سجل
+يساوي إعادة البناء (rebuild) ويساوي العد المباشر من جدول السجلات، مع سجلات مكررة
+ومتعارضة وسجلات متأخرة لجلسات سابقة
+
+التشغيل:
+    python -m pytest -q test_attendance_reports.py
+"""
+
+import random
+from collections import defaultdict
+
+import attendance_reports
+from attendance_store import AttendanceStore, normalize_record
+
+
+def _rows(seed, count=400):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        student = rng.randrange(10)
+        rows.append(normalize_record({
+            'student_id': f's{student}',
+            # الاسم يختلف بين السجلات المكررة (التعارض) وقد يكون فارغاً
+            'student_name': rng.choice(['', f'name {student}', f'renamed {student}']),
+            'stage': str(student % 2 + rng.choice([0, 0, 0, 2])),
+            'date': f'2026-10-{rng.randrange(1, 8):02d}',
+            'time': f'{rng.randrange(8, 15):02d}:{rng.randrange(60):02d}:00',
+            'lecture_name': rng.choice(['-', 'Math', 'Physics']),
+        }, source=rng.choice(['face', 'manual', 'firebase'])))
+    return rows
+
+
+def _rollups(db):
+    return {
+        table: sorted(tuple(row) for row in db.execute(f'SELECT * FROM {table}'))
+        for table in attendance_reports.ROLLUP_TABLES
+    }
+
+
+def _streaks(seqs):
+    streak = best = 0
+    for i, seq in enumerate(seqs):
+        streak = streak + 1 if i and seq == seqs[i - 1] + 1 else 1
+        best = max(best, streak)
+    return streak, best
+
+
+def _recount(db):
+    """التجميعات محسوبة مباشرة من السجلات حسب التعريفات في attendance_reports"""
+    raw = [dict(row) for row in db.execute('SELECT * FROM attendance ORDER BY id')]
+
+    first_id = {}
+    for row in raw:
+        first_id.setdefault((row['date'], row['stage'], row['lecture_name']), row['id'])
+    seq = {}
+    for stage in {key[1] for key in first_id}:
+        keys = sorted((key for key in first_id if key[1] == stage), key=first_id.get)
+        seq.update((key, n) for n, key in enumerate(keys, 1))
+
+    by_stage, by_day, by_student = defaultdict(list), defaultdict(list), defaultdict(list)
+    for row in raw:
+        by_stage[row['stage']].append(row)
+        by_day[(row['stage'], row['date'])].append(row)
+        by_student[(row['stage'], row['student_id'])].append(row)
+    joined = {stage: {} for stage in by_stage}
+    for row in raw:
+        joined[row['stage']].setdefault(row['student_id'], row['id'])
+
+    stages = [
+        (stage, len(joined[stage]), sum(key[1] == stage for key in seq), len(rows))
+        for stage, rows in by_stage.items()
+    ]
+    sessions = [
+        (*key, seq[key], sum((r['date'], r['stage'], r['lecture_name']) == key for r in raw)) for key in seq
+    ]
+    days = []
+    for (stage, date), rows in by_day.items():
+        last = max(row['id'] for row in rows)
+        days.append((stage, date, len({row['lecture_name'] for row in rows}), len(rows),
+                     len({row['student_id'] for row in rows}),
+                     sum(first <= last for first in joined[stage].values())))
+    students = []
+    for (stage, student_id), rows in by_student.items():
+        seqs = sorted(seq[(row['date'], stage, row['lecture_name'])] for row in rows)
+        names = [row['student_name'] for row in rows if row['student_name']]
+        dates = [row['date'] for row in rows]
+        students.append((stage, student_id, names[-1] if names else '', len(rows), len(set(dates)),
+                         min(dates), max(dates), seqs[-1], *_streaks(seqs)))
+    return {
+        'report_stages': sorted(stages),
+        'report_sessions': sorted(sessions),
+        'report_days': sorted(days),
+        'report_students': sorted(students),
+    }
+
+
+def test_incremental_rollups_match_rebuild_and_recount(tmp_path):
+    store = AttendanceStore(str(tmp_path / 'attendance.sqlite3'))
+    rows = _rows(seed=1)
+    # دفعات متعددة، مع إعادة إرسال سجلات سابقة (تكرار بين الدفعات وداخل الدفعة)
+    batches = [rows[:150], rows[100:250] + rows[120:130], rows[250:], rows[:50]]
+    written = sum(store.insert_many(batch) for batch in batches)
+
+    db = store._connect()
+    total = db.execute('SELECT COUNT(*) FROM attendance').fetchone()[0]
+    assert written == total < len(rows)
+
+    incremental = _rollups(db)
+    assert incremental == _recount(db)
+
+    with store._transaction() as tx:
+        assert attendance_reports.rebuild(tx) == total
+    assert _rollups(db) == incremental
+
+
+def test_late_record_joins_streaks(tmp_path):
+    """سجل متأخر لجلسة سابقة (نقل من Firebase مثلاً) يصل سلسلتي الطالب"""
+    store = AttendanceStore(str(tmp_path / 'attendance.sqlite3'))
+
+    def record(student, day):
+        return normalize_record({'student_id': student, 'stage': '1', 'date': f'2026-10-0{day}'})
+
+    store.insert_many([record('a', 1), record('b', 1), record('b', 2), record('a', 3), record('b', 3)])
+    store.insert_many([record('a', 2)])
+
+    rows, _ = store.report('students', stage='1', sort='name')
+    streaks = {row['student_id']: (row['current_streak'], row['best_streak'], row['absent']) for row in rows}
+    assert streaks == {'a': (3, 3, 0), 'b': (3, 3, 0)}
+    assert _rollups(store._connect()) == _recount(store._connect())
+
+
+def test_rollups_are_rebuilt_for_older_databases(tmp_path):
+    path = str(tmp_path / 'attendance.sqlite3')
+    store = AttendanceStore(path)
+    store.insert_many(_rows(seed=2, count=120))
+    expected = _rollups(store._connect())
+
+    db = store._connect()
+    for table in attendance_reports.ROLLUP_TABLES:
+        db.execute(f'DELETE FROM {table}')
+    db.execute('PRAGMA user_version = 0')
+
+    reopened = AttendanceStore(path)
+    assert _rollups(reopened._connect()) == expected
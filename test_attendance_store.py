@@ -0,0 +1,88 @@
+"""
+اختبار مخزن الحضور (attendance_store): توحيد صيغة التاريخ ودمج سجلات Firebase
+القديمة مع سجلات الخادم بدون تكرار عبر /api/attendance
+
+التشغيل:
+    python -m pytest -q test_attendance_store.py
+"""
+
+import pytest
+
+import app as app_module
+from attendance_store import AttendanceStore, AttendanceWriter, normalize_record
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AttendanceStore(str(tmp_path / 'attendance.sqlite3'))
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    writer = AttendanceWriter(store, flush_interval=60)
+    monkeypatch.setattr(app_module, 'attendance_store', store)
+    monkeypatch.setattr(app_module, 'attendance_writer', writer)
+    return app_module.app.test_client()
+
+
+def _record(**fields):
+    return {'student_id': 's1', 'student_name': 'Ali', 'stage': '1', 'date': '2026-10-18',
+            'time': '09:00:00', 'lecture_name': '-', **fields}
+
+
+def test_normalize_record_dates():
+    assert normalize_record(_record(date='18/10/2026'))['date'] == '2026-10-18'
+    assert normalize_record(_record(date='5/3/2026'))['date'] == '2026-03-05'
+    assert normalize_record(_record(date='2026-10-18'))['date'] == '2026-10-18'
+    assert len(normalize_record(_record(date=None))['date']) == 10
+    for bad in ('2026/10/18', '31/02/2026', 'yesterday'):
+        with pytest.raises(ValueError):
+            normalize_record(_record(date=bad))
+    with pytest.raises(ValueError):
+        normalize_record({'date': '2026-10-18'})
+
+
+def test_firebase_and_server_records_are_one_row(store):
+    face = normalize_record(_record(distance=12.5), source='face')
+    firebase = normalize_record(_record(date='18/10/2026', time='09:00:04', source='firebase'))
+    other_lecture = normalize_record(_record(date='18/10/2026', lecture_name='Math', source='firebase'))
+
+    assert store.insert_many([face]) == 1
+    # نفس الطالب والتاريخ والمرحلة والمحاضرة من Firebase (بالصيغة القديمة) يُتجاهل
+    assert store.insert_many([firebase, other_lecture]) == 1
+    records, _ = store.query(student_id='s1')
+    assert sorted((r['lecture_name'], r['source']) for r in records) == [('-', 'face'), ('Math', 'firebase')]
+
+
+def test_repeated_migration_through_api(client, store):
+    # سجل تعرف على الخادم، ثم صفحة الحضور تنقل سجلات Firebase مرتين (فتح الصفحة مرتين)
+    store.insert_many([normalize_record(_record(), source='face')])
+    firebase = [
+        _record(date='18/10/2026', source='firebase'),
+        _record(date='17/10/2026', source='firebase'),
+        _record(student_id='s2', date='17/10/2026', source='firebase'),
+    ]
+    for _ in range(2):
+        response = client.post('/api/attendance', json={'records': firebase})
+        assert response.status_code == 202
+        assert response.get_json()['queued'] == 3
+
+    data = client.get('/api/attendance?limit=1000').get_json()
+    assert data['success']
+    keys = [(r['date'], r['stage'], r['student_id'], r['lecture_name']) for r in data['attendance']]
+    assert sorted(keys) == [
+        ('2026-10-17', '1', 's1', '-'),
+        ('2026-10-17', '1', 's2', '-'),
+        ('2026-10-18', '1', 's1', '-'),
+    ]
+    assert {r['source'] for r in data['attendance'] if r['date'] == '2026-10-18'} == {'face'}
+
+    # تسجيل يدوي من الصفحة بعد التعرف على الخادم لنفس الطالب لا يضيف سجلاً
+    client.post('/api/attendance', json=_record(time='09:01:00'))
+    assert len(client.get('/api/attendance?date=2026-10-18').get_json()['attendance']) == 1
+
+
+def test_invalid_date_is_rejected(client):
+    response = client.post('/api/attendance', json=_record(date='18-10-2026'))
+    assert response.status_code == 400
+    assert not response.get_json()['success']
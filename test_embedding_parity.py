@@ -0,0 +1,126 @@
+"""
+اختبار تطابق نواة البصمة الجديدة (face_embedding) مع التنفيذ السابق حرفياً
+
+التشغيل:
+    python -m pytest -q test_embedding_parity.py
+    python test_embedding_parity.py
+"""
+
+import cv2
+import numpy as np
+
+from face_embedding import embed_face, embed_faces, resize_face
+
+
+def legacy_face_embedding(face_image):
+    """التنفيذ السابق لـ _compute_face_embedding كما هو (مرجع المقارنة)"""
+    try:
+        face_resized = cv2.resize(face_image, (64, 64))
+        gray = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY)
+        gray = cv2.equalizeHist(gray)
+        features = []
+
+        pixel_features = gray.flatten().astype(float) / 255.0
+        features.extend(pixel_features[:32])
+
+        hist = cv2.calcHist([gray], [0], None, [64], [0, 256])
+        hist = cv2.normalize(hist, hist).flatten().tolist()
+        features.extend(hist[:64])
+
+        gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+        gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+        magnitude = np.sqrt(gx**2 + gy**2)
+        features.extend(magnitude.flatten()[:32] / 255.0)
+
+        for i in range(0, 64, 8):
+            for j in range(0, 64, 8):
+                region = gray[i:i+8, j:j+8]
+                if region.size > 0:
+                    features.append(float(np.mean(region)) / 255.0)
+                    features.append(float(np.std(region)) / 255.0)
+
+        edges = cv2.Canny(gray, 30, 100)
+        features.extend(edges.flatten()[:32] / 255.0)
+
+        orb = cv2.ORB_create(nfeatures=32)
+        try:
+            kp = orb.detect(gray, None)
+            features.append(float(len(kp)))
+            for k in kp[:8]:
+                features.append(float(k.pt[0]) / 64.0)
+                features.append(float(k.pt[1]) / 64.0)
+                features.append(float(k.size) / 100.0)
+        except:
+            features.extend([0.0] * 25)
+
+        if len(face_resized.shape) == 3 and face_resized.shape[2] >= 3:
+            for channel in cv2.split(face_resized)[:3]:
+                features.append(float(np.mean(channel)) / 255.0)
+                features.append(float(np.std(channel)) / 255.0)
+
+        embedding = features[:128]
+        while len(embedding) < 128:
+            embedding.append(0.0)
+
+        embedding_array = np.array(embedding[:128], dtype=np.float32)
+        mean_val = np.mean(embedding_array)
+        std_val = np.std(embedding_array)
+
+        if std_val > 1e-6:
+            embedding_array = (embedding_array - mean_val) / std_val
+
+        embedding_array = np.clip(embedding_array, -5, 5)
+
+        return embedding_array.tolist()
+
+    except Exception:
+        return [0.0] * 128
+
+
+def _random_faces(count, seed=0):
+    """قصاصات وجوه بأحجام مختلفة: ضوضاء، تدرجات، وصور ثابتة اللون"""
+    rng = np.random.default_rng(seed)
+    faces = []
+    for i in range(count):
+        h, w = rng.integers(20, 260, size=2)
+        kind = i % 4
+        if kind == 0:
+            face = rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8)
+        elif kind == 1:
+            y, x = np.mgrid[0:h, 0:w]
+            face = np.stack([x * 255 // max(1, w - 1), y * 255 // max(1, h - 1), (x + y) % 256], axis=-1).astype(np.uint8)
+        elif kind == 2:
+            face = np.full((h, w, 3), rng.integers(0, 256, size=3), dtype=np.uint8)
+        else:
+            face = cv2.GaussianBlur(rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8), (9, 9), 3)
+        faces.append(face)
+    return faces
+
+
+def test_single_face_matches_legacy_exactly():
+    for face in _random_faces(200):
+        assert embed_face(face).tolist() == legacy_face_embedding(face)
+
+
+def test_batch_matches_legacy_exactly():
+    faces = _random_faces(64, seed=1)
+    batch = embed_faces(np.stack([resize_face(face) for face in faces]))
+    assert batch.shape == (64, 128)
+    assert batch.dtype == np.float32
+    for row, face in zip(batch, faces):
+        assert row.tolist() == legacy_face_embedding(face)
+
+
+def test_empty_batch():
+    assert embed_faces(np.empty((0, 64, 64, 3), dtype=np.uint8)).shape == (0, 128)
+
+
+def main():
+    test_single_face_matches_legacy_exactly()
+    test_batch_matches_legacy_exactly()
+    test_empty_batch()
+    print("✅ البصمات مطابقة للتنفيذ السابق")
+
+
+if __name__ == '__main__':
+    main()
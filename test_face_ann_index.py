@@ -0,0 +1,129 @@
+"""
+اختبار فهرس IVF (face_ann_index): الاسترجاع مقارنة بالبحث الكامل، الحذف وإعادة
+الإضافة، الحفظ والتحميل، وإعدادات PQ مع إعادة الترتيب الدقيق
+
+التشغيل:
+    python -m pytest -q test_face_ann_index.py
+"""
+
+import io
+
+import numpy as np
+import pytest
+
+from face_ann_index import IVFIndex
+from face_matcher import pairwise_distances, top_k
+
+
+def _clustered(count, seed=0, dim=128, clusters=20):
+    """بصمات في مجموعات (كالطلاب المتشابهين) حتى يكون لقوائم IVF معنى"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=10.0, size=(clusters, dim))
+    return (centers[rng.integers(0, clusters, count)] + rng.normal(size=(count, dim))).astype(np.float32)
+
+
+def _exact(data, queries, k, metric='euclidean'):
+    rows, distances = top_k(pairwise_distances(queries, data, metric), k)
+    return [[str(row) for row in found] for found in rows.tolist()], distances
+
+
+def _recall(found, expected):
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)])
+
+
+def _index(data, **params):
+    return IVFIndex(dim=data.shape[1], **params).build(data, [str(i) for i in range(len(data))])
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'cosine'])
+def test_full_probe_recall_is_exact(metric):
+    data, queries = _clustered(2000), _clustered(50, seed=1)
+    index = _index(data, nlist=16, metric=metric)
+    found, distances = index.search(queries, k=10, nprobe=index.nlist)
+    expected, expected_distances = _exact(data, queries, 10, metric)
+    assert _recall(found, expected) == 1.0
+    assert np.allclose(np.array(distances), expected_distances, rtol=1e-3, atol=1e-3)
+
+
+def test_partial_probe_recall():
+    data, queries = _clustered(2000), _clustered(50, seed=1)
+    index = _index(data, nlist=16)
+    expected, _ = _exact(data, queries, 10)
+    recalls = [_recall(index.search(queries, k=10, nprobe=nprobe)[0], expected) for nprobe in (1, 4, 16)]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] == 1.0
+
+
+def test_remove_and_readd_same_id():
+    data = _clustered(500)
+    index = _index(data, nlist=8)
+    assert index.remove(['7', '8', 'missing']) == 2
+    assert len(index) == 498
+    found, _ = index.search(data[7], k=5, nprobe=index.nlist)
+    assert '7' not in found[0] and '8' not in found[0]
+
+    # إعادة الإضافة بنفس المعرف، والإضافة المكررة تستبدل ولا تضاعف
+    index.add(data[7:9], ['7', '8'])
+    index.add(data[8:9], ['8'])
+    assert len(index) == 500
+    listed = [index._ids[label] for lst in index.lists for label in lst.labels[:lst.size].tolist()]
+    assert sorted(listed) == sorted(str(i) for i in range(500))
+
+    # بقية العناصر لم تتأثر بنقل العناصر داخل القوائم عند الحذف
+    found, _ = index.search(data[:20], k=1, nprobe=index.nlist)
+    assert [f[0] for f in found] == [str(i) for i in range(20)]
+
+
+@pytest.mark.parametrize('params', [
+    {'nlist': 8},
+    {'nlist': 8, 'pq_m': 16},
+    {'nlist': 8, 'pq_m': 16, 'rerank': 50},
+    {'nlist': 8, 'metric': 'cosine'},
+])
+def test_save_load_round_trip(params):
+    data, queries = _clustered(1500), _clustered(20, seed=2)
+    index = _index(data, **params)
+    index.remove(['3', '500'])
+    index.add(data[3:4] + 0.5, ['3'])
+
+    buffer = io.BytesIO()
+    index.save(buffer)
+    buffer.seek(0)
+    loaded = IVFIndex.load(buffer)
+
+    assert loaded.params() == index.params()
+    assert len(loaded) == len(index)
+    for nprobe in (2, 8):
+        found, distances = index.search(queries, k=10, nprobe=nprobe)
+        loaded_found, loaded_distances = loaded.search(queries, k=10, nprobe=nprobe)
+        assert loaded_found == found
+        assert np.allclose(np.array(loaded_distances), np.array(distances))
+
+    # الفهرس المحمل يقبل التعديل التدريجي
+    loaded.remove(['4'])
+    loaded.add(data[4:5], ['4'])
+    assert loaded.search(data[4], k=1, nprobe=8)[0][0][0] == '4'
+
+
+def test_pq_with_rerank():
+    data, queries = _clustered(3000), _clustered(50, seed=3)
+    expected, _ = _exact(data, queries, 10)
+
+    pq = _index(data, nlist=8, pq_m=16)
+    reranked = _index(data, nlist=8, pq_m=16, rerank=100)
+    pq_recall = _recall(pq.search(queries, k=10, nprobe=8)[0], expected)
+    found, distances = reranked.search(queries, k=10, nprobe=8)
+
+    assert _recall(found, expected) >= max(pq_recall, 0.95)
+    # بعد إعادة الترتيب المسافات دقيقة (ليست تقريب PQ)
+    exact = pairwise_distances(queries, data)
+    for q, (ids, dist) in enumerate(zip(found, distances)):
+        assert np.allclose(dist, exact[q, [int(i) for i in ids]], rtol=1e-4, atol=1e-3)
+        assert list(dist) == sorted(dist)
+
+
+def test_untrained_index_rejects_add():
+    with pytest.raises(RuntimeError):
+        IVFIndex(dim=4, nlist=2).add(np.zeros((1, 4)), ['a'])
+    with pytest.raises(ValueError):
+        IVFIndex(dim=10, pq_m=3)
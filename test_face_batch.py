@@ -0,0 +1,60 @@
+"""
+اختبار مجموعة عمليات الاستخراج (face_batch): حجمها حصة عملية gunicorn من الأنوية،
+مجموعة واحدة مشتركة لكل الطلبات، وإغلاقها بعد مدة الخمول
+
+التشغيل:
+    python -m pytest -q test_face_batch.py
+"""
+
+import time
+
+import pytest
+
+import face_batch
+from face_batch import BatchEmbeddingExtractor
+
+
+@pytest.mark.parametrize('cpus, env, expected', [
+    (8, {'FACE_SERVER_WORKERS': '4'}, 2),
+    (8, {'WEB_CONCURRENCY': '2'}, 4),
+    (2, {'FACE_SERVER_WORKERS': '4'}, 1),
+    (8, {}, 8),
+])
+def test_default_workers_share_cpus(monkeypatch, cpus, env, expected):
+    monkeypatch.setattr(face_batch.os, 'cpu_count', lambda: cpus)
+    monkeypatch.delenv('FACE_SERVER_WORKERS', raising=False)
+    monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+    monkeypatch.delenv('FACE_BATCH_WORKERS', raising=False)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    assert BatchEmbeddingExtractor().max_workers == expected
+    assert BatchEmbeddingExtractor(max_workers=3).max_workers == 3
+
+
+def test_pool_is_shared_and_closed_when_idle():
+    extractor = BatchEmbeddingExtractor(max_workers=1, start_method='fork', idle_timeout=0.3)
+    try:
+        items = [{'id': 'a', 'image': None}, {'id': 'b', 'image': ''}]
+        results = extractor.extract(items)
+        assert [(r['id'], r['success']) for r in results] == [('a', False), ('b', False)]
+        executor = extractor._executor
+        assert executor is not None
+
+        # الطلب التالي قبل انتهاء مدة الخمول يستخدم نفس المجموعة ويؤجل الإغلاق
+        time.sleep(0.2)
+        assert sorted(r['index'] for r in extractor.extract_stream(items)) == [0, 1]
+        assert extractor._executor is executor
+        time.sleep(0.2)
+        assert extractor._executor is executor
+
+        deadline = time.monotonic() + 5
+        while extractor._executor is not None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert extractor._executor is None and extractor._active == 0
+
+        # تُنشأ من جديد عند الحاجة
+        assert len(extractor.extract(items)) == 2
+        assert extractor._executor is not None
+    finally:
+        extractor.shutdown()
+    assert extractor._executor is None and extractor._timer is None
@@ -0,0 +1,122 @@
+"""
+اختبار تجميع طلبات المطابقة (face_batching.MatchBatcher): كل طلب يستلم نتائج
+استعلاماته هو من الدفعة المشتركة، واحترام أقصى حجم للدفعة وأقصى انتظار
+
+التشغيل:
+    python -m pytest -q test_face_batching.py
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from face_batching import MatchBatcher
+from face_gallery import FaceGallery
+from face_matcher import FaceMatcher
+
+
+def _gallery(count=20):
+    gallery = FaceGallery('g')
+    vectors = np.random.default_rng(0).normal(scale=3.0, size=(count, 128)).astype(np.float32)
+    gallery.upsert([{'id': f's{i}', 'full_name': f'student {i}', 'embedding': vectors[i].tolist()}
+                    for i in range(count)])
+    return gallery, vectors
+
+
+def _spy(gallery):
+    """أحجام الدفعات التي وصلت للمعرض"""
+    sizes = []
+    search = gallery.search
+
+    def spy(queries, *args, **kwargs):
+        sizes.append(len(queries))
+        return search(queries, *args, **kwargs)
+
+    gallery.search = spy
+    return sizes
+
+
+def _concurrent(batcher, gallery, requests):
+    """
+    تشغيل الطلبات معاً؛ كل طلب (queries, k) في خيط مسجل في batcher.request()
+    حتى ينتظر القائد انضمام الجميع
+    """
+    matcher = FaceMatcher('euclidean')
+    results, errors = [None] * len(requests), []
+    started = threading.Barrier(len(requests))
+
+    def worker(i, queries, k):
+        try:
+            with batcher.request():
+                started.wait(5)
+                results[i] = batcher.search(gallery, queries, matcher, k=k)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i, *request)) for i, request in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return results
+
+
+def test_results_are_routed_to_their_caller():
+    gallery, vectors = _gallery()
+    sizes = _spy(gallery)
+    batcher = MatchBatcher(window_ms=500, max_batch=64)
+    # طلبات بعدد استعلامات و k مختلفين
+    requests = [(vectors[[i, (i + 7) % 20]] + 0.01, 1 + i % 3) for i in range(8)]
+
+    results = _concurrent(batcher, gallery, requests)
+
+    for (queries, k), (rows, distances, student_at) in zip(requests, results):
+        assert rows.shape == distances.shape == (2, k)
+        expected = [gallery.rows[f's{i}'] for i in np.argmin(
+            ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2), axis=1)]
+        assert rows[:, 0].tolist() == expected
+        assert [student_at(row)['id'] for row in rows[:, 0].tolist()] == [gallery.ids[row] for row in expected]
+
+    # كل الطلبات انضمت لدفعة واحدة (القائد لا ينتظر بعد انضمام كل الطلبات الجارية)
+    assert sizes == [16]
+    stats = batcher.stats()
+    assert stats['batches'] == 1 and stats['requests'] == 8 and stats['efficiency'] == 8
+    assert stats['avg_wait_ms'] < 500
+
+
+def test_batches_respect_max_size():
+    gallery, vectors = _gallery()
+    sizes = _spy(gallery)
+    batcher = MatchBatcher(window_ms=200, max_batch=4)
+    requests = [(vectors[i:i + 1], 1) for i in range(10)]
+
+    results = _concurrent(batcher, gallery, requests)
+
+    assert [rows[0, 0] for rows, _, _ in results] == [gallery.rows[f's{i}'] for i in range(10)]
+    assert sum(sizes) == 10
+    assert max(sizes) <= 4
+    assert batcher.stats()['max_batch'] <= 4
+
+
+def test_leader_waits_at_most_the_window():
+    gallery, vectors = _gallery()
+    matcher = FaceMatcher('euclidean')
+    batcher = MatchBatcher(window_ms=100, max_batch=32)
+
+    # بدون طلبات جارية أخرى لا ينتظر القائد
+    start = time.monotonic()
+    with batcher.request():
+        batcher.search(gallery, vectors[0], matcher, k=1)
+    assert time.monotonic() - start < 0.1
+
+    # طلب جارٍ آخر لا يصل للبحث (ما زال يستخرج البصمة): القائد ينتظر النافذة
+    # فقط ثم يبحث وحده
+    with batcher.request(), batcher.request():
+        start = time.monotonic()
+        rows, _, _ = batcher.search(gallery, vectors[3], matcher, k=1)
+        elapsed = time.monotonic() - start
+    assert 0.09 <= elapsed < 1.0
+    assert rows[0, 0] == gallery.rows['s3']
+    assert batcher.stats()['batches'] == 2
@@ -0,0 +1,129 @@
+"""
+اختبار ترميز البصمات المضغوط (face_embedding_codec): الترميز والفك لكل نوع بيانات،
+رفض الصيغ غير المدعومة والبيانات التالفة، تمييز البصمات من إصدار أقدم للخوارزمية،
+وحد عدد بصمات الطالب الواحد (MAX_TEMPLATES)
+
+التشغيل:
+    python -m pytest -q test_face_embedding_codec.py
+"""
+
+import base64
+import struct
+
+import numpy as np
+import pytest
+
+from face_embedding import EMBEDDING_VERSION
+from face_embedding_codec import (
+    DTYPES, FORMAT_VERSION, MAX_TEMPLATES, decode_embedding, decode_templates, embedding_vector,
+    encode_embedding, format_embedding, is_stale, stack_embeddings
+)
+from face_gallery import FaceGallery
+
+
+def _vector(seed=0):
+    return np.random.default_rng(seed).normal(size=128).astype(np.float32)
+
+
+def _tamper(encoded, offset, fmt, value):
+    raw = bytearray(base64.b64decode(encoded))
+    struct.pack_into(fmt, raw, offset, value)
+    return base64.b64encode(bytes(raw)).decode('ascii')
+
+
+@pytest.mark.parametrize('dtype, tolerance', [('float32', 0.0), ('float16', 2e-3), ('int8', None)])
+def test_round_trip(dtype, tolerance):
+    vector = _vector()
+    encoded = encode_embedding(vector, dtype)
+    # ترويسة 12 بايت + البيانات بحجم النوع
+    assert len(base64.b64decode(encoded)) == 12 + 128 * np.dtype(DTYPES[dtype][1]).itemsize
+
+    decoded = decode_embedding(encoded)
+    assert decoded.dtype == dtype
+    assert decoded.version == EMBEDDING_VERSION
+    assert decoded.data.dtype == DTYPES[dtype][1] and decoded.data.shape == (128,)
+
+    restored = embedding_vector(encoded)
+    assert restored.dtype == np.float32
+    if tolerance is None:
+        # int8: الخطأ لا يتجاوز نصف خطوة التكميم
+        assert np.max(np.abs(restored - vector)) <= decoded.scale / 2 + 1e-6
+    else:
+        assert np.allclose(restored, vector, atol=tolerance, rtol=tolerance)
+    assert format_embedding(vector, dtype) == encoded
+
+
+def test_plain_lists_are_accepted_without_version():
+    vector = _vector()
+    decoded = decode_embedding(format_embedding(vector, 'list'))
+    assert decoded.version is None and decoded.dtype == 'float32'
+    assert np.allclose(decoded.data, vector)
+    assert not is_stale(decoded.version)
+
+
+@pytest.mark.parametrize('value', [
+    'not base64!',
+    base64.b64encode(b'FE\x01').decode('ascii'),
+    'garbage-that-is-not-a-list',
+    [1.0, 'x'],
+    [1.0, float('nan')],
+])
+def test_invalid_values_are_rejected(value):
+    with pytest.raises(ValueError):
+        decode_embedding(value)
+
+
+def test_unsupported_or_corrupt_headers_are_rejected():
+    encoded = encode_embedding(_vector(), 'int8')
+    for tampered in (
+        _tamper(encoded, 0, '<2s', b'XX'),                # توقيع غير صحيح
+        _tamper(encoded, 2, '<B', FORMAT_VERSION + 1),    # صيغة أحدث غير مدعومة
+        _tamper(encoded, 4, '<B', 9),                     # نوع بيانات غير معروف
+        _tamper(encoded, 6, '<H', 64),                    # البعد لا يطابق الطول
+        _tamper(encoded, 8, '<f', float('inf')),          # معامل تحجيم غير صالح
+        base64.b64encode(base64.b64decode(encoded)[:-1]).decode('ascii'),
+    ):
+        with pytest.raises(ValueError):
+            decode_embedding(tampered)
+
+
+def test_stale_versions_are_reported():
+    current = encode_embedding(_vector(0), 'int8')
+    old = encode_embedding(_vector(1), 'int8', version=EMBEDDING_VERSION + 1)
+    assert decode_embedding(old).version == EMBEDDING_VERSION + 1
+    assert is_stale(EMBEDDING_VERSION + 1) and not is_stale(EMBEDDING_VERSION) and not is_stale(None)
+
+    kept, matrix, scales, stale = stack_embeddings(
+        [current, old, None, 'bad', _vector(2).tolist(), encode_embedding(_vector(3)[:64])], 128
+    )
+    assert kept == [0, 1, 4] and stale == [1]
+    # بصمة غير int8 في القائمة: المصفوفة float32 بدون معاملات تحجيم
+    assert matrix.dtype == np.float32 and scales is None
+    assert np.allclose(matrix[0], embedding_vector(current))
+
+    kept, matrix, scales, _ = stack_embeddings([current, old], 128)
+    assert matrix.dtype == np.int8 and scales.shape == (2,)
+
+    gallery = FaceGallery('g')
+    gallery.upsert([{'id': 'a', 'embedding': current}, {'id': 'b', 'embedding': old},
+                    {'id': 'c', 'embeddings': [current, old]}])
+    assert sorted(gallery.stale_ids()) == ['b', 'c']
+
+
+def test_templates_keep_latest_up_to_limit():
+    vectors = [_vector(seed) for seed in range(MAX_TEMPLATES + 3)]
+    values = [encode_embedding(v, 'float32') for v in vectors] + ['bad', _vector(99)[:10].tolist()]
+
+    templates, version = decode_templates(values, 128)
+    assert templates.shape == (MAX_TEMPLATES, 128)
+    assert np.allclose(templates, np.stack(vectors[-MAX_TEMPLATES:]))
+    assert version == EMBEDDING_VERSION
+
+    templates, _ = decode_templates(values, 128, limit=2)
+    assert np.allclose(templates, np.stack(vectors[-2:]))
+    assert decode_templates(['bad'], 128) == (None, None)
+    assert decode_templates('not a list', 128) == (None, None)
+
+    gallery = FaceGallery('g')
+    gallery.upsert([{'id': 'multi', 'embeddings': values}])
+    assert len(gallery.templates['multi']) == MAX_TEMPLATES
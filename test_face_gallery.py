@@ -0,0 +1,264 @@
+"""
+اختبار معارض البصمات (face_gallery): الإضافة والحذف وترقيم الصفوف، الحفظ
+والتحميل، البحث عبر الفهرس بقوائم صغيرة، التعديل المتزامن من أكثر من عملية على نفس
+المعرض، وإزالة المعارض من الذاكرة (LRU) ومن القرص بعد انتهاء صلاحيتها
+
+التشغيل:
+    python -m pytest -q test_face_gallery.py
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from face_gallery import FaceGallery, GalleryRegistry
+from face_matcher import FaceMatcher
+from face_recognition_service import FaceRecognitionService
+
+
+def _students(count, seed=0, start=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {'id': f's{i}', 'full_name': f'student {i}', 'stage': str(i % 3),
+         'embedding': rng.normal(size=128).astype(np.float32).tolist()}
+        for i in range(start, start + count)
+    ]
+
+
+def _check_rows(gallery):
+    """ids و rows و students متسقة مع المصفوفة"""
+    assert len(gallery.ids) == gallery.size == len(gallery.rows) == len(gallery.students)
+    for row, student_id in enumerate(gallery.ids):
+        assert gallery.rows[student_id] == row
+    vectors = gallery.vectors()
+    assert np.allclose(gallery.sq_norms, (vectors * vectors).sum(axis=1), rtol=1e-5)
+
+
+def test_upsert_and_update():
+    gallery = FaceGallery('g', capacity=2)
+    students = _students(10)
+    assert gallery.upsert(students) == (10, 0, [])
+    assert gallery.version == 1
+
+    changed = dict(students[3], embedding=[0.5] * 128, full_name='renamed')
+    added, updated, skipped = gallery.upsert([changed, {'id': 'bad', 'embedding': [1.0] * 5}])
+    assert (added, updated, skipped) == (0, 1, ['bad'])
+    assert gallery.size == 10
+    assert gallery.student_at(gallery.rows['s3'])['full_name'] == 'renamed'
+    assert np.allclose(gallery.vectors(gallery.rows['s3']), 0.5)
+    _check_rows(gallery)
+
+
+def test_swap_remove_keeps_rows_consistent():
+    gallery = FaceGallery('g')
+    students = _students(8)
+    gallery.upsert(students)
+    vectors = {s['id']: np.array(s['embedding'], dtype=np.float32) for s in students}
+
+    # حذف صف من الوسط (ينتقل الأخير مكانه)، والأخير نفسه، ومعرف غير موجود
+    assert gallery.remove(['s2', 's7', 'missing']) == 2
+    assert gallery.rows['s6'] == 2
+    _check_rows(gallery)
+    for student_id, row in gallery.rows.items():
+        assert np.array_equal(gallery.vectors(row), vectors[student_id])
+
+    matcher = FaceMatcher('euclidean')
+    rows, distances = gallery.search(vectors['s6'], matcher, k=1)
+    assert gallery.student_at(rows[0, 0])['id'] == 's6'
+    assert distances[0, 0] < 0.05
+
+    # إعادة إضافة المحذوف تضعه في آخر صف
+    gallery.upsert([students[2]])
+    assert gallery.rows['s2'] == gallery.size - 1
+    _check_rows(gallery)
+
+
+def test_save_load_round_trip(tmp_path):
+    for storage in ('float32', 'float16', 'int8'):
+        gallery = FaceGallery('g', storage=storage)
+        gallery.upsert(_students(20))
+        gallery.upsert([{'id': 'multi', 'full_name': 'multi', 'section': 'B',
+                         'embeddings': [[0.1] * 128, [0.3] * 128]}])
+        gallery.remove(['s4'])
+        path = str(tmp_path / f'{storage}.npz')
+        gallery.save(path)
+
+        loaded = FaceGallery.load(path)
+        assert loaded.storage == storage
+        assert loaded.version == gallery.version
+        assert loaded.ids == gallery.ids
+        assert loaded.students == gallery.students
+        assert np.array_equal(loaded.matrix, gallery.matrix)
+        assert np.array_equal(loaded.vectors(), gallery.vectors())
+        assert np.array_equal(loaded.templates['multi'], gallery.templates['multi'])
+        _check_rows(loaded)
+
+        matcher = FaceMatcher('euclidean')
+        queries = np.random.default_rng(1).normal(size=(5, 128)).astype(np.float32)
+        (rows, distances), (loaded_rows, loaded_distances) = (
+            gallery.search(queries, matcher, k=3), loaded.search(queries, matcher, k=3)
+        )
+        assert np.array_equal(rows, loaded_rows)
+        assert np.allclose(distances, loaded_distances, rtol=1e-5)
+
+
+def _clustered_students(sizes, seed=0):
+    """مجموعات متباعدة بأحجام مختلفة حتى تحوي بعض قوائم IVF أقل من k عنصراً"""
+    rng = np.random.default_rng(seed)
+    students = []
+    for cluster, size in enumerate(sizes):
+        center = rng.normal(scale=20.0, size=128)
+        for _ in range(size):
+            i = len(students)
+            students.append({'id': f's{i}', 'full_name': f'student {i}', 'stage': str(cluster),
+                             'embedding': (center + rng.normal(size=128)).astype(np.float32).tolist()})
+    return students
+
+
+def test_indexed_search_pads_short_lists():
+    gallery = FaceGallery('g')
+    students = _clustered_students([3, 3, 3, 300])
+    gallery.upsert(students)
+    gallery.enable_index({'nlist': 4, 'nprobe': 1})
+    assert gallery.index.is_trained
+    gallery.upsert([{'id': 'multi', 'full_name': 'multi', 'embeddings': [students[0]['embedding']] * 2}])
+
+    matcher = FaceMatcher('euclidean', threshold=5.0)
+    queries = np.array([students[i]['embedding'] for i in (0, 4, 8, 100)], dtype=np.float32)
+    rows, distances = gallery.search(queries, matcher, k=5)
+
+    assert rows.shape == distances.shape == (4, 5)
+    for q, expected in enumerate((0, 4, 8, 100)):
+        valid = rows[q] >= 0
+        # الإكمال في آخر الصف فقط، والصفوف الفعلية بلا تكرار ومرتبة
+        assert valid.tolist() == sorted(valid.tolist(), reverse=True)
+        assert np.all(np.isinf(distances[q, ~valid]))
+        assert len(set(rows[q, valid].tolist())) == valid.sum()
+        assert list(distances[q, valid]) == sorted(distances[q, valid])
+        assert gallery.student_at(rows[q, 0])['id'] in (f's{expected}', 'multi')
+    assert not np.all(rows >= 0)
+
+    # مسارات المطابقة تتجاهل الإكمال
+    candidates = matcher.candidates(rows[0], distances[0], gallery.student_at)
+    assert len(candidates) == (rows[0] >= 0).sum()
+    matches, matched_faces, _ = FaceRecognitionService._assign_candidates(
+        [[i, i, 1, 1] for i in range(4)], queries, lambda q, k: gallery.search(q, matcher, k=k),
+        gallery.vectors, gallery.student_at, matcher, 'optimal', gallery.templates_at
+    )
+    assert matched_faces == {0, 1, 2, 3}
+    assert len({match['student_id'] for match in matches}) == 4
+
+
+def test_index_is_saved_with_gallery(tmp_path):
+    gallery = FaceGallery('g')
+    students = _clustered_students([3, 3, 3, 300])
+    gallery.upsert(students)
+    gallery.enable_index({'nlist': 4, 'nprobe': 2})
+    path = str(tmp_path / 'g.npz')
+    gallery.save(path)
+    # الفهرس داخل ملف المعرض: لا ملف منفصل يمكن أن يُستبدل في لحظة مختلفة
+    assert os.listdir(tmp_path) == ['g.npz']
+
+    loaded = FaceGallery.load(path)
+    assert loaded.index.is_trained and loaded.index.params() == gallery.index.params()
+    matcher = FaceMatcher('euclidean')
+    queries = np.array([students[i]['embedding'] for i in (0, 5, 200)], dtype=np.float32)
+    assert np.array_equal(loaded.search(queries, matcher, k=4)[0], gallery.search(queries, matcher, k=4)[0])
+
+    # ملف فهرس منفصل قديم من إصدار آخر للمعرض يُتجاهل ويُعاد بناء الفهرس
+    newer = FaceGallery('g')
+    newer.upsert(students + _students(1, start=999))
+    newer.enable_index({'nlist': 4, 'nprobe': 2})
+    with open(FaceGallery._index_path(path), 'wb') as f:
+        newer.index.save(f)
+    data = dict(np.load(path))
+    del data['index']
+    np.savez(path, **data)
+    loaded = FaceGallery.load(path)
+    assert set(loaded.index._labels) == set(loaded.rows)
+
+
+def test_registry_reloads_changes_from_other_process(tmp_path):
+    first, second = GalleryRegistry(str(tmp_path)), GalleryRegistry(str(tmp_path))
+    first.register(_students(5), gallery_id='g')
+
+    gallery, _ = second.update('g', upsert=_students(1, start=5), remove=['s0'])
+    assert sorted(gallery.ids) == ['s1', 's2', 's3', 's4', 's5']
+
+    gallery, _ = first.update('g', upsert=_students(1, start=6))
+    assert sorted(gallery.ids) == ['s1', 's2', 's3', 's4', 's5', 's6']
+    assert gallery.version == 4
+
+    assert second.delete('g')
+    assert first.get('g') is None
+
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    """
+    كل سجل يمثل عملية gunicorn بذاكرتها الخاصة؛ التعديلات المتزامنة على نفس
+    المعرض تُسلسل بقفل الملف فلا يضيع أي منها ولا يتكرر رقم إصدار
+    """
+    registries = [GalleryRegistry(str(tmp_path)) for _ in range(4)]
+    registries[0].register(_students(1), gallery_id='g')
+    versions, errors = [], []
+
+    def worker(registry, offset):
+        try:
+            for i in range(10):
+                gallery, _ = registry.update('g', upsert=_students(1, seed=offset + i, start=offset + i))
+                versions.append(gallery.version)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(registry, 100 * (n + 1)))
+               for n, registry in enumerate(registries)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(set(versions)) == len(versions) == 40
+    gallery = GalleryRegistry(str(tmp_path)).get('g')
+    assert gallery.size == 41
+    assert gallery.version == 41
+    _check_rows(gallery)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_registry_memory_is_bounded(tmp_path):
+    registry = GalleryRegistry(str(tmp_path), max_galleries=2)
+    for gallery_id in ('a', 'b', 'c'):
+        registry.register(_students(2), gallery_id=gallery_id)
+    assert list(registry._galleries) == ['b', 'c']
+
+    # المعرض المزال من الذاكرة يُحمّل من القرص، والمستخدم حديثاً يبقى
+    registry.get('b')
+    assert registry.get('a').ids == ['s0', 's1']
+    assert list(registry._galleries) == ['b', 'a']
+
+
+def test_expired_galleries_are_purged_with_lock_files(tmp_path):
+    registry = GalleryRegistry(str(tmp_path), ttl=3600)
+    registry.register(_students(2), gallery_id='old')
+    registry.register(_students(2), gallery_id='fresh')
+    registry.update('missing', upsert=_students(1))
+    old = time.time() - 7200
+    os.utime(tmp_path / 'old.npz', (old, old))
+    assert sorted(os.listdir(tmp_path)) == [
+        'fresh.npz', 'fresh.npz.lock', 'missing.npz.lock', 'old.npz', 'old.npz.lock'
+    ]
+
+    # التنظيف مرة كل PURGE_INTERVAL على الأكثر إلا عند طلبه صراحة
+    registry._last_purge = time.time()
+    assert registry.purge() == []
+    assert sorted(registry.purge(force=True)) == ['missing', 'old']
+    assert sorted(os.listdir(tmp_path)) == ['fresh.npz', 'fresh.npz.lock']
+    assert registry.get('old') is None and 'old' not in registry._galleries
+    assert registry.get('fresh') is not None
+
+    assert registry.delete('fresh')
+    assert os.listdir(tmp_path) == []
+    assert not registry.delete('fresh')
@@ -0,0 +1,134 @@
+"""
+اختبار مخزن المهام (face_jobs.JobStore): حد المهام الجارية عند الحجز، انتهاء العقد
+واستعادة المهمة أو إفشالها بعد أقصى عدد محاولات، وإلغاء مهمة منتظرة أو جارية
+(مباشرة من المخزن وعبر JobRunner)
+
+التشغيل:
+    python -m pytest -q test_face_jobs.py
+"""
+
+import threading
+import time
+
+import pytest
+
+import face_jobs
+from face_jobs import CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobRunner, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.sqlite3'))
+
+
+def _create(store, count):
+    jobs = []
+    for i in range(count):
+        jobs.append(store.create('extract_embeddings', {'images': [f'image {i}']}))
+        # ترتيب الحجز حسب created_at
+        time.sleep(0.002)
+    return jobs
+
+
+def test_claim_respects_running_limit(store):
+    jobs = _create(store, 3)
+    first, params = store.claim('a', limit=2)
+    assert first['job_id'] == jobs[0]['job_id'] and first['status'] == RUNNING and first['attempts'] == 1
+    assert params == {'images': ['image 0']}
+    # الحد للمهام الجارية في كل العمليات وليس لكل مالك
+    second, _ = store.claim('b', limit=2)
+    assert second['job_id'] == jobs[1]['job_id']
+    assert store.claim('a', limit=2) is None
+
+    assert store.finish(first['job_id'], 'a', SUCCEEDED, {'ok': True})
+    third, _ = store.claim('a', limit=2)
+    assert third['job_id'] == jobs[2]['job_id']
+    assert store.claim('a', limit=5) is None
+
+    finished = store.get(first['job_id'], with_result=True)
+    assert finished['status'] == SUCCEEDED and finished['result'] == {'ok': True} and finished['progress'] == 1.0
+    # مالك آخر لا يستطيع إنهاء مهمة ليست له
+    assert not store.finish(second['job_id'], 'a', SUCCEEDED)
+
+
+def test_expired_lease_is_recovered_then_failed(store, monkeypatch):
+    monkeypatch.setattr(face_jobs, 'MAX_ATTEMPTS', 2)
+    job, = _create(store, 1)
+
+    store.claim('a', limit=1)
+    # العقد الحالي لم ينتهِ بعد
+    assert store.recover() == 0
+    store.progress(job['job_id'], 'a', 3, 10)
+
+    # عملية متوقفة لا تجدد العقد: تعود المهمة للانتظار وتبدأ من جديد
+    monkeypatch.setattr(face_jobs, 'LEASE_SECONDS', -1)
+    store.renew('a')
+    assert store.recover() == 1
+    recovered = store.get(job['job_id'])
+    assert recovered['status'] == QUEUED and recovered['done'] == 0 and recovered['attempts'] == 1
+
+    # المالك السابق لم يعد يملكها: التقدم يطلب التوقف والنتيجة تُتجاهل
+    claimed, params = store.claim('b', limit=1)
+    assert claimed['attempts'] == 2 and params == {'images': ['image 0']}
+    assert store.progress(job['job_id'], 'a', 5, 10)
+    assert not store.finish(job['job_id'], 'a', SUCCEEDED)
+
+    # بعد أقصى عدد محاولات تفشل المهمة بدل إعادتها
+    assert store.recover() == 0
+    failed = store.get(job['job_id'])
+    assert failed['status'] == FAILED and failed['error']
+    assert store.claim('c', limit=1) is None
+
+
+def test_cancel_queued_and_running_jobs(store, monkeypatch):
+    queued, running, abandoned = _create(store, 3)
+    assert store.cancel('missing') is None
+
+    assert store.cancel(queued['job_id'])['status'] == CANCELLED
+    claimed, _ = store.claim('a', limit=5)
+    assert claimed['job_id'] == running['job_id']
+    store.claim('a', limit=5)
+
+    # المهمة الجارية: طلب إلغاء يراه المنفذ في التقدم التالي
+    cancelled = store.cancel(running['job_id'])
+    assert cancelled['status'] == RUNNING and cancelled['cancel_requested']
+    assert store.progress(running['job_id'], 'a', 1, 10)
+    assert store.finish(running['job_id'], 'a', CANCELLED)
+    assert store.get(running['job_id'])['status'] == CANCELLED
+
+    # مهمة طُلب إلغاؤها وتوقفت عمليتها تُلغى عند الاستعادة ولا تعود للانتظار
+    store.cancel(abandoned['job_id'])
+    monkeypatch.setattr(face_jobs, 'LEASE_SECONDS', -1)
+    store.renew('a')
+    assert store.recover() == 0
+    assert store.get(abandoned['job_id'])['status'] == CANCELLED
+    assert store.cancel(abandoned['job_id'])['status'] == CANCELLED
+
+
+def test_runner_cancels_running_job(store, monkeypatch):
+    started, stopped = threading.Event(), threading.Event()
+
+    def slow(params, progress):
+        started.set()
+        try:
+            for done in range(1000):
+                progress(done, 1000)
+                time.sleep(0.01)
+        finally:
+            stopped.set()
+        return {'done': True}
+
+    monkeypatch.setitem(face_jobs.JOB_KINDS, 'slow', (lambda params: None, slow))
+    monkeypatch.setattr(face_jobs, 'PROGRESS_INTERVAL', 0.0)
+    runner = JobRunner(store)
+    job = runner.submit('slow', {})
+    assert started.wait(5)
+
+    assert store.cancel(job['job_id'])['cancel_requested']
+    assert stopped.wait(5)
+    deadline = time.monotonic() + 5
+    while store.get(job['job_id'])['status'] == RUNNING and time.monotonic() < deadline:
+        time.sleep(0.01)
+    finished = store.get(job['job_id'], with_result=True)
+    assert finished['status'] == CANCELLED and finished['result'] is None
+    assert 0 < finished['done'] < 1000
@@ -0,0 +1,60 @@
+"""
+اختبار تسخين نظام الوجه (face_loader.warm_up): الكاشفات نسخة لكل خيط، فالتسخين
+يجب أن يصل لكل خيط في مجموعة الكشف حتى لا يحمّل أول طلب ملفات الكاشف
+
+التشغيل:
+    python -m pytest -q test_face_loader.py
+"""
+
+import threading
+
+import pytest
+
+import face_loader
+from face_workers import DetectionPool
+
+
+@pytest.fixture
+def pool():
+    pool = DetectionPool(max_workers=3, max_queue=3)
+    yield pool
+    pool.shutdown()
+
+
+def _thread_state(detectors, gather):
+    gather.wait(5)
+    return threading.get_ident(), {
+        name: getattr(getattr(detector, '_local', None), 'cascade', None) is not None
+        for name, detector in detectors.items() if hasattr(detector, '_local')
+    }
+
+
+def test_warm_up_reaches_every_pool_thread(pool):
+    assert face_loader.warm_up(pool) == 3
+    assert face_loader.startup['warmup_threads'] == 3
+
+    service = face_loader.load()
+    detectors = {name: service.detectors.get(name) for name in service.detectors.profiles}
+    gather = threading.Barrier(3)
+    states = [future.result() for future in [pool.submit(_thread_state, detectors, gather) for _ in range(3)]]
+
+    assert len({ident for ident, _ in states}) == 3
+    assert all(all(warm.values()) for _, warm in states)
+    # خيط جديد خارج المجموعة لم يُسخّن (التسخين لا يحدث في خيط مؤقت)
+    outside = []
+    thread = threading.Thread(target=lambda: outside.append(_thread_state(detectors, threading.Barrier(1))))
+    thread.start()
+    thread.join()
+    assert not any(outside[0][1].values())
+
+
+def test_warm_up_with_busy_pool():
+    pool = DetectionPool(max_workers=2, max_queue=0)
+    release = threading.Event()
+    try:
+        pool.submit(release.wait, 5)
+        # خيط مشغول بطلب: يُسخّن الخيط المتاح فقط دون انتظار
+        assert face_loader.warm_up(pool) == 1
+    finally:
+        release.set()
+        pool.shutdown()
@@ -0,0 +1,301 @@
+"""
+اختبار محرك المطابقة (face_matcher): مسافات GEMM مقارنة بالحساب المباشر،
+ترتيب أفضل k مع التعادل، الهامش بين المرشحين، وحد المطابقة في compare_face_encodings،
+والتعيين (المجري والجشع) مقارنة بتجربة كل التباديل
+
+التشغيل:
+    python -m pytest -q test_face_matcher.py
+"""
+
+import itertools
+
+import numpy as np
+import pytest
+
+import face_matcher
+from face_embedding_codec import quantize
+from face_matcher import (
+    FaceMatcher, greedy_assignment, linear_assignment, pairwise_distances, squared_norms, top_k
+)
+from face_recognition_service import FaceRecognitionService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setitem(face_matcher.DEFAULT_THRESHOLDS, 'euclidean', 50.0)
+    monkeypatch.setitem(face_matcher.DEFAULT_THRESHOLDS, 'cosine', 0.5)
+    # الدوال المختبرة لا تحتاج الكواشف والمعارض التي يهيئها __init__
+    return FaceRecognitionService.__new__(FaceRecognitionService)
+
+
+def _vectors(count, seed=0, scale=3.0):
+    return np.random.default_rng(seed).normal(scale=scale, size=(count, 128)).astype(np.float32)
+
+
+def _reference(queries, matrix, metric):
+    queries, matrix = queries.astype(np.float64), matrix.astype(np.float64)
+    if metric == 'euclidean':
+        return np.linalg.norm(queries[:, None, :] - matrix[None, :, :], axis=2)
+    norms = np.linalg.norm(queries, axis=1)[:, None] * np.linalg.norm(matrix, axis=1)[None, :]
+    return 1.0 - (queries @ matrix.T) / norms
+
+
+@pytest.mark.parametrize('metric', ['euclidean', 'cosine'])
+def test_pairwise_distances_match_linalg_norm(metric):
+    queries, matrix = _vectors(7, seed=1), _vectors(300, seed=2)
+    expected = _reference(queries, matrix, metric)
+    assert np.allclose(pairwise_distances(queries, matrix, metric), expected, rtol=1e-4, atol=1e-4)
+    # مربعات الأطوال المحسوبة مسبقاً تعطي نفس النتيجة
+    assert np.allclose(pairwise_distances(queries, matrix, metric, sq_norms=squared_norms(matrix)), expected,
+                       rtol=1e-4, atol=1e-4)
+    # استعلام واحد بالشكل (dim,)
+    assert pairwise_distances(queries[0], matrix, metric).shape == (1, 300)
+
+
+def test_pairwise_distances_identical_rows_are_zero():
+    matrix = _vectors(5, seed=3, scale=40.0)
+    distances = pairwise_distances(matrix, matrix)
+    assert np.all(distances >= 0)
+    assert np.allclose(np.diag(distances), 0, atol=0.5)
+
+
+@pytest.mark.parametrize('storage', ['float16', 'int8'])
+def test_quantized_matrix_distances(storage, monkeypatch):
+    # أجزاء صغيرة حتى يُختبر التحويل على أكثر من جزء
+    monkeypatch.setattr(face_matcher, 'QUANTIZED_CHUNK_ROWS', 64)
+    queries, vectors = _vectors(4, seed=4), _vectors(200, seed=5)
+    pairs = [quantize(vector, storage) for vector in vectors]
+    matrix = np.stack([data for data, _ in pairs])
+    scales = np.array([scale for _, scale in pairs], dtype=np.float32) if storage == 'int8' else None
+    decoded = matrix.astype(np.float32) * (scales[:, None] if scales is not None else 1.0)
+    assert np.allclose(pairwise_distances(queries, matrix, scales=scales), _reference(queries, decoded, 'euclidean'),
+                       rtol=1e-4, atol=1e-3)
+
+
+def test_unknown_metric():
+    with pytest.raises(ValueError):
+        pairwise_distances(_vectors(1), _vectors(2), 'manhattan')
+    with pytest.raises(ValueError):
+        FaceMatcher('manhattan')
+
+
+def test_top_k_order_matches_full_sort():
+    distances = np.random.default_rng(6).random((5, 500)).astype(np.float32)
+    for k in (1, 5, 499, 500, 1000):
+        rows, best = top_k(distances, k)
+        expected = np.sort(distances, axis=1)[:, :min(k, 500)]
+        assert np.array_equal(best, expected)
+        assert np.array_equal(np.take_along_axis(distances, rows, axis=1), best)
+
+
+def test_top_k_ties():
+    distances = np.array([[3.0, 1.0, 2.0, 1.0, 1.0, 5.0]], dtype=np.float32)
+    rows, best = top_k(distances, 2)
+    assert best.tolist() == [[1.0, 1.0]]
+    assert set(rows[0].tolist()) <= {1, 3, 4} and len(set(rows[0].tolist())) == 2
+
+    # كل القيم متساوية و k = N: الترتيب الأصلي للصفوف
+    rows, best = top_k(np.zeros((2, 4), dtype=np.float32), 4)
+    assert rows.tolist() == [[0, 1, 2, 3], [0, 1, 2, 3]]
+
+
+def test_search_empty_matrix():
+    rows, distances = FaceMatcher().search(_vectors(3), np.empty((0, 128), dtype=np.float32), k=5)
+    assert rows.shape == distances.shape == (3, 0)
+
+
+def test_candidates_margin():
+    matrix = np.zeros((4, 128), dtype=np.float32)
+    matrix[:, 0] = [10.0, 0.0, 4.0, 4.0]
+    matcher = FaceMatcher('euclidean')
+    rows, distances = matcher.search(np.zeros(128, dtype=np.float32), matrix, k=4)
+    candidates = matcher.candidates(rows[0], distances[0], lambda row: {'id': f's{row}', 'full_name': str(row)})
+
+    assert candidates[0]['student_id'] == 's1' and candidates[-1]['student_id'] == 's0'
+    assert [c['distance'] for c in candidates] == pytest.approx([0.0, 4.0, 4.0, 10.0], abs=1e-3)
+    assert [c['margin'] for c in candidates] == pytest.approx([0.0, 4.0, 4.0, 10.0], abs=1e-3)
+    assert matcher.candidates(np.empty(0, dtype=np.intp), np.empty(0), None) == []
+
+
+def test_match_result_reports_margin_to_runner_up(service):
+    matrix = np.zeros((3, 128), dtype=np.float32)
+    matrix[:, 0] = [1.0, 1.5, 30.0]
+    matcher = FaceMatcher('euclidean')
+    students = [{'id': f's{i}', 'full_name': f'n{i}'} for i in range(3)]
+
+    result = service._match_embedding(np.zeros(128, dtype=np.float32),
+                                      lambda q, k: matcher.search(q, matrix, k=k), students.__getitem__, matcher)
+    assert result['success'] and result['student_id'] == 's0'
+    # مرشحان متقاربان: الهامش الصغير يُذكر في الرد ليقرر العميل
+    assert result['margin'] == pytest.approx(0.5, abs=1e-3)
+    assert [c['student_id'] for c in result['candidates']] == ['s0', 's1', 's2']
+
+    result = service._match_embedding(np.zeros(128, dtype=np.float32),
+                                      lambda q, k: matcher.search(q, matrix[:1], k=k), students.__getitem__, matcher)
+    assert result['margin'] is None
+
+
+def test_compare_threshold_edges(service):
+    origin = [0.0] * 128
+
+    def at(distance):
+        return [distance] + [0.0] * 127
+
+    result = service.compare_face_encodings(origin, at(50.0))
+    assert result['distance'] == pytest.approx(50.0)
+    assert result['match'] is True
+    assert result['similarity'] == pytest.approx(0.0)
+    assert result['threshold'] == 50.0 and result['metric'] == 'euclidean'
+
+    assert service.compare_face_encodings(origin, at(50.01))['match'] is False
+    # أبعد من الحد القديم (30) وأقرب من الحد الحالي
+    result = service.compare_face_encodings(origin, at(30.5))
+    assert result['match'] is True
+    assert result['similarity'] == pytest.approx(1 - 30.5 / 50.0, abs=1e-4)
+
+    result = service.compare_face_encodings(origin, origin)
+    assert result['match'] is True and result['similarity'] == 1.0
+
+
+def test_compare_cosine_and_errors(service):
+    e1 = [1.0] + [0.0] * 127
+    e2 = [0.0, 1.0] + [0.0] * 126
+    assert service.compare_face_encodings(e1, e1, metric='cosine')['match'] is True
+    result = service.compare_face_encodings(e1, e2, metric='cosine')
+    assert result['distance'] == pytest.approx(1.0) and result['match'] is False
+
+    result = service.compare_face_encodings(e1, e2, metric='manhattan')
+    assert result == {'distance': None, 'similarity': 0, 'match': False}
+
+
+def test_calibrated_threshold_is_used(service, monkeypatch):
+    monkeypatch.setitem(face_matcher.DEFAULT_THRESHOLDS, 'euclidean', 20.0)
+    result = service.compare_face_encodings([0.0] * 128, [25.0] + [0.0] * 127)
+    assert result['threshold'] == 20.0 and result['match'] is False
+
+
+def test_load_thresholds(tmp_path, monkeypatch):
+    monkeypatch.setattr(face_matcher, 'DEFAULT_THRESHOLDS', dict(face_matcher.DEFAULT_THRESHOLDS))
+    path = tmp_path / 'thresholds.json'
+    path.write_text('{"thresholds": {"euclidean": 41.5, "cosine": -1, "manhattan": 3}}')
+    assert face_matcher.load_thresholds(str(path)) == {'euclidean': 41.5}
+    assert FaceMatcher('euclidean').threshold == 41.5
+    assert face_matcher.load_thresholds(str(tmp_path / 'missing.json')) == {}
+
+
+def _brute_force_assignment(cost):
+    """أقل مجموع تكلفة لتعيين كامل للبعد الأصغر بتجربة كل التباديل"""
+    cost = np.asarray(cost, dtype=np.float64)
+    flipped = cost.shape[0] > cost.shape[1]
+    if flipped:
+        cost = cost.T
+    rows = np.arange(cost.shape[0])
+    return min(cost[rows, list(cols)].sum() for cols in itertools.permutations(range(cost.shape[1]), len(rows)))
+
+
+def _check_assignment(cost, rows, cols):
+    assert len(rows) == len(cols) == min(cost.shape)
+    assert len(set(rows.tolist())) == len(rows) and len(set(cols.tolist())) == len(cols)
+    assert list(rows) == sorted(rows)
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 3), (5, 5), (6, 6), (2, 5), (3, 7), (5, 2), (7, 4)])
+def test_linear_assignment_matches_brute_force(shape):
+    rng = np.random.default_rng(sum(shape))
+    for trial in range(20):
+        # أعداد صحيحة صغيرة في نصف المحاولات لاختبار التعادل
+        cost = rng.integers(0, 4, size=shape).astype(float) if trial % 2 else rng.random(shape) * 100
+        rows, cols = linear_assignment(cost)
+        _check_assignment(cost, rows, cols)
+        assert cost[rows, cols].sum() == pytest.approx(_brute_force_assignment(cost))
+
+
+def test_linear_assignment_empty():
+    for shape in ((0, 3), (3, 0), (0, 0)):
+        rows, cols = linear_assignment(np.empty(shape))
+        assert rows.size == cols.size == 0
+
+
+def _best_valid_matching(cost, threshold):
+    """أكبر عدد من الأزواج المسموحة (التكلفة ≤ الحد) ثم أقل مجموع، بالتجربة الكاملة"""
+    faces, students = cost.shape
+    best = (0, 0.0)
+    for cols in itertools.permutations(list(range(students)) + [None] * faces, faces):
+        pairs = [(face, col) for face, col in enumerate(cols) if col is not None and cost[face, col] <= threshold]
+        if len({col for _, col in pairs}) < len(pairs):
+            continue
+        key = (len(pairs), -sum(cost[face, col] for face, col in pairs))
+        best = max(best, key)
+    return best[0], -best[1]
+
+
+@pytest.mark.parametrize('shape', [(3, 3), (4, 2), (2, 5), (5, 4)])
+def test_padded_assignment_maximizes_valid_matches(shape):
+    """
+    التكلفة المحجوبة (فوق الحد) تُستبدل بقيمة كبيرة كما في _assign_candidates:
+    الحل يعطي أكبر عدد من التطابقات الصالحة ثم أقل مجموع لها
+    """
+    rng = np.random.default_rng(shape[0] * 10 + shape[1])
+    threshold = 50.0
+    for _ in range(15):
+        cost = rng.random(shape) * 100
+        blocked = cost > threshold
+        padded = np.where(blocked, float(cost.max()) + threshold + 1.0, cost)
+        rows, cols = linear_assignment(padded)
+        _check_assignment(padded, rows, cols)
+        valid = ~blocked[rows, cols]
+        count, total = _best_valid_matching(cost, threshold)
+        assert valid.sum() == count
+        assert cost[rows[valid], cols[valid]].sum() == pytest.approx(total)
+
+
+def test_greedy_assignment():
+    cost = np.array([[1.0, 2.0, 9.0],
+                     [1.5, 8.0, 9.0],
+                     [7.0, 3.0, 60.0]])
+    rows, cols = greedy_assignment(cost, threshold=50.0)
+    assert sorted(zip(rows.tolist(), cols.tolist())) == [(0, 0), (1, 2), (2, 1)]
+    # الحد يمنع الأزواج البعيدة حتى لو بقي صف بدون تعيين
+    rows, cols = greedy_assignment(cost, threshold=5.0)
+    assert sorted(zip(rows.tolist(), cols.tolist())) == [(0, 0), (2, 1)]
+
+    rng = np.random.default_rng(7)
+    for shape in ((6, 3), (3, 6), (5, 5)):
+        cost = rng.random(shape)
+        rows, cols = greedy_assignment(cost)
+        _check_assignment(cost, np.sort(rows), cols)
+    rows, cols = greedy_assignment(np.empty((0, 3)))
+    assert rows.size == cols.size == 0
+
+
+@pytest.mark.parametrize('assignment', ['greedy', 'optimal'])
+def test_frame_never_assigns_a_student_twice(assignment):
+    """
+    وجوه متعددة قريبة من نفس الطالب (أو من طالب متعدد البصمات): كل طالب لوجه واحد
+    على الأكثر، وبقية الوجوه للمرشح التالي أو بدون تطابق
+    """
+    rng = np.random.default_rng(8)
+    gallery = rng.normal(scale=20.0, size=(30, 128)).astype(np.float32)
+    faces = np.concatenate([gallery[[0, 0, 0, 1]] + rng.normal(scale=0.5, size=(4, 128)),
+                            gallery[[2, 2]] + rng.normal(scale=0.5, size=(2, 128))]).astype(np.float32)
+    # الطالب 2 متعدد البصمات: إحداها قريبة جداً من الوجه الأخير
+    templates = {2: np.stack([gallery[2] + 30.0, faces[-1]])}
+    matcher = FaceMatcher('euclidean', threshold=50.0)
+    students = [{'id': f's{i}', 'full_name': f'n{i}'} for i in range(30)]
+
+    matches, matched_faces, best = FaceRecognitionService._assign_candidates(
+        [[i, 0, 10, 10] for i in range(len(faces))],
+        faces,
+        lambda queries, k: matcher.search(queries, gallery, k=k),
+        lambda rows: gallery[rows],
+        students.__getitem__,
+        matcher,
+        assignment,
+        templates.get
+    )
+    ids = [match['student_id'] for match in matches]
+    assert len(ids) == len(set(ids))
+    assert set(ids) == {'s0', 's1', 's2'}
+    assert len(matched_faces) == 3
+    assert all(match['distance'] <= matcher.threshold for match in matches)
+    assert len(best) == len(faces)
@@ -0,0 +1,131 @@
+"""
+اختبار البحث في جزء المعرض (_sharded_search): كل الاستعلامات تتطابق داخل الجزء
+بدون رجوع، استعلام واحد لا يتطابق فيرجع للمعرض كاملاً، ونتيجة الرجوع لا تكرر طالباً
+(في مرشحي الاستعلام الواحد ولا في تعيين الوجوه المتعددة)
+
+التشغيل:
+    python -m pytest -q test_face_shards.py
+"""
+
+import numpy as np
+import pytest
+
+import face_recognition_service
+from face_gallery import in_shard, shard_key
+from face_matcher import FaceMatcher
+from face_metrics import FaceMetrics
+from face_recognition_service import FaceRecognitionService
+
+SHARD = shard_key(stage='1')
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = FaceMetrics(directory='')
+    monkeypatch.setattr(face_recognition_service, 'face_metrics', metrics)
+    return metrics
+
+
+@pytest.fixture
+def roster():
+    # بصمات متباعدة (المسافة بين طالبين ~50) والمرحلتان بالتناوب
+    matrix = np.random.default_rng(0).normal(scale=3.0, size=(12, 128)).astype(np.float32)
+    students = [{'id': f's{i}', 'full_name': f'student {i}', 'stage': str(i % 2 + 1)} for i in range(12)]
+    return students, matrix
+
+
+def _queries(matrix, rows, seed=1):
+    return matrix[rows] + np.random.default_rng(seed).normal(scale=0.1, size=(len(rows), 128)).astype(np.float32)
+
+
+def _search(roster, matcher, state):
+    """بحث الجزء (المرحلة 1) مع رجوع للقائمة كاملة، وعدد مرات البحث في القائمة كاملة"""
+    students, matrix = roster
+    rows = np.array([row for row, student in enumerate(students) if in_shard(student, SHARD)], dtype=np.intp)
+    full = FaceRecognitionService._roster_search(matrix, None, matcher, None)
+    calls = []
+
+    def global_search(queries, k):
+        calls.append(k)
+        return full(queries, k)
+
+    search = FaceRecognitionService._sharded_search(
+        SHARD, FaceRecognitionService._roster_search(matrix, None, matcher, None, rows), global_search,
+        len(rows), len(students), matcher, state
+    )
+    return search, full, calls
+
+
+def _counter(metrics, name, **labels):
+    return sum(value for counter, counter_labels, value in metrics.snapshot()['counters']
+               if counter == name and set(labels.items()) <= {tuple(label) for label in counter_labels})
+
+
+def test_every_query_hits_inside_shard(roster, metrics):
+    students, matrix = roster
+    state = {'shard_size': 6}
+    search, _, calls = _search(roster, FaceMatcher(threshold=10.0), state)
+
+    rows, distances = search(_queries(matrix, [0, 2, 4]), 3)
+    assert not state.get('fallback') and calls == []
+    # أرقام الصفوف في القائمة كاملة، وكلها من الجزء
+    assert rows[:, 0].tolist() == [0, 2, 4]
+    assert all(in_shard(students[row], SHARD) for row in rows.ravel().tolist())
+    assert np.all(distances[:, 0] <= 10.0)
+
+    assert _counter(metrics, 'face_shard_searches_total', result='shard') == 1
+    assert _counter(metrics, 'face_shard_searches_total', result='fallback') == 0
+    assert _counter(metrics, 'face_shard_rows_total', scope='shard') == 6 * 3
+    assert _counter(metrics, 'face_shard_rows_total', scope='saved') == 6 * 3
+
+
+def test_one_query_misses_and_falls_back(roster, metrics):
+    _, matrix = roster
+    state = {'shard_size': 6}
+    matcher = FaceMatcher(threshold=10.0)
+    search, full, calls = _search(roster, matcher, state)
+
+    # الطالب s3 من المرحلة 2: أقرب مرشح له في الجزء أبعد من الحد
+    queries = _queries(matrix, [0, 3, 4])
+    rows, distances = search(queries, 3)
+    assert state['fallback'] and calls == [3]
+    expected_rows, expected_distances = full(queries, 3)
+    assert np.array_equal(rows, expected_rows)
+    assert np.allclose(distances, expected_distances)
+    assert rows[:, 0].tolist() == [0, 3, 4]
+
+    assert _counter(metrics, 'face_shard_searches_total', result='fallback') == 1
+    assert _counter(metrics, 'face_shard_rows_total', scope='fallback') == 12 * 3
+    assert _counter(metrics, 'face_shard_rows_total', scope='saved') == 0
+
+
+@pytest.mark.parametrize('assignment', ['greedy', 'optimal'])
+def test_fallback_never_returns_a_student_twice(roster, metrics, assignment):
+    students, matrix = roster
+    state = {'shard_size': 6}
+    matcher = FaceMatcher(threshold=10.0)
+    search, _, _ = _search(roster, matcher, state)
+    faces = [0, 3, 4, 7]
+    queries = _queries(matrix, faces)
+
+    rows, _ = search(queries, len(students))
+    assert state['fallback']
+    for found in rows.tolist():
+        assert len(found) == len(set(found))
+
+    matches, matched_faces, _ = FaceRecognitionService._assign_candidates(
+        [[i, i, 1, 1] for i in range(len(faces))], queries, search,
+        lambda rows: matrix[rows], lambda row: students[row], matcher, assignment
+    )
+    ids = [match['student_id'] for match in matches]
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == sorted(f's{i}' for i in faces)
+    assert matched_faces == set(range(len(faces)))
+
+    result = {'matches': matches}
+    FaceRecognitionService._shard_result(result, SHARD, state,
+                                         lambda match: in_shard(match, SHARD))
+    assert result['fallback'] and result['shard'] == {'stage': '1'}
+    assert {match['student_id']: match['matched_in'] for match in matches} == {
+        's0': 'shard', 's3': 'global', 's4': 'shard', 's7': 'global'
+    }
@@ -0,0 +1,76 @@
+"""
+اختبار مجموعة خيوط الكشف (face_workers.DetectionPool): السعة = الخيوط + الطابور،
+الرفض الفوري بـ PoolSaturated عند الامتلاء مع تقدير retry_after، وتحرير الأماكن
+بعد انتهاء المهام أو إلغائها عند الإغلاق، ورد 429 مع Retry-After من نقاط الوجه
+
+التشغيل:
+    python -m pytest -q test_face_workers.py
+"""
+
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from face_workers import DetectionPool, PoolSaturated
+
+
+@pytest.fixture
+def saturated():
+    """مجموعة بخيطين وطابور واحد، كل أماكنها مشغولة بمهام تنتظر release"""
+    pool = DetectionPool(max_workers=2, max_queue=1)
+    release = threading.Event()
+    futures = [pool.submit(release.wait, 5) for _ in range(3)]
+    yield pool, release, futures
+    release.set()
+    pool.shutdown()
+
+
+def test_saturated_pool_rejects_with_retry_after(saturated):
+    pool, release, futures = saturated
+    assert pool.pending == 3
+
+    with pytest.raises(PoolSaturated) as error:
+        pool.submit(lambda: None)
+    assert error.value.retry_after >= 1
+    # الرفض لا يحجز مكاناً
+    assert pool.pending == 3
+
+    # متوسط زمن مهمة طويل يزيد التقدير: 3 مهام × 4 ثوانٍ / خيطان
+    pool._avg_seconds = 4.0
+    with pytest.raises(PoolSaturated) as error:
+        pool.run(lambda: None)
+    assert error.value.retry_after == 6
+
+    release.set()
+    assert all(future.result(5) for future in futures)
+    # بعد انتهاء المهام تتحرر الأماكن (التحرير في done callback بعد النتيجة)
+    deadline = time.monotonic() + 5
+    while pool.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.pending == 0
+    assert pool.run(lambda: 'done') == 'done'
+
+
+def test_shutdown_cancels_queued_tasks_and_frees_slots(saturated):
+    pool, release, futures = saturated
+    # المهمة الثالثة في الطابور تُلغى، والإلغاء يحرر مكانها دون تعارض على القفل
+    pool.shutdown()
+    assert futures[2].cancelled()
+    assert pool.pending == 2
+    release.set()
+    assert futures[0].result(5) and futures[1].result(5)
+
+
+def test_busy_response_from_endpoint(saturated, monkeypatch):
+    pool, _, _ = saturated
+    pool._avg_seconds = 2.0
+    monkeypatch.setattr(app_module, 'detection_pool', pool)
+    response = app_module.app.test_client().post('/api/face/detect-only',
+                                                 json={'image': 'data:image/jpeg;base64,AA=='})
+    assert response.status_code == 429
+    data = response.get_json()
+    assert data['success'] is False and data['error'] == 'busy'
+    assert data['retry_after'] == 3
+    assert response.headers['Retry-After'] == '3'
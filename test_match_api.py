@@ -0,0 +1,97 @@
+"""
+اختبار التحقق من معاملات /api/face/match-attendance و /api/face/galleries: القيم
+غير الصالحة (top_k، nprobe، إعدادات الفهرس) ترجع 400 بالشكل
+{'success': False, 'message': ...} بدلاً من 500، و top_k الصالح يُحصر بعدد الطلاب
+
+التشغيل:
+    python -m pytest -q test_match_api.py
+"""
+
+import pytest
+
+import app as app_module
+from face_gallery import GalleryRegistry
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """معاملات المطابقة المرسلة للخدمة (بدون كشف وجه فعلي)"""
+    calls = []
+
+    def match(image, students, **params):
+        calls.append(params)
+        return {'success': False, 'message': 'no face'}
+
+    monkeypatch.setattr(app_module.face_service, 'match_face_with_students', match)
+    return calls
+
+
+def _students(count):
+    return [{'id': f's{i}', 'full_name': f'student {i}', 'embedding': [0.1 * i] * 128} for i in range(count)]
+
+
+@pytest.mark.parametrize('top_k', ['abc', 0, -3, 2.5, True, [5], {'k': 1}, '1e3'])
+def test_invalid_top_k(client, calls, top_k):
+    response = client.post('/api/face/match-attendance',
+                           json={'image': 'data:image/jpeg;base64,AA==', 'students': _students(3), 'top_k': top_k})
+    assert response.status_code == 400
+    data = response.get_json()
+    assert data['success'] is False and 'top_k' in data['message']
+    assert calls == []
+
+
+@pytest.mark.parametrize('top_k, expected', [(None, 3), ('2', 2), (1, 1), (50, 3)])
+def test_top_k_is_clamped_to_students(client, calls, top_k, expected):
+    payload = {'image': 'data:image/jpeg;base64,AA==', 'students': _students(3), 'record': False}
+    if top_k is not None:
+        payload['top_k'] = top_k
+    response = client.post('/api/face/match-attendance', json=payload)
+    assert response.status_code == 200
+    assert calls[0]['top_k'] == expected
+
+
+@pytest.mark.parametrize('nprobe', ['abc', 0, -1, 1.5, [2]])
+def test_invalid_nprobe(client, nprobe):
+    response = client.post('/api/face/match-attendance',
+                           json={'image': 'data:image/jpeg;base64,AA==', 'gallery_id': 'g', 'nprobe': nprobe})
+    assert response.status_code == 400
+    data = response.get_json()
+    assert data['success'] is False and 'nprobe' in data['message']
+
+
+def test_nprobe_from_query_string(client, monkeypatch):
+    calls = []
+
+    def match(image, gallery_id, **params):
+        calls.append(params)
+        return {'success': False, 'message': 'no face'}
+
+    monkeypatch.setattr(app_module.face_service, 'match_face_with_gallery', match)
+    response = client.post('/api/face/match-attendance?gallery_id=g&nprobe=4&record=false',
+                           data=b'\xff\xd8', content_type='image/jpeg')
+    assert response.status_code == 200
+    assert calls[0]['nprobe'] == 4
+    assert client.post('/api/face/match-attendance?gallery_id=g&nprobe=x',
+                       data=b'\xff\xd8', content_type='image/jpeg').status_code == 400
+
+
+@pytest.mark.parametrize('index', [True, 'ivf', ['ivf'], 3, {'type': 'hnsw'}, {'nlist': 'many'},
+                                   {'nlist': 0}, {'nprobe': 2.5}, {'unknown': 1}])
+def test_invalid_gallery_index(client, monkeypatch, tmp_path, index):
+    monkeypatch.setattr(app_module.face_service, 'galleries', GalleryRegistry(str(tmp_path)))
+    response = client.post('/api/face/galleries', json={'students': _students(3), 'index': index})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_gallery_index_accepted(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module.face_service, 'galleries', GalleryRegistry(str(tmp_path)))
+    response = client.post('/api/face/galleries',
+                           json={'students': _students(3), 'index': {'type': 'ivf', 'nlist': 2, 'nprobe': 1}})
+    assert response.status_code == 200
+    assert response.get_json()['index']['nlist'] == 2
@@ -0,0 +1,138 @@
+"""
+اختبار قائمة الطلاب بالإصدارات (student_roster) عبر /api/students: أرقام الإصدار
+وعلامات الحذف، ETag ورد 304، التغييرات منذ إصدار (since)، الترقيم بالمؤشر،
+ورموز الخطأ الموثقة للقيم غير الصالحة أو القديمة
+
+التشغيل:
+    python -m pytest -q test_student_roster.py
+"""
+
+import json
+
+import pytest
+
+import app as app_module
+from student_roster import RosterStore
+
+
+@pytest.fixture
+def roster(tmp_path, monkeypatch):
+    store = RosterStore(str(tmp_path / 'roster.sqlite3'))
+    monkeypatch.setattr(app_module, 'roster_store', store)
+    return store
+
+
+@pytest.fixture
+def client(roster):
+    return app_module.app.test_client()
+
+
+def _student(i, **fields):
+    return {'id': f's{i}', 'full_name': f'student {i}', 'stage': '1', 'face_embedding': [0.1 * i] * 4, **fields}
+
+
+def _get(client, query='', **headers):
+    response = client.get(f'/api/students{query}', headers=headers)
+    return response, (json.loads(response.get_data(as_text=True)) if response.status_code != 304 else None)
+
+
+def test_versions_and_tombstones(roster):
+    assert roster.upsert([_student(i) for i in range(3)]) == {'version': 3, 'changed': 3, 'deleted': 0}
+    # نفس البيانات لا تغير الإصدار
+    assert roster.upsert([_student(1)])['version'] == 3
+    assert roster.upsert([_student(1, stage='2')]) == {'version': 4, 'changed': 1, 'deleted': 0}
+    assert roster.delete(['s0', 'missing']) == {'version': 5, 'changed': 0, 'deleted': 1}
+    assert roster.delete(['s0'])['version'] == 5
+    # القائمة كاملة: من ليس فيها يُحذف
+    assert roster.upsert([_student(1, stage='2'), _student(7)], replace=True) == {
+        'version': 7, 'changed': 1, 'deleted': 1
+    }
+    with pytest.raises(ValueError):
+        roster.upsert([{'full_name': 'no id'}])
+
+
+def test_full_load_and_etag(client):
+    response = client.post('/api/students', json={'students': [_student(i) for i in range(3)]})
+    assert response.get_json() == {'success': True, 'version': 3, 'changed': 3, 'deleted': 0}
+
+    response, data = _get(client)
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"roster-3"'
+    assert response.headers['X-Roster-Version'] == '3'
+    assert data['version'] == 3 and data['since'] == 0 and data['next_cursor'] is None
+    assert [s['id'] for s in data['students']] == ['s0', 's1', 's2']
+    assert data['students'][1] == _student(1)
+
+    response, data = _get(client, **{'If-None-Match': '"roster-3"'})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == '"roster-3"'
+
+    client.post('/api/students', json={'students': [_student(1, full_name='renamed')]})
+    response, data = _get(client, **{'If-None-Match': '"roster-3"'})
+    assert response.status_code == 200
+    assert data['version'] == 4
+
+
+def test_since_returns_changes_and_tombstones(client):
+    client.post('/api/students', json={'students': [_student(i) for i in range(4)]})
+    response = client.post('/api/students', json={'students': [_student(1, stage='2')], 'deleted': ['s2']})
+    assert response.get_json() == {'success': True, 'version': 6, 'changed': 1, 'deleted': 1}
+
+    _, data = _get(client, '?since=4')
+    assert data['version'] == 6 and data['since'] == 4
+    assert [s['id'] for s in data['students']] == ['s1']
+    assert data['students'][0]['stage'] == '2'
+    assert data['deleted'] == ['s2']
+
+    # التحميل الكامل لا يعيد المحذوفين
+    _, data = _get(client)
+    assert sorted(s['id'] for s in data['students']) == ['s0', 's1', 's3']
+    assert data['deleted'] == []
+
+    # لا تغيير منذ آخر إصدار
+    _, data = _get(client, '?since=6')
+    assert data['students'] == [] and data['deleted'] == []
+
+
+def test_cursor_paging(client):
+    client.post('/api/students', json={'students': [_student(i) for i in range(7)]})
+    client.post('/api/students', json={'deleted': ['s3']})
+
+    for since in (0, 2):
+        seen, deleted, cursor, pages = [], [], None, 0
+        while True:
+            _, data = _get(client, f'?since={since}&limit=2' + (f'&cursor={cursor}' if cursor else ''))
+            assert len(data['students']) + len(data['deleted']) <= 2
+            seen += [s['id'] for s in data['students']]
+            deleted += data['deleted']
+            pages += 1
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        _, everything = _get(client, f'?since={since}')
+        assert seen == [s['id'] for s in everything['students']]
+        assert deleted == everything['deleted']
+        assert pages > 1
+
+
+@pytest.mark.parametrize('query, status', [
+    ('?since=999', 410),
+    ('?cursor=999', 410),
+    ('?since=abc', 400),
+    ('?since=-1', 400),
+    ('?cursor=x', 400),
+    ('?limit=ten', 400),
+])
+def test_invalid_or_stale_parameters(client, query, status):
+    client.post('/api/students', json={'students': [_student(i) for i in range(3)]})
+    response, data = _get(client, query)
+    assert response.status_code == status
+    assert data['success'] is False
+    if status == 410:
+        assert data['error'] == 'version_gone' and data['version'] == 3
+
+
+def test_invalid_post(client):
+    assert client.post('/api/students', json={'students': 'nope'}).status_code == 400
+    assert client.post('/api/students', json={'students': [{'full_name': 'no id'}]}).status_code == 400